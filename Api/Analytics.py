@@ -0,0 +1,87 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from Packages.AnalyticsQuery import AnalyticsQuery
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+import logging
+import json
+
+router = APIRouter(prefix="/analytics")
+analytics = AnalyticsQuery.from_env()
+
+logger = logging.getLogger("Analytics")
+
+NDJSON = "application/x-ndjson"
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, default=_default)
+
+
+def respond(query, fmt: str, limit: int, offset: int):
+    """
+    Runs a cached analytics query and returns one page of its rows, as a JSON
+    document or streamed as NDJSON (one row per line).
+    """
+    try:
+        rows = query()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Analytics query failed: {e}")
+        raise HTTPException(status_code=503, detail="Analytics backends unavailable")
+
+    page = rows[offset:offset + limit]
+    if fmt == "ndjson":
+        return StreamingResponse((_dumps(row) + "\n" for row in page), media_type=NDJSON)
+
+    next_offset = offset + limit if offset + limit < len(rows) else None
+    body = {"rows": page, "total": len(rows), "offset": offset, "next_offset": next_offset,
+            "watermark": analytics.watermark()}
+    return Response(_dumps(body), media_type="application/json")
+
+
+# Plain (non-async) handlers run in FastAPI's threadpool, so blocking database
+# calls never stall the WebSocket event loop
+@router.get("/series")
+def series(location: str,
+           start: Optional[datetime] = None,
+           end: Optional[datetime] = None,
+           bucket: int = Query(60, gt=0, description="Bucket size in seconds"),
+           format: str = Query("json", pattern="^(json|ndjson)$"),
+           limit: int = Query(1000, gt=0, le=10000),
+           offset: int = Query(0, ge=0)):
+    return respond(lambda: analytics.series(location, start, end, bucket), format, limit, offset)
+
+
+@router.get("/top")
+def top(level: str = Query("city", pattern="^(city|province)$"),
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = Query(10, gt=0, le=1000),
+        format: str = Query("json", pattern="^(json|ndjson)$")):
+    return respond(lambda: analytics.top_congested(level, start, end, limit), format, limit, 0)
+
+
+@router.get("/latest")
+def latest(min_lon: float, min_lat: float, max_lon: float, max_lat: float,
+           lookback_minutes: int = Query(60, gt=0),
+           format: str = Query("json", pattern="^(json|ndjson)$"),
+           limit: int = Query(1000, gt=0, le=10000),
+           offset: int = Query(0, ge=0)):
+    return respond(lambda: analytics.latest_in_bbox(min_lon, min_lat, max_lon, max_lat, lookback_minutes),
+                   format, limit, offset)
+
+
+@router.get("/cache")
+def cache_stats():
+    return analytics.cache.stats()
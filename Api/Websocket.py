@@ -1,46 +1,308 @@
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import PlainTextResponse
 from Packages.KafkaService import KafkaService
+from Packages.KafkaPublisher import KafkaPublisher, PublisherBusy
+from Packages.EventCodec import EventCodec, JSON, MSGPACK, COMPACT
+from Packages.SubscriptionHub import SubscriptionHub, Subscription, EnrichedFeed, FIELDS, DROP_OLDEST
+from Packages.Metrics import REGISTRY, CONTENT_TYPE, SIZE_BUCKETS, sampled_log, toggle_profiler
+from Api.Analytics import router as analytics_router
+import time
+import os
+import asyncio
 import logging
 import json
 import ast
+import signal
 
 app = FastAPI()
+app.include_router(analytics_router)
 producer = KafkaService.get_producer()
+publisher = KafkaPublisher.from_env(producer)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("WS→Kafka")
 
 TOPIC = "ws_incoming"
+MAX_BATCH_EVENTS = int(os.getenv("WS_MAX_BATCH_EVENTS", "5000"))
+LITERAL_EVAL_MAX_CHARS = 4096
+SUBSCRIBER_QUEUE = int(os.getenv("WS_SUBSCRIBER_QUEUE", "1000"))
+# Records are keyed by stream_id so each camera's events stay on one partition, in order
+KEY_BY_STREAM = os.getenv("KAFKA_KEY_BY_STREAM", "true").lower() == "true"
+# original keeps the frame's encoding; compact re-encodes events into the binary format
+VALUE_FORMAT = os.getenv("KAFKA_VALUE_FORMAT", "original").lower()
+
+# Live fan-out of enriched events to /ws/subscribe clients
+hub = SubscriptionHub(cell_degrees=float(os.getenv("WS_SUBSCRIBE_CELL_DEGREES", "0.1")))
+feed = None
+# Anomaly alerts from ALERTS_TOPIC, pushed to /ws/alerts clients
+alerts_hub = SubscriptionHub(cell_degrees=float(os.getenv("WS_SUBSCRIBE_CELL_DEGREES", "0.1")))
+alerts_feed = None
+
+FRAMES = REGISTRY.counter("ws_frames_total", "WebSocket frames received by outcome", ["content_type", "result"])
+FRAME_EVENTS = REGISTRY.histogram("ws_frame_events", "Events per accepted frame", buckets=SIZE_BUCKETS)
+PARSE_SECONDS = REGISTRY.histogram("ws_parse_seconds", "Time to parse one frame")
+PUBLISH_SECONDS = REGISTRY.histogram("ws_publish_seconds", "Time from accepting a frame to its broker acknowledgement", ["result"])
+REGISTRY.gauge("ws_publisher_pending", "Frames queued or awaiting broker acknowledgement").track(lambda: publisher.pending)
+REGISTRY.gauge("ws_subscribers", "Connected /ws/subscribe clients").track(lambda: len(hub.subscriptions))
+REGISTRY.gauge("ws_alert_subscribers", "Connected /ws/alerts clients").track(lambda: len(alerts_hub.subscriptions))
+
+
+def observe_delivery(delivery: asyncio.Future, started: float):
+    delivery.add_done_callback(lambda f: PUBLISH_SECONDS.observe(
+        time.perf_counter() - started, result="error" if f.cancelled() or f.exception() else "ok"))
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.on_event("startup")
+def register_profiler_signal():
+    # The API has no profiling endpoint; SIGUSR2 toggles the sampler as on workers
+    signal.signal(signal.SIGUSR2, toggle_profiler)
+
+
+@app.on_event("shutdown")
+def shutdown_publisher():
+    publisher.close()
+    if feed is not None:
+        feed.stop()
+    if alerts_feed is not None:
+        alerts_feed.stop()
+
+
+async def send_ack(websocket: WebSocket, seq: int, delivery: asyncio.Future):
+    """
+    Reports the broker acknowledgement (or failure) for one message back to
+    the client. A frame split into several records is acked with each of them.
+    """
+    try:
+        metadata = await delivery
+        if isinstance(metadata, list):
+            records = [{"partition": m.partition, "offset": m.offset} for m in metadata]
+            await websocket.send_text(json.dumps({"ack": seq, "records": records}))
+            return
+        await websocket.send_text(json.dumps({"ack": seq, "partition": metadata.partition, "offset": metadata.offset}))
+    except Exception as e:
+        try:
+            await websocket.send_text(json.dumps({"nack": seq, "error": str(e)}))
+        except Exception:
+            pass
+
+
+def parse_text(msg: str):
+    """Returns ``(events, payload)`` for a text frame: one event, a JSON array or NDJSON."""
+    try:
+        return EventCodec.parse_text_frame(msg)
+    except (json.JSONDecodeError, ValueError) as e:
+        # Legacy clients send single Python dict literals (single quotes).
+        # literal_eval is slow and unbounded on untrusted input, so it only
+        # runs on small frames.
+        if len(msg) > LITERAL_EVAL_MAX_CHARS:
+            raise ValueError(f"Invalid message format: {e}")
+        data = ast.literal_eval(msg)
+        if not isinstance(data, dict):
+            raise ValueError("Invalid message format: expected an object")
+        try:
+            payload = json.dumps(data).encode("utf-8")
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"Invalid message format: {error}")
+        sampled_log(logging.INFO, "literal-eval", "Parsed message using ast.literal_eval (Python dict format)", logger)
+        return [data], payload
+
+
+def to_records(events, payload, content_type):
+    """
+    Kafka records ``(key, value, headers)`` for one frame.
+
+    With KAFKA_KEY_BY_STREAM the frame is split per stream_id and each part
+    keyed by it. A frame that stays one record in its own encoding is
+    forwarded as received. Otherwise events are encoded in the frame's
+    encoding, or compact with KAFKA_VALUE_FORMAT=compact; events the compact
+    schema cannot carry go out as JSON for the consumer to reject.
+    """
+    target = COMPACT if VALUE_FORMAT == "compact" else content_type
+    groups = EventCodec.group_by_stream(events) if KEY_BY_STREAM else [(None, events)]
+    if len(groups) == 1 and target == content_type:
+        return [(groups[0][0], payload, EventCodec.headers(content_type))]
+
+    records = []
+    for key, group in groups:
+        try:
+            value, encoding = EventCodec.encode(group, target), target
+        except (ValueError, TypeError):
+            value, encoding = json.dumps(group if len(group) != 1 else group[0], default=str).encode("utf-8"), JSON
+        records.append((key, value, EventCodec.headers(encoding)))
+    return records
+
+
+async def publish_frame(records) -> asyncio.Future:
+    """
+    Queues every record of a frame, or none of them when the publisher is
+    busy, so a client retrying a rejected frame cannot duplicate part of it.
+    The result resolves once all records are acknowledged.
+    """
+    deliveries = await publisher.publish_many(TOPIC, records)
+    return deliveries[0] if len(deliveries) == 1 else asyncio.gather(*deliveries)
+
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logger.info("Client connected")
 
+    # Clients opt in to per-message delivery acks with /ws?ack=1
+    want_ack = websocket.query_params.get("ack") in ("1", "true")
+    # Binary frames are negotiated per connection with /ws?encoding=msgpack
+    encoding = websocket.query_params.get("encoding", "json").lower()
+    content_type = MSGPACK if encoding == "msgpack" else JSON
+    if not EventCodec.supports(content_type):
+        await websocket.send_text(json.dumps({"error": f"Unsupported encoding: {encoding}"}))
+        await websocket.close(code=1003)
+        return
+    seq = 0
+
     try:
         while True:
             # Client sends message → WS receives it
-            msg = await websocket.receive_text()
+            seq += 1
+            if content_type == MSGPACK:
+                payload = await websocket.receive_bytes()
+            else:
+                msg = await websocket.receive_text()
+            started = time.perf_counter()
+            try:
+                if content_type == MSGPACK:
+                    events = EventCodec.parse_binary_frame(payload)
+                else:
+                    events, payload = parse_text(msg)
+            except (ValueError, SyntaxError, TypeError) as e:
+                FRAMES.inc(content_type=content_type, result="invalid")
+                sampled_log(logging.ERROR, "ws-parse", f"Failed to parse message: {e}", logger)
+                await websocket.send_text(json.dumps({"error": "Invalid message format", "seq": seq}))
+                continue
+            PARSE_SECONDS.observe(time.perf_counter() - started)
+
+            if len(events) > MAX_BATCH_EVENTS:
+                FRAMES.inc(content_type=content_type, result="too_large")
+                await websocket.send_text(json.dumps({"error": "Batch too large", "seq": seq, "max": MAX_BATCH_EVENTS}))
+                continue
+
+            # A frame goes to Kafka as one record per stream, usually as the bytes it
+            # arrived in. The event loop never waits on the broker.
             try:
-                # Try to parse as JSON first (double quotes)
-                data = json.loads(msg)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, try to evaluate as Python dict (single quotes)
-                try:
-                    data = ast.literal_eval(msg)
-                    logger.info("Parsed message using ast.literal_eval (Python dict format)")
-                except (ValueError, SyntaxError) as e:
-                    logger.error(f"Failed to parse message: {e}")
-                    await websocket.send_text(json.dumps({"error": "Invalid message format"}))
-                    continue
-
-            # Send to Kafka
-            producer.send(TOPIC, data)
-            producer.flush()
-            logger.info(f"Sent to Kafka topic '{TOPIC}': {data}")
+                delivery = await publish_frame(to_records(events, payload, content_type))
+            except PublisherBusy:
+                FRAMES.inc(content_type=content_type, result="busy")
+                await websocket.send_text(json.dumps({"error": "busy", "seq": seq}))
+                continue
+            FRAMES.inc(content_type=content_type, result="accepted")
+            FRAME_EVENTS.observe(len(events))
+            observe_delivery(delivery, started)
+
+            if want_ack:
+                asyncio.create_task(send_ack(websocket, seq, delivery))
+            logger.debug(f"Queued {len(events)} events for Kafka topic '{TOPIC}'")
 
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
 
     finally:
         logger.info("Client disconnected")
+
+
+def parse_subscription(params) -> Subscription:
+    """
+    Builds a subscription from query parameters: comma-separated ``city``,
+    ``province`` and ``label`` values, ``bbox=min_lon,min_lat,max_lon,max_lat``
+    and ``policy=drop_oldest|coalesce``.
+    """
+    filters = {}
+    for field in FIELDS:
+        values = [v.strip() for v in params.get(field, "").split(",") if v.strip()]
+        if values:
+            filters[field] = values
+
+    bbox = None
+    if params.get("bbox"):
+        try:
+            bbox = tuple(float(v) for v in params["bbox"].split(","))
+        except ValueError:
+            raise ValueError("bbox must be four numbers")
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+
+    return Subscription(filters, bbox, max_queue=SUBSCRIBER_QUEUE, policy=params.get("policy", DROP_OLDEST))
+
+
+async def pump(websocket: WebSocket, subscription: Subscription):
+    """Sends pending events as JSON array frames; while a send is slow, the queue sheds."""
+    while True:
+        frame = await subscription.next_frame()
+        await websocket.send_text(frame.decode("utf-8"))
+
+
+async def serve_subscription(websocket: WebSocket, subscription: Subscription, hub: SubscriptionHub):
+    """Streams the hub's matching events to one client until it disconnects."""
+    hub.subscribe(subscription)
+    logger.info(f"Subscriber connected ({len(hub.subscriptions)} total)")
+    sender = asyncio.create_task(pump(websocket, subscription))
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    except Exception as e:
+        logger.error(f"Subscriber error: {e}")
+    finally:
+        sender.cancel()
+        hub.unsubscribe(subscription)
+        logger.info(f"Subscriber disconnected ({subscription.delivered} delivered, {subscription.dropped} dropped)")
+
+
+@app.websocket("/ws/subscribe")
+async def subscribe_endpoint(websocket: WebSocket):
+    global feed
+    await websocket.accept()
+
+    try:
+        subscription = parse_subscription(websocket.query_params)
+    except ValueError as e:
+        await websocket.send_text(json.dumps({"error": str(e)}))
+        await websocket.close(code=1008)
+        return
+
+    if feed is None:
+        feed = EnrichedFeed.from_env(hub, asyncio.get_running_loop())
+        if feed is None:
+            await websocket.send_text(json.dumps({"error": "Live feed is not configured (ENRICHED_TOPIC)"}))
+            await websocket.close(code=1011)
+            return
+        feed.start()
+
+    await serve_subscription(websocket, subscription, hub)
+
+
+@app.websocket("/ws/alerts")
+async def alerts_endpoint(websocket: WebSocket):
+    """Pushes anomaly alerts, with the same filters as /ws/subscribe."""
+    global alerts_feed
+    await websocket.accept()
+
+    try:
+        subscription = parse_subscription(websocket.query_params)
+    except ValueError as e:
+        await websocket.send_text(json.dumps({"error": str(e)}))
+        await websocket.close(code=1008)
+        return
+
+    if alerts_feed is None:
+        topic = os.getenv("ALERTS_TOPIC")
+        if not topic:
+            await websocket.send_text(json.dumps({"error": "Alerts feed is not configured (ALERTS_TOPIC)"}))
+            await websocket.close(code=1011)
+            return
+        alerts_feed = EnrichedFeed(alerts_hub, topic, asyncio.get_running_loop()).start()
+
+    await serve_subscription(websocket, subscription, alerts_hub)
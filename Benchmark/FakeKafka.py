@@ -0,0 +1,111 @@
+import time
+import threading
+from types import SimpleNamespace
+from kafka.structs import TopicPartition
+
+
+class FakeFuture:
+    """Already-resolved send result with kafka-python's callback interface."""
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def add_callback(self, callback):
+        callback(self.metadata)
+        return self
+
+    def add_errback(self, errback):
+        return self
+
+    def get(self, timeout=None):
+        return self.metadata
+
+
+class FakeTopic:
+    """
+    In-process topic with partitions and offsets, shared by FakeProducer and
+    FakeConsumer. Records carry ``produced_at`` (monotonic) for latency.
+    """
+
+    def __init__(self, name: str, partitions: int = 4):
+        self.name = name
+        self.partitions = [[] for _ in range(partitions)]
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def append(self, value, key=None, headers=None):
+        with self._lock:
+            if key is not None:
+                partition = hash(key) % len(self.partitions)
+            else:
+                partition = self._next % len(self.partitions)
+                self._next += 1
+            records = self.partitions[partition]
+            record = SimpleNamespace(
+                topic=self.name, partition=partition, offset=len(records), key=key,
+                value=value, headers=headers or [], produced_at=time.monotonic()
+            )
+            records.append(record)
+            return record
+
+    def __len__(self):
+        return sum(len(records) for records in self.partitions)
+
+
+class FakeProducer:
+    def __init__(self, topics: dict):
+        self.topics = topics
+
+    def send(self, topic, value=None, key=None, headers=None):
+        record = self.topics[topic].append(value, key, headers)
+        return FakeFuture(SimpleNamespace(topic=topic, partition=record.partition, offset=record.offset))
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class FakeConsumer:
+    """Consumer over a FakeTopic with the subset of the KafkaConsumer API the parser uses."""
+
+    def __init__(self, topic: FakeTopic, group_id: str = "benchmark", max_poll_records: int = 500):
+        self.topic = topic
+        self.config = {"group_id": group_id}
+        self.max_poll_records = max_poll_records
+        self.positions = [0] * len(topic.partitions)
+        self.committed = {}
+        self.closed = False
+
+    def poll(self, timeout_ms=0, max_records=None):
+        budget = max_records or self.max_poll_records
+        batch = {}
+        for partition, records in enumerate(self.topic.partitions):
+            if budget <= 0:
+                break
+            start = self.positions[partition]
+            taken = records[start:start + budget]
+            if taken:
+                batch[TopicPartition(self.topic.name, partition)] = taken
+                self.positions[partition] += len(taken)
+                budget -= len(taken)
+        if not batch and timeout_ms:
+            time.sleep(min(timeout_ms, 10) / 1000)
+        return batch
+
+    def assignment(self):
+        return {TopicPartition(self.topic.name, partition) for partition in range(len(self.topic.partitions))}
+
+    def end_offsets(self, partitions):
+        return {tp: len(self.topic.partitions[tp.partition]) for tp in partitions}
+
+    def position(self, tp):
+        return self.positions[tp.partition]
+
+    def commit(self, offsets=None):
+        for tp, meta in (offsets or {}).items():
+            self.committed[tp] = meta.offset
+
+    def close(self, autocommit=True):
+        self.closed = True
@@ -0,0 +1,86 @@
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeNominatim:
+    """
+    Local stand-in for the Nominatim ``/reverse`` endpoint.
+
+    Every request sleeps ``latency_ms`` plus up to ``jitter_ms`` before
+    answering with a Nominatim-shaped address for the coordinates, so
+    geocoding can be measured without the public API or its rate limit.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 20.0, seed: int = 42):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests = 0
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/reverse"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive like the real service, so connection reuse shows up in benchmarks
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                    delay = fake.latency_ms + fake._random.uniform(0, fake.jitter_ms)
+                time.sleep(delay / 1000)
+
+                query = parse_qs(urlparse(self.path).query)
+                lat = float(query.get("lat", ["0"])[0])
+                lon = float(query.get("lon", ["0"])[0])
+                body = json.dumps({
+                    "display_name": f"Jalan {lat:.3f},{lon:.3f}, Indonesia",
+                    "address": {"city": f"City {round(lat, 1)}", "state": f"Province {round(lon)}"}
+                }).encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-nominatim", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,104 @@
+import json
+import math
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+LABELS = ("Sepi", "Normal", "Ramai", "Padat")
+TYPES = ("TC", "CC")
+
+
+class TrafficGenerator:
+    """
+    Synthetic traffic events shaped like production traffic.
+
+    A fixed set of camera streams sits at fixed coordinates around a few city
+    centres, and stream popularity follows a Zipf distribution, so a handful
+    of hot streams account for most events (the coordinate reuse the
+    geocoding cache relies on). Arrivals alternate between quiet periods and
+    bursts ``burst_factor`` times denser.
+    """
+
+    CENTRES = (
+        (-6.2088, 106.8456),  # Jakarta
+        (-6.5950, 106.8166),  # Bogor
+        (-6.9175, 107.6191),  # Bandung
+        (-7.2575, 112.7521),  # Surabaya
+    )
+
+    def __init__(self, streams: int = 500, seed: int = 42, zipf_s: float = 1.1,
+                 rate_per_second: float = 1000.0, burst_factor: float = 10.0,
+                 burst_probability: float = 0.1, start: datetime = None):
+        self.random = random.Random(seed)
+        self.rate = rate_per_second
+        self.burst_factor = burst_factor
+        self.burst_probability = burst_probability
+        self.clock = start or datetime(2025, 11, 17, 7, 0, tzinfo=timezone.utc)
+
+        self.streams = []
+        for i in range(streams):
+            latitude, longitude = self.random.choice(self.CENTRES)
+            self.streams.append({
+                "stream_id": str(uuid.UUID(int=self.random.getrandbits(128))),
+                "location": f"Simpang {i}",
+                "latitude": round(latitude + self.random.uniform(-0.15, 0.15), 6),
+                "longitude": round(longitude + self.random.uniform(-0.15, 0.15), 6),
+                "estimated_max_people": self.random.randint(10, 200),
+                "type": self.random.choice(TYPES),
+            })
+
+        weights = [1 / math.pow(rank, zipf_s) for rank in range(1, streams + 1)]
+        total = sum(weights)
+        self._cumulative = []
+        running = 0.0
+        for weight in weights:
+            running += weight / total
+            self._cumulative.append(running)
+
+        self._bursting = False
+
+    def _stream(self) -> dict:
+        index = min(self._bisect(self.random.random()), len(self.streams) - 1)
+        return self.streams[index]
+
+    def _bisect(self, value) -> int:
+        lo, hi = 0, len(self._cumulative)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._cumulative[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _advance(self):
+        # Switch between quiet and bursty periods now and then
+        if self.random.random() < self.burst_probability / 100:
+            self._bursting = not self._bursting
+        rate = self.rate * (self.burst_factor if self._bursting else 1.0)
+        self.clock += timedelta(seconds=self.random.expovariate(rate))
+
+    def event(self) -> dict:
+        self._advance()
+        stream = self._stream()
+        total = self.random.randint(0, stream["estimated_max_people"])
+        ratio = total / stream["estimated_max_people"]
+        return {
+            "timestamp": self.clock.isoformat(),
+            "stream_id": stream["stream_id"],
+            "location": stream["location"],
+            "longitude": stream["longitude"],
+            "latitude": stream["latitude"],
+            "total_in_area": total,
+            "estimated_max_people": stream["estimated_max_people"],
+            "label": LABELS[min(int(ratio * len(LABELS)), len(LABELS) - 1)],
+            "type": stream["type"],
+        }
+
+    def events(self, count: int) -> list:
+        return [self.event() for _ in range(count)]
+
+    @staticmethod
+    def encode(events: list) -> list:
+        """JSON bytes per event, as the WebSocket API forwards them to Kafka."""
+        return [json.dumps(event).encode("utf-8") for event in events]
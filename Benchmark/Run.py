@@ -0,0 +1,332 @@
+"""
+End-to-end pipeline benchmark with local stand-ins for Kafka and Nominatim.
+
+    python -m Benchmark.Run --events 20000 --output results.json
+    python -m Benchmark.Run --stages deserialize,pipeline --compare results.json
+
+Every stage reports msgs/sec and p50/p95/p99 latency in milliseconds as JSON,
+so runs can be compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from Benchmark.Generator import TrafficGenerator
+from Benchmark.FakeNominatim import FakeNominatim
+from Benchmark.FakeKafka import FakeTopic, FakeProducer, FakeConsumer
+
+STAGES = ("deserialize", "wire_format", "reverse_geocode", "day_month_year", "postgres_insert", "ws_ingress", "pipeline")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, messages=None):
+    """Throughput and latency percentiles (ms) for one stage."""
+    ordered = sorted(latencies)
+    messages = len(latencies) if messages is None else messages
+    return {
+        "messages": messages,
+        "seconds": round(elapsed, 6),
+        "msgs_per_sec": round(messages / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": _ms(percentile(ordered, 0.50)),
+        "p95_ms": _ms(percentile(ordered, 0.95)),
+        "p99_ms": _ms(percentile(ordered, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 4)
+
+
+def measure(items, operation):
+    """Runs ``operation`` on every item, timing each call."""
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        operation(item)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_deserialize(events, args):
+    from Packages.Parser import KafkaParser
+    topic = FakeTopic("ws_incoming")
+    for value in TrafficGenerator.encode(events):
+        topic.append(value)
+    records = [record for partition in topic.partitions for record in partition]
+    return measure(records, lambda record: list(KafkaParser.decode([record])))
+
+
+def bench_wire_format(events, args):
+    """Record size and decode time of poll-sized batches in each topic encoding."""
+    from Packages.EventCodec import EventCodec, JSON, MSGPACK, COMPACT
+
+    batches = [events[i:i + args.batch_size] for i in range(0, len(events), args.batch_size)]
+    result = {}
+    for content_type in (JSON, MSGPACK, COMPACT):
+        values = [EventCodec.encode(batch, content_type) for batch in batches]
+        stage = measure(values, lambda value: EventCodec.decode(value, content_type))
+        stage["messages"] = len(events)
+        stage["msgs_per_sec"] = round(len(events) / stage["seconds"], 1)
+        stage["latency_unit"] = f"batch of {args.batch_size}"
+        stage["bytes_per_event"] = round(sum(len(v) for v in values) / len(events), 1)
+        result[content_type] = stage
+    return result
+
+
+def bench_reverse_geocode(events, args):
+    from Packages.GeocodingService import GeocodingService
+    from Packages.GeocodingCache import GeocodingCache
+
+    sample = events[:args.geocode_events]
+    with FakeNominatim(latency_ms=args.nominatim_latency_ms, jitter_ms=args.nominatim_jitter_ms) as nominatim:
+        with patch.dict(os.environ, {"GEOCODING_API_URL": nominatim.url, "GEOCODING_BACKEND": "nominatim", "GEOCODING_RATE_LIMIT": "0"}):
+            GeocodingService._cache = GeocodingCache(db_path=None) if args.geocode_cache else None
+            # The HTTP client reads GEOCODING_API_URL once; start from one pointed at the fake server
+            GeocodingService._client = None
+            with patch.dict(os.environ, {"GEOCODING_CACHE_ENABLED": "true" if args.geocode_cache else "false"}):
+                GeocodingService._configured = False
+                result = measure(sample, lambda e: GeocodingService.reverse_geocode(e["latitude"], e["longitude"]))
+            GeocodingService._configured = False
+            GeocodingService._cache = None
+            GeocodingService._client = None
+        result["nominatim_requests"] = nominatim.requests
+    return result
+
+
+def bench_day_month_year(events, args):
+    from Packages.Parser import Parser
+    return measure(events, lambda e: Parser.time_to_day_month_year(e["timestamp"]))
+
+
+def bench_postgres_insert(events, args):
+    """Batched inserts into a real PostgreSQL; only runs with --postgres."""
+    if not args.postgres:
+        return {"skipped": "pass --postgres to write benchmark rows to the configured database"}
+
+    from Packages.Parser import KafkaParser
+    from Packages.Query import QuerySql
+    rows = [KafkaParser.enrich(dict(e), {"city": "Bench", "province": "Bench", "fulladdress": None}) for e in events]
+    batches = [rows[i:i + args.batch_size] for i in range(0, len(rows), args.batch_size)]
+    query = QuerySql()
+    result = measure(batches, query.insert_traffic_data_batch)
+    # Latencies are per batch, throughput per row
+    result["messages"] = len(rows)
+    result["msgs_per_sec"] = round(len(rows) / result["seconds"], 1)
+    result["latency_unit"] = f"batch of {args.batch_size}"
+    return result
+
+
+def bench_ws_ingress(events, args):
+    """Frame parsing plus the non-blocking publish path of the WebSocket API, to broker ack."""
+    from Packages.EventCodec import EventCodec
+    from Packages.KafkaPublisher import KafkaPublisher
+
+    frames = [json.dumps(e) for e in events]
+    publisher = KafkaPublisher(FakeProducer({"ws_incoming": FakeTopic("ws_incoming")}), max_pending=len(frames) + 1)
+
+    async def run():
+        latencies = []
+        started = time.perf_counter()
+        for frame in frames:
+            t0 = time.perf_counter()
+            _, payload = EventCodec.parse_text_frame(frame)
+            await (await publisher.publish("ws_incoming", payload))
+            latencies.append(time.perf_counter() - t0)
+        return summarize(latencies, time.perf_counter() - started)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        publisher.close()
+
+
+def bench_pipeline(events, args):
+    """
+    Events are produced to an in-process topic at ``--rate`` msgs/sec and
+    consumed by ``KafkaParser.consumer_kafka`` with geocoding against the
+    fake Nominatim. Latency runs from produce to the batch landing in the sink.
+    """
+    from Packages import Parser as parser_module
+    from Packages.GeocodingService import GeocodingService
+    from Packages.GeocodingCache import GeocodingCache
+
+    topic = FakeTopic("ws_incoming", partitions=args.partitions)
+    consumer = FakeConsumer(topic, max_poll_records=args.batch_size)
+    produced = {}
+    latencies = []
+    landed = threading.Event()
+
+    class RecordingSink:
+        def __init__(self, pool=None, partitions=None):
+            pass
+
+        def insert_traffic_data_batch(self, rows):
+            now = time.monotonic()
+            for row in rows:
+                produced_at = produced.get((row.get("stream_id"), row.get("timestamp")))
+                if produced_at is not None:
+                    latencies.append(now - produced_at)
+            if len(latencies) >= len(events):
+                landed.set()
+
+    def produce():
+        interval = 1.0 / args.rate if args.rate else 0
+        next_at = time.monotonic()
+        for value, event in zip(TrafficGenerator.encode(events), events):
+            if interval:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_at += interval
+            record = topic.append(value)
+            produced[(event["stream_id"], event["timestamp"])] = record.produced_at
+
+    stop_event = threading.Event()
+    with FakeNominatim(latency_ms=args.nominatim_latency_ms, jitter_ms=args.nominatim_jitter_ms) as nominatim:
+        environment = {
+            "GEOCODING_API_URL": nominatim.url,
+            "GEOCODING_BACKEND": "nominatim",
+            "GEOCODING_RATE_LIMIT": "0",
+            "GEOCODING_CACHE_ENABLED": "true",
+            "TRAFFIC_SINKS": "postgres",
+            "ROLLUP_WINDOWS": "",
+            "ENRICHED_TOPIC": "",
+            "KAFKA_POLL_TIMEOUT_MS": "50",
+        }
+        with patch.dict(os.environ, environment), \
+                patch.object(parser_module.KafkaService, "get_raw_consumer", lambda *a, **k: consumer), \
+                patch.object(parser_module, "QuerySql", RecordingSink), \
+                patch.object(parser_module.PostgresService, "get_pool", lambda: None), \
+                patch.object(parser_module.PartitionManager, "from_env", lambda pool: None):
+            GeocodingService._configured = False
+            GeocodingService._cache = GeocodingCache(db_path=None)
+            GeocodingService._client = None
+            worker = threading.Thread(
+                target=parser_module.KafkaParser.consumer_kafka,
+                args=("ws_incoming",), kwargs={"stop_event": stop_event}, daemon=True
+            )
+            started = time.perf_counter()
+            worker.start()
+            produce()
+            finished = landed.wait(args.timeout)
+            elapsed = time.perf_counter() - started
+            stop_event.set()
+            worker.join(30)
+            GeocodingService._configured = False
+            GeocodingService._cache = None
+            GeocodingService._client = None
+
+    result = summarize(latencies, elapsed)
+    result["target_rate"] = args.rate
+    result["nominatim_requests"] = nominatim.requests
+    if not finished:
+        result["incomplete"] = f"{len(latencies)} of {len(events)} events landed within {args.timeout}s"
+    return result
+
+
+BENCHMARKS = {
+    "deserialize": bench_deserialize,
+    "wire_format": bench_wire_format,
+    "reverse_geocode": bench_reverse_geocode,
+    "day_month_year": bench_day_month_year,
+    "postgres_insert": bench_postgres_insert,
+    "ws_ingress": bench_ws_ingress,
+    "pipeline": bench_pipeline,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Prints throughput and p95 changes against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"{'stage':<18}{'msgs/sec':>14}{'change':>10}{'p95 ms':>12}{'change':>10}", file=sys.stderr)
+    for name, result in current["stages"].items():
+        before = baseline.get("stages", {}).get(name, {})
+        rate, rate_before = result.get("msgs_per_sec"), before.get("msgs_per_sec")
+        p95, p95_before = result.get("p95_ms"), before.get("p95_ms")
+        rate_change = f"{(rate / rate_before - 1) * 100:+.1f}%" if rate and rate_before else "-"
+        p95_change = f"{(p95 / p95_before - 1) * 100:+.1f}%" if p95 and p95_before else "-"
+        print(f"{name:<18}{rate or '-':>14}{rate_change:>10}{p95 or '-':>12}{p95_change:>10}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Traffic pipeline benchmark")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {', '.join(STAGES)}")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--streams", type=int, default=500, help="Distinct camera streams (coordinate reuse)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--geocode-events", type=int, default=2000, help="Events used by the reverse_geocode stage")
+    parser.add_argument("--no-geocode-cache", dest="geocode_cache", action="store_false")
+    parser.add_argument("--nominatim-latency-ms", type=float, default=20.0)
+    parser.add_argument("--nominatim-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--postgres", action="store_true", help="Run postgres_insert against the configured database")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=5000.0, help="Pipeline produce rate in msgs/sec (0 = all at once)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Pipeline completion timeout in seconds")
+    parser.add_argument("--output", help="Write results JSON to this file instead of stdout")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    return parser.parse_args(argv)
+
+
+def run(args) -> dict:
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    events = TrafficGenerator(streams=args.streams, seed=args.seed).events(args.events)
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "stages": {},
+    }
+    # Benchmarks answer from fake servers; keep their addresses out of the on-disk geocoding cache
+    with patch.dict(os.environ, {"GEOCODING_CACHE_PATH": ""}):
+        for stage in stages:
+            print(f"Running {stage}...", file=sys.stderr)
+            results["stages"][stage] = BENCHMARKS[stage](events, args)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import os
+import time
+import heapq
+import logging
+from decimal import Decimal
+from concurrent.futures import wait
+from typing import Optional
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from Packages.Enrichment import EnrichmentStage
+from Packages.GeocodingService import GeocodingService
+from Packages.Query import QuerySql
+from Packages.Metrics import REGISTRY, sampled_log
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESOLVED = REGISTRY.counter("backfill_coordinates_total", "Coordinates handled by the address backfill", ["result"])
+UPDATED = REGISTRY.counter("backfill_rows_updated_total", "Rows given an address by the backfill", ["target"])
+BACKING_OFF = REGISTRY.gauge("backfill_backing_off_coordinates", "Coordinates waiting to be retried after a failed lookup")
+
+# Rows written in deferred mode (or whose inline lookup failed) have no address yet
+UNRESOLVED = "city IS NULL AND province IS NULL AND fulladdress IS NULL"
+# Coordinates the consumer would geocode; the rest can never be resolved
+VALID_COORDINATES = "latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180"
+
+# Coordinates are NUMERIC(10, 6) / Decimal(10, 6); the same integer key is
+# computed in Python, PostgreSQL and ClickHouse so failed coordinates can be
+# excluded from the next scan
+_OFFSET_LATITUDE = 90_000_000
+_OFFSET_LONGITUDE = 180_000_000
+_SHIFT = 1_000_000_000
+POSTGRES_KEY = (f"(((latitude * 1000000)::bigint + {_OFFSET_LATITUDE}) * {_SHIFT}"
+                f" + (longitude * 1000000)::bigint + {_OFFSET_LONGITUDE})")
+CLICKHOUSE_KEY = (f"((toInt64(latitude * 1000000) + {_OFFSET_LATITUDE}) * {_SHIFT}"
+                  f" + toInt64(longitude * 1000000) + {_OFFSET_LONGITUDE})")
+
+
+def coordinate_key(latitude, longitude) -> int:
+    """Integer key of a coordinate at the columns' micro-degree scale."""
+    micro = lambda value: int((Decimal(str(value)) * 1_000_000).to_integral_value())
+    return (micro(latitude) + _OFFSET_LATITUDE) * _SHIFT + micro(longitude) + _OFFSET_LONGITUDE
+
+
+class PostgresBackfill:
+    """Finds and fills unresolved addresses in traffic_data and traffic_latest."""
+
+    name = "postgres"
+    TABLES = ("traffic_data", "traffic_latest")
+
+    UNRESOLVED_QUERY = f"""
+        SELECT latitude, longitude FROM traffic_data
+        WHERE {UNRESOLVED} AND {VALID_COORDINATES} AND {POSTGRES_KEY} <> ALL(%s::bigint[])
+        GROUP BY latitude, longitude
+        LIMIT %s
+    """
+    UPDATE_QUERY = """
+        UPDATE {table} AS t SET city = v.city, province = v.province, fulladdress = v.fulladdress
+        FROM (VALUES %s) AS v(latitude, longitude, city, province, fulladdress)
+        WHERE t.latitude = v.latitude AND t.longitude = v.longitude
+        AND t.city IS NULL AND t.province IS NULL AND t.fulladdress IS NULL
+    """
+    UPDATE_TEMPLATE = "(%s::numeric, %s::numeric, %s, %s, %s)"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def unresolved(self, limit: int, blocked) -> list:
+        def read(conn):
+            with conn.cursor() as cur:
+                cur.execute(self.UNRESOLVED_QUERY, (list(blocked), limit))
+                return cur.fetchall()
+
+        return [tuple(row) for row in self.pool.run(read)]
+
+    def apply(self, resolved: dict) -> int:
+        """Sets the address of every still-unresolved row at the given coordinates in one transaction."""
+        values = [(lat, lon, r.get("city"), r.get("province"), r.get("fulladdress")) for (lat, lon), r in resolved.items()]
+
+        def write(conn):
+            updated = 0
+            with conn.cursor() as cur:
+                for table in self.TABLES:
+                    execute_values(cur, self.UPDATE_QUERY.format(table=table), values,
+                                   template=self.UPDATE_TEMPLATE, page_size=len(values))
+                    updated += max(cur.rowcount, 0)
+                if updated:
+                    # Cached analytics results may hold the old, empty addresses
+                    cur.execute(QuerySql.WRITE_SEQUENCE_QUERY, (None,))
+            return updated
+
+        return self.pool.run(write)
+
+
+class ClickHouseBackfill:
+    """
+    Finds and fills unresolved addresses in ClickHouse with one mutation per
+    batch. ``mutations_sync`` makes the mutation finish before the next scan,
+    so the same rows are not picked up again.
+    """
+
+    name = "clickhouse"
+
+    UNRESOLVED_QUERY = f"""
+        SELECT latitude, longitude FROM traffic_data
+        WHERE {UNRESOLVED} AND {VALID_COORDINATES}{{blocked}}
+        GROUP BY latitude, longitude
+        LIMIT %(limit)s
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def unresolved(self, limit: int, blocked) -> list:
+        params = {"limit": limit}
+        clause = ""
+        if blocked:
+            clause = f" AND {CLICKHOUSE_KEY} NOT IN %(blocked)s"
+            params["blocked"] = tuple(blocked)
+        rows = self.client.execute(self.UNRESOLVED_QUERY.format(blocked=clause), params)
+        return [tuple(row) for row in rows]
+
+    def apply(self, resolved: dict) -> int:
+        params = {}
+        branches = {"city": [], "province": [], "fulladdress": []}
+        for i, ((latitude, longitude), result) in enumerate(resolved.items()):
+            params[f"k{i}"] = coordinate_key(latitude, longitude)
+            for column, parts in branches.items():
+                params[f"{column}{i}"] = result.get(column)
+                parts.append(f"{CLICKHOUSE_KEY} = %(k{i})s, %({column}{i})s")
+        params["keys"] = tuple(params[f"k{i}"] for i in range(len(resolved)))
+        assignments = ", ".join(f"{column} = multiIf({', '.join(parts)}, {column})" for column, parts in branches.items())
+        self.client.execute(
+            f"ALTER TABLE traffic_data UPDATE {assignments} WHERE {UNRESOLVED} AND {CLICKHOUSE_KEY} IN %(keys)s",
+            params, settings={"mutations_sync": 1}
+        )
+        # Mutations do not report affected rows
+        return len(resolved)
+
+
+class AddressBackfill:
+    """
+    Fills in addresses for rows written without one (GEOCODING_MODE=deferred).
+
+    Each pass reads up to ``batch_size`` distinct unresolved coordinates from
+    the first target, geocodes them concurrently and writes the addresses to
+    every target in bulk. A coordinate whose lookup fails, or finds no
+    address, is retried after ``base_backoff`` seconds, doubling up to
+    ``max_backoff``, and is left out of the scans until then. At most
+    ``max_blocked`` coordinates are held back; beyond that the ones due
+    soonest are forgotten and retried as new.
+    """
+
+    def __init__(self, targets, stage: EnrichmentStage, batch_size: int = 500,
+                 base_backoff: float = 30.0, max_backoff: float = 3600.0, max_blocked: int = 10000):
+        self.targets = targets
+        self.stage = stage
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_blocked = max_blocked
+        # coordinate key -> (failed attempts, monotonic time of the next attempt)
+        self._retry = {}
+        BACKING_OFF.track(lambda: len(self._retry))
+
+    @classmethod
+    def from_env(cls) -> Optional["AddressBackfill"]:
+        sinks = [sink.strip() for sink in os.getenv("TRAFFIC_SINKS", "postgres").lower().split(",")]
+        targets = []
+        if "postgres" in sinks:
+            from Packages.PostgresService import PostgresService
+            targets.append(PostgresBackfill(PostgresService.get_pool()))
+        if "clickhouse" in sinks:
+            from Packages.ClickHouseService import ClickHouseService
+            targets.append(ClickHouseBackfill(ClickHouseService.get_connection()))
+        if not targets:
+            return None
+        return cls(
+            targets,
+            EnrichmentStage(None, max_workers=int(os.getenv("GEOCODING_WORKERS", "4"))),
+            batch_size=int(os.getenv("BACKFILL_BATCH_SIZE", "500")),
+            base_backoff=float(os.getenv("BACKFILL_RETRY_SECONDS", "30")),
+            max_backoff=float(os.getenv("BACKFILL_MAX_RETRY_SECONDS", "3600")),
+            max_blocked=int(os.getenv("BACKFILL_MAX_BLOCKED", "10000"))
+        )
+
+    def _blocked(self, now: float) -> list:
+        return [key for key, (_, retry_at) in self._retry.items() if retry_at > now]
+
+    def _failed(self, key, now: float):
+        attempts = self._retry.get(key, (0, 0))[0] + 1
+        self._retry[key] = (attempts, now + min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff))
+
+    def _trim(self):
+        # Bounds both this map and the key list sent with every scan
+        if len(self._retry) > self.max_blocked:
+            kept = heapq.nlargest(self.max_blocked, self._retry.items(), key=lambda item: item[1][1])
+            self._retry = dict(kept)
+
+    def run_once(self) -> dict:
+        """One pass over up to ``batch_size`` coordinates; returns what it did."""
+        now = time.monotonic()
+        coordinates = self.targets[0].unresolved(self.batch_size, self._blocked(now))
+        futures = {}
+        for coordinate in coordinates:
+            latitude, longitude = coordinate
+            if latitude is None or longitude is None or not GeocodingService.validate_coordinates(latitude, longitude):
+                sampled_log(logging.WARNING, "backfill-invalid", f"⚠️ Backfill skipped invalid coordinates {coordinate}", logger)
+                continue
+            futures[coordinate] = self.stage.geocode(latitude, longitude)
+        wait(futures.values())
+
+        resolved = {}
+        for coordinate, future in futures.items():
+            key = coordinate_key(*coordinate)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Backfill lookup failed for {coordinate}: {e}")
+                result = None
+            if result and any(result.values()):
+                resolved[coordinate] = result
+                self._retry.pop(key, None)
+            else:
+                self._failed(key, now)
+        self._trim()
+        RESOLVED.inc(len(resolved), result="resolved")
+        RESOLVED.inc(len(coordinates) - len(resolved), result="failed")
+
+        updated = {}
+        if resolved:
+            for target in self.targets:
+                updated[target.name] = target.apply(resolved)
+                UPDATED.inc(updated[target.name], target=target.name)
+        return {"coordinates": len(coordinates), "resolved": len(resolved),
+                "failed": len(coordinates) - len(resolved), "updated": updated}
+
+    def run(self, stop_event, interval: float = 0):
+        """
+        Runs passes back to back while full batches come in, then waits
+        ``interval`` seconds between passes; with ``interval`` 0 it returns
+        once no unresolved coordinates are left to try.
+        """
+        while not stop_event.is_set():
+            result = self.run_once()
+            if result["coordinates"]:
+                logger.info(f"📍 Backfill: {result['resolved']} of {result['coordinates']} coordinates resolved, "
+                            f"rows updated {result['updated']}")
+            if result["coordinates"] >= self.batch_size:
+                continue
+            if interval <= 0 or stop_event.wait(interval):
+                return
+
+    def shutdown(self):
+        self.stage.shutdown()
@@ -0,0 +1,406 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from dotenv import load_dotenv
+from Packages.ClickHouseSchema import ROLLUPS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("city", "province")
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _normalize(value):
+    if isinstance(value, datetime):
+        return _utc(value).isoformat()
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+class QueryCache:
+    """
+    LRU of analytics results invalidated by the writes to the backend that
+    answered them.
+
+    An entry remembers the backend and that backend's write version (see
+    ``AnalyticsQuery.versions``) it was computed at, and is served only
+    while the version is unchanged. Late events, replays and address
+    backfills all move the version, so no range is ever treated as final.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(name: str, params: dict) -> tuple:
+        """Normalized cache key: parameter order, float noise and timezones do not matter."""
+        return (name,) + tuple(sorted((k, _normalize(v)) for k, v in params.items()))
+
+    def get(self, key, versions: dict):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                _, backend, version = entry
+                if versions.get(backend) == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, rows, backend: str, version):
+        if version is None:
+            return
+        with self._lock:
+            self._entries[key] = (rows, backend, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+
+class AnalyticsQuery:
+    """
+    Read queries for dashboards: time series per location, most congested
+    cities or provinces, and latest readings inside a bounding box.
+
+    Each query runs on the first backend in ``backends`` that answers
+    (ClickHouse, then PostgreSQL by default). Results are cached in a
+    QueryCache keyed on the normalized parameters and tagged with the
+    answering backend's write version.
+
+    On ClickHouse, series and rankings whose range (and bucket) fall on
+    whole hours or minutes read the hourly or per-minute rollup instead of
+    raw rows. Rankings by city or province stay on raw rows when
+    ``address_rollups`` is off: rollups keep the address a row had when it
+    was inserted, which deferred geocoding fills in later.
+    """
+
+    SERIES_SQL = {
+        "clickhouse": """
+            SELECT toStartOfInterval(timestamp, toIntervalSecond(%(bucket)s)) AS bucket,
+                   count() AS events,
+                   avg(total_in_area) AS avg_total_in_area,
+                   max(total_in_area) AS max_total_in_area,
+                   sum(total_in_area) / nullIf(sum(estimated_max_people), 0) AS occupancy_ratio
+            FROM traffic_data
+            WHERE location = %(location)s AND timestamp >= %(start)s AND timestamp < %(end)s
+            GROUP BY bucket ORDER BY bucket LIMIT %(limit)s
+        """,
+        "postgres": """
+            SELECT to_timestamp(floor(extract(epoch FROM timestamp) / %(bucket)s) * %(bucket)s) AS bucket,
+                   count(*) AS events,
+                   avg(total_in_area)::float AS avg_total_in_area,
+                   max(total_in_area) AS max_total_in_area,
+                   sum(total_in_area)::float / NULLIF(sum(estimated_max_people), 0) AS occupancy_ratio
+            FROM traffic_data
+            WHERE location = %(location)s AND timestamp >= %(start)s AND timestamp < %(end)s
+            GROUP BY 1 ORDER BY 1 LIMIT %(limit)s
+        """,
+    }
+
+    # {level} is one of LEVELS, never user input
+    TOP_SQL = {
+        "clickhouse": """
+            SELECT {level} AS name,
+                   count() AS events,
+                   avg(total_in_area) AS avg_total_in_area,
+                   sum(total_in_area) / nullIf(sum(estimated_max_people), 0) AS occupancy_ratio
+            FROM traffic_data
+            WHERE timestamp >= %(start)s AND timestamp < %(end)s AND {level} IS NOT NULL
+            GROUP BY name ORDER BY occupancy_ratio DESC LIMIT %(limit)s
+        """,
+        "postgres": """
+            SELECT {level} AS name,
+                   count(*) AS events,
+                   avg(total_in_area)::float AS avg_total_in_area,
+                   sum(total_in_area)::float / NULLIF(sum(estimated_max_people), 0) AS occupancy_ratio
+            FROM traffic_data
+            WHERE timestamp >= %(start)s AND timestamp < %(end)s AND {level} IS NOT NULL
+            GROUP BY {level} ORDER BY occupancy_ratio DESC NULLS LAST LIMIT %(limit)s
+        """,
+    }
+
+    LATEST_SQL = {
+        "clickhouse": """
+            SELECT stream_id,
+                   max(timestamp) AS timestamp,
+                   argMax(location, timestamp) AS location,
+                   argMax(longitude, timestamp) AS longitude,
+                   argMax(latitude, timestamp) AS latitude,
+                   argMax(total_in_area, timestamp) AS total_in_area,
+                   argMax(estimated_max_people, timestamp) AS estimated_max_people,
+                   argMax(label, timestamp) AS label,
+                   argMax(city, timestamp) AS city
+            FROM traffic_data
+            WHERE timestamp >= %(since)s
+              AND longitude BETWEEN %(min_lon)s AND %(max_lon)s
+              AND latitude BETWEEN %(min_lat)s AND %(max_lat)s
+            GROUP BY stream_id ORDER BY stream_id LIMIT %(limit)s
+        """,
+        "postgres": """
+            SELECT DISTINCT ON (stream_id)
+                   stream_id::text AS stream_id, timestamp, location, longitude::float AS longitude,
+                   latitude::float AS latitude, total_in_area, estimated_max_people, label, city
+            FROM traffic_data
+            WHERE timestamp >= %(since)s
+              AND longitude BETWEEN %(min_lon)s AND %(max_lon)s
+              AND latitude BETWEEN %(min_lat)s AND %(max_lat)s
+            ORDER BY stream_id, timestamp DESC LIMIT %(limit)s
+        """,
+    }
+
+    # {table} is one of the ROLLUPS tables, never user input
+    ROLLUP_SERIES_SQL = """
+        SELECT toStartOfInterval(bucket_start, toIntervalSecond(%(bucket)s)) AS bucket,
+               sum(events) AS events,
+               sum(sum_total_in_area) / sum(events) AS avg_total_in_area,
+               max(max_total_in_area) AS max_total_in_area,
+               sum(sum_total_in_area) / nullIf(sum(sum_estimated_max_people), 0) AS occupancy_ratio
+        FROM {table}
+        WHERE location = %(location)s AND bucket_start >= %(start)s AND bucket_start < %(end)s
+        GROUP BY bucket ORDER BY bucket LIMIT %(limit)s
+    """
+    ROLLUP_TOP_SQL = """
+        SELECT {level} AS name,
+               sum(events) AS events,
+               sum(sum_total_in_area) / sum(events) AS avg_total_in_area,
+               sum(sum_total_in_area) / nullIf(sum(sum_estimated_max_people), 0) AS occupancy_ratio
+        FROM {table}
+        WHERE bucket_start >= %(start)s AND bucket_start < %(end)s AND {level} != ''
+        GROUP BY name ORDER BY occupancy_ratio DESC LIMIT %(limit)s
+    """
+
+    # Every PostgreSQL write bumps the sequence; in ClickHouse every insert and
+    # mutation replaces the set of active parts
+    VERSION_SQL = {
+        "postgres": "SELECT sequence, watermark FROM ingest_watermark WHERE name = 'traffic_data'",
+        "clickhouse": """
+            SELECT count(), groupBitXor(cityHash64(table, name)) FROM system.parts
+            WHERE active AND database = currentDatabase() AND table IN %(tables)s
+        """,
+    }
+    VERSION_TABLES = ("traffic_data",) + tuple(table for table, _, _ in ROLLUPS)
+
+    def __init__(self, pool=None, clickhouse_connect=None, backends=("clickhouse", "postgres"),
+                 cache: Optional[QueryCache] = None, max_rows: int = 10000,
+                 watermark_poll_seconds: float = 1.0, use_rollups: bool = True, address_rollups: bool = True):
+        self.pool = pool
+        self.clickhouse_connect = clickhouse_connect
+        self.backends = tuple(backends)
+        self.cache = cache or QueryCache()
+        self.max_rows = max_rows
+        self.watermark_poll_seconds = watermark_poll_seconds
+        self.use_rollups = use_rollups
+        self.address_rollups = address_rollups
+
+        # clickhouse_driver clients are not thread-safe; each request thread gets its own
+        self._local = threading.local()
+        self._versions = {}
+        self._watermark = None
+        self._versions_read_at = None
+        self._versions_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        from Packages.PostgresService import PostgresService
+        from Packages.ClickHouseService import ClickHouseService
+        return cls(
+            pool=PostgresService.get_pool(),
+            clickhouse_connect=ClickHouseService.get_connection,
+            backends=[b.strip() for b in os.getenv("ANALYTICS_BACKENDS", "clickhouse,postgres").lower().split(",") if b.strip()],
+            cache=QueryCache(max_entries=int(os.getenv("ANALYTICS_CACHE_SIZE", "1024"))),
+            max_rows=int(os.getenv("ANALYTICS_MAX_ROWS", "10000")),
+            watermark_poll_seconds=int(os.getenv("ANALYTICS_WATERMARK_POLL_MS", "1000")) / 1000,
+            use_rollups=os.getenv("ANALYTICS_ROLLUPS", "true").lower() == "true",
+            address_rollups=os.getenv("GEOCODING_MODE", "inline").lower() != "deferred"
+        )
+
+    def versions(self) -> dict:
+        """
+        Write version of every backend, read at most once per
+        ``watermark_poll_seconds``: PostgreSQL's write sequence and a
+        fingerprint of ClickHouse's active parts. A backend whose version
+        cannot be read is missing, so its results are not cached.
+        """
+        with self._versions_lock:
+            now = time.monotonic()
+            if self._versions_read_at is not None and now - self._versions_read_at < self.watermark_poll_seconds:
+                return self._versions
+
+            versions = {}
+            self._watermark = None
+            if "postgres" in self.backends and self.pool is not None:
+                def read(conn):
+                    statement = self.pool.prepare(conn, self.VERSION_SQL["postgres"])
+                    with conn.cursor() as cur:
+                        cur.execute(statement)
+                        row = cur.fetchone()
+                    conn.rollback()
+                    return row
+
+                try:
+                    row = self.pool.run(read)
+                    if row is not None:
+                        versions["postgres"], self._watermark = row[0], _utc(row[1])
+                except Exception as e:
+                    # Without a version nothing is cached, results are still served
+                    logger.warning(f"⚠️ Failed to read the PostgreSQL write sequence: {e}")
+
+            if "clickhouse" in self.backends and self.clickhouse_connect is not None:
+                try:
+                    rows = self._clickhouse(self.VERSION_SQL["clickhouse"], {"tables": self.VERSION_TABLES})
+                    versions["clickhouse"] = tuple(rows[0].values()) if rows else None
+                except Exception as e:
+                    logger.warning(f"⚠️ Failed to read the ClickHouse parts: {e}")
+
+            self._versions = versions
+            self._versions_read_at = now
+            return versions
+
+    def watermark(self) -> Optional[datetime]:
+        """Newest event time written to PostgreSQL, read along with the versions."""
+        self.versions()
+        return self._watermark
+
+    def _clickhouse(self, query, params):
+        client = getattr(self._local, "clickhouse", None)
+        if client is None:
+            client = self._local.clickhouse = self.clickhouse_connect()
+        try:
+            rows, columns = client.execute(query, params, with_column_types=True)
+        except Exception:
+            self._local.clickhouse = None
+            raise
+        names = [name for name, _ in columns]
+        return [dict(zip(names, row)) for row in rows]
+
+    def _postgres(self, query, params):
+        def read(conn):
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                names = [column[0] for column in cur.description]
+                rows = cur.fetchall()
+            conn.rollback()
+            return [dict(zip(names, row)) for row in rows]
+
+        return self.pool.run(read)
+
+    def _execute(self, queries, params):
+        error = None
+        for backend in self.backends:
+            if backend == "clickhouse" and self.clickhouse_connect is None:
+                continue
+            if backend == "postgres" and self.pool is None:
+                continue
+            try:
+                if backend == "clickhouse":
+                    return backend, self._clickhouse(queries[backend], params)
+                return backend, self._postgres(queries[backend], params)
+            except Exception as e:
+                logger.warning(f"⚠️ Analytics query on {backend} failed, trying next backend: {e}")
+                error = e
+        raise error or RuntimeError("No analytics backend configured")
+
+    def _cached(self, name, queries, params):
+        # Versions are read before the query, so a write racing it invalidates the entry
+        versions = self.versions()
+        key = QueryCache.key(name, params)
+        rows = self.cache.get(key, versions)
+        if rows is None:
+            backend, rows = self._execute(queries, dict(params, limit=self.max_rows))
+            self.cache.put(key, rows, backend, versions.get(backend))
+        return rows
+
+    @staticmethod
+    def _range(start, end, default: timedelta):
+        if end is None:
+            # "Now" is rounded up to the minute so refreshes share a cache entry
+            end = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = _utc(end)
+        start = _utc(start) or end - default
+        if start >= end:
+            raise ValueError("start must be before end")
+        return start, end
+
+    def rollup(self, start: datetime, end: datetime, bucket_seconds: Optional[int] = None) -> Optional[str]:
+        """
+        The coarsest ClickHouse rollup whose grain divides the bucket and on
+        which the range starts and ends exactly; None to read raw rows.
+        """
+        if not self.use_rollups:
+            return None
+        for table, grain, _ in ROLLUPS:
+            if bucket_seconds is not None and bucket_seconds % grain:
+                continue
+            if start.timestamp() % grain or end.timestamp() % grain:
+                continue
+            return table
+        return None
+
+    def series(self, location: str, start=None, end=None, bucket_seconds: int = 60) -> list:
+        """Per-bucket event count, avg/max total_in_area and occupancy for one location."""
+        if bucket_seconds <= 0:
+            raise ValueError("bucket_seconds must be positive")
+        start, end = self._range(start, end, timedelta(hours=1))
+        params = {"location": location, "start": start, "end": end, "bucket": bucket_seconds}
+        queries = dict(self.SERIES_SQL)
+        table = self.rollup(start, end, bucket_seconds)
+        if table is not None:
+            queries["clickhouse"] = self.ROLLUP_SERIES_SQL.format(table=table)
+        return self._cached("series", queries, params)
+
+    def top_congested(self, level: str = "city", start=None, end=None, limit: int = 10) -> list:
+        """Cities or provinces ordered by occupancy ratio, highest first."""
+        if level not in LEVELS:
+            raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+        start, end = self._range(start, end, timedelta(hours=1))
+        queries = {backend: query.format(level=level) for backend, query in self.TOP_SQL.items()}
+        table = self.rollup(start, end) if self.address_rollups else None
+        if table is not None:
+            queries["clickhouse"] = self.ROLLUP_TOP_SQL.format(level=level, table=table)
+        params = {"start": start, "end": end}
+        return self._cached(f"top_{level}", queries, params)[:limit]
+
+    def latest_in_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float,
+                       lookback_minutes: int = 60) -> list:
+        """Latest reading of every stream inside the bounding box within the lookback window."""
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError("Bounding box minimum must not exceed its maximum")
+        # The window start is rounded to the minute so refreshes share a cache entry
+        since = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=lookback_minutes)
+        params = {"min_lon": min_lon, "min_lat": min_lat, "max_lon": max_lon, "max_lat": max_lat, "since": since}
+        return self._cached("latest", self.LATEST_SQL, params)
@@ -0,0 +1,288 @@
+import os
+import glob
+import time
+import logging
+from typing import List, Optional, Sequence
+from dotenv import load_dotenv
+from Packages.Metrics import REGISTRY
+
+try:
+    import numpy as np
+except ImportError:  # The detector needs NumPy; without it the consumer runs without alerts
+    np = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ALERTS = REGISTRY.counter("anomaly_alerts_total", "Anomaly alerts emitted by reason", ["reason"])
+SUPPRESSED = REGISTRY.counter("anomaly_alerts_suppressed_total", "Flagged events within a stream's alert cooldown")
+STREAMS = REGISTRY.gauge("anomaly_tracked_streams", "Streams with detector state")
+OBSERVE_SECONDS = REGISTRY.histogram("anomaly_observe_seconds", "Time to score and fold one poll batch into the detector")
+CHECKPOINT_SECONDS = REGISTRY.histogram("anomaly_checkpoint_seconds", "Time to write a detector state checkpoint")
+
+CHECKPOINT_VERSION = 1
+# Copied into every alert when the event has them
+ALERT_FIELDS = ("stream_id", "timestamp", "location", "city", "province", "label", "type",
+                "latitude", "longitude", "total_in_area", "estimated_max_people")
+
+
+class StreamState:
+    """
+    Array-backed state of every stream: a slot per ``stream_id`` in parallel
+    NumPy arrays holding the observation count, EWMA mean and variance and
+    the time of the last alert. Memory per stream is constant (four numbers
+    plus the id's index entry) and the arrays double when full.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.index = {}
+        self.ids = []
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros(capacity, dtype=np.float64)
+        self.var = np.zeros(capacity, dtype=np.float64)
+        self.last_alert = np.full(capacity, -np.inf, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _grow(self, needed: int):
+        capacity = len(self.count)
+        while capacity < needed:
+            capacity *= 2
+        for name, fill in (("count", 0), ("mean", 0.0), ("var", 0.0), ("last_alert", -np.inf)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def slots(self, stream_ids: Sequence) -> "np.ndarray":
+        """Slot of every stream id, allocating slots for new streams."""
+        index = self.index
+        slots = np.empty(len(stream_ids), dtype=np.int64)
+        for i, stream_id in enumerate(stream_ids):
+            slot = index.get(stream_id)
+            if slot is None:
+                slot = index[stream_id] = len(self.ids)
+                self.ids.append(stream_id)
+            slots[i] = slot
+        if len(self.ids) > len(self.count):
+            self._grow(len(self.ids))
+        return slots
+
+    def save(self, path: str):
+        """Writes the state to ``path`` atomically; ids are stored as length-prefixed UTF-8."""
+        n = len(self.ids)
+        encoded = [stream_id.encode("utf-8") for stream_id in self.ids]
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(CHECKPOINT_VERSION),
+                id_lengths=np.array([len(e) for e in encoded], dtype=np.int32),
+                id_bytes=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                count=self.count[:n], mean=self.mean[:n], var=self.var[:n], last_alert=self.last_alert[:n]
+            )
+        os.replace(temporary, path)
+
+    def merge(self, path: str) -> int:
+        """
+        Loads a checkpoint into this state. A stream present in both keeps
+        whichever state has seen more events. Returns the streams read.
+        """
+        with np.load(path) as data:
+            if int(data["version"]) != CHECKPOINT_VERSION:
+                raise ValueError(f"Unsupported checkpoint version {int(data['version'])}")
+            raw = data["id_bytes"].tobytes()
+            ends = np.cumsum(data["id_lengths"])
+            starts = ends - data["id_lengths"]
+            ids = [raw[start:end].decode("utf-8") for start, end in zip(starts.tolist(), ends.tolist())]
+            count, mean, var, last_alert = data["count"], data["mean"], data["var"], data["last_alert"]
+
+        slots = self.slots(ids)
+        newer = count > self.count[slots]
+        for name, values in (("count", count), ("mean", mean), ("var", var), ("last_alert", last_alert)):
+            getattr(self, name)[slots[newer]] = values[newer]
+        return len(ids)
+
+
+class AnomalyDetector:
+    """
+    Per-stream anomaly detection inside the consumer.
+
+    Every stream keeps an exponentially weighted mean and variance of
+    ``total_in_area`` (weight ``alpha`` for the newest reading). An event is
+    flagged as a ``spike`` or ``drop`` when its z-score against the stream's
+    state before it reaches ``z_threshold``, once the stream has seen
+    ``warmup`` events. It is flagged as ``capacity`` when ``total_in_area``
+    exceeds ``capacity_ratio`` times ``estimated_max_people``. A stream
+    alerts at most once per ``cooldown_seconds``.
+
+    A poll batch is scored and folded in column-wise. Events of a stream
+    that appears several times in a batch are applied in order, one round
+    per repeat. State is checkpointed every ``checkpoint_seconds`` to this
+    worker's file in ``checkpoint_dir``. On start the files of all workers
+    are merged, so state stays warm across restarts and rebalances.
+    """
+
+    def __init__(self, alpha: float = 0.1, z_threshold: float = 4.0, capacity_ratio: float = 1.0,
+                 warmup: int = 10, min_std: float = 1.0, cooldown_seconds: float = 60.0,
+                 checkpoint_dir: Optional[str] = None, checkpoint_seconds: float = 60.0, worker: int = 0):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.capacity_ratio = capacity_ratio
+        self.warmup = warmup
+        # Floor for the deviation so a perfectly steady stream does not alert on +1
+        self.min_std = min_std
+        self.cooldown_seconds = cooldown_seconds
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_seconds = checkpoint_seconds
+        self.checkpoint_path = os.path.join(checkpoint_dir, f"worker-{worker}.npz") if checkpoint_dir else None
+
+        self.state = StreamState()
+        self._checkpointed = time.monotonic()
+        self.events = 0
+        self.alerts = 0
+        STREAMS.track(lambda: len(self.state))
+
+        if checkpoint_dir:
+            self.restore()
+
+    @staticmethod
+    def from_env(worker: int = 0) -> Optional["AnomalyDetector"]:
+        """Builds the detector from ANOMALY_* variables; None unless ANOMALY_DETECTION is true."""
+        if os.getenv("ANOMALY_DETECTION", "false").lower() != "true":
+            return None
+        if np is None:
+            logger.warning("⚠️ NumPy is not installed, anomaly detection is disabled")
+            return None
+        return AnomalyDetector(
+            alpha=float(os.getenv("ANOMALY_ALPHA", "0.1")),
+            z_threshold=float(os.getenv("ANOMALY_Z_THRESHOLD", "4")),
+            capacity_ratio=float(os.getenv("ANOMALY_CAPACITY_RATIO", "1.0")),
+            warmup=int(os.getenv("ANOMALY_WARMUP_EVENTS", "10")),
+            min_std=float(os.getenv("ANOMALY_MIN_STD", "1.0")),
+            cooldown_seconds=float(os.getenv("ANOMALY_COOLDOWN_SECONDS", "60")),
+            checkpoint_dir=os.getenv("ANOMALY_CHECKPOINT_DIR") or None,
+            checkpoint_seconds=float(os.getenv("ANOMALY_CHECKPOINT_SECONDS", "60")),
+            worker=worker
+        )
+
+    def restore(self):
+        """Merges every worker's checkpoint in ``checkpoint_dir`` into the state."""
+        for path in sorted(glob.glob(os.path.join(self.checkpoint_dir, "*.npz"))):
+            try:
+                streams = self.state.merge(path)
+                logger.info(f"🚨 Restored anomaly state of {streams} streams from {path}")
+            except Exception as e:
+                logger.error(f"❌ Failed to restore anomaly state from {path}: {e}")
+
+    def checkpoint(self, force: bool = False) -> bool:
+        """Writes the state when ``checkpoint_seconds`` have passed (or when forced)."""
+        if self.checkpoint_path is None:
+            return False
+        if not force and time.monotonic() - self._checkpointed < self.checkpoint_seconds:
+            return False
+        try:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            with CHECKPOINT_SECONDS.time():
+                self.state.save(self.checkpoint_path)
+        except OSError as e:
+            logger.error(f"❌ Failed to checkpoint anomaly state: {e}")
+            return False
+        finally:
+            self._checkpointed = time.monotonic()
+        return True
+
+    @staticmethod
+    def _rounds(slots):
+        """Positions of the batch grouped into rounds in which every stream appears at most once."""
+        n = len(slots)
+        order = np.argsort(slots, kind="stable")
+        ordered = slots[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+        by_rank = np.argsort(rank, kind="stable")
+        return np.split(by_rank, np.cumsum(np.bincount(rank))[:-1])
+
+    def observe(self, events: Sequence) -> List[dict]:
+        """Scores a batch of events, folds them into their streams' state and returns the alerts."""
+        usable = [e for e in events if e.get("stream_id") is not None and e.get("total_in_area") is not None]
+        if not usable:
+            return []
+        with OBSERVE_SECONDS.time():
+            return self._observe(usable)
+
+    def _observe(self, events) -> List[dict]:
+        state = self.state
+        slots = state.slots([str(e.get("stream_id")) for e in events])
+        value = np.array([e.get("total_in_area") for e in events], dtype=np.float64)
+        capacity = np.array([e.get("estimated_max_people") or 0 for e in events], dtype=np.float64)
+
+        z = np.zeros(len(events))
+        mean_before = np.empty(len(events))
+        std_before = np.empty(len(events))
+        alpha = self.alpha
+        for positions in self._rounds(slots):
+            # Rounds run in batch order, so a stream's repeated events update its state in sequence
+            s = slots[positions]
+            x = value[positions]
+            count, mean, var = state.count[s], state.mean[s], state.var[s]
+            std = np.maximum(np.sqrt(var), self.min_std)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                z[positions] = np.where(count >= self.warmup, (x - mean) / std, 0.0)
+            mean_before[positions] = np.where(count > 0, mean, np.nan)
+            std_before[positions] = np.where(count > 0, std, np.nan)
+
+            # Incremental EWMA mean and variance; the first reading seeds the mean
+            first = count == 0
+            diff = x - mean
+            increment = alpha * diff
+            state.mean[s] = np.where(first, x, mean + increment)
+            state.var[s] = np.where(first, 0.0, (1 - alpha) * (var + diff * increment))
+            state.count[s] = count + 1
+        self.events += len(events)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(capacity > 0, value / capacity, np.nan)
+        deviating = np.abs(z) >= self.z_threshold
+        over_capacity = capacity > 0
+        over_capacity[over_capacity] = value[over_capacity] > self.capacity_ratio * capacity[over_capacity]
+
+        alerts = []
+        now = time.time()
+        for i in np.flatnonzero(deviating | over_capacity).tolist():
+            slot = slots[i]
+            if now - state.last_alert[slot] < self.cooldown_seconds:
+                SUPPRESSED.inc()
+                continue
+            state.last_alert[slot] = now
+            reasons = []
+            if deviating[i]:
+                reasons.append("spike" if z[i] > 0 else "drop")
+            if over_capacity[i]:
+                reasons.append("capacity")
+            alerts.append(self._alert(events[i], reasons, z[i], mean_before[i], std_before[i], ratio[i]))
+            for reason in reasons:
+                ALERTS.inc(reason=reason)
+        self.alerts += len(alerts)
+        return alerts
+
+    @staticmethod
+    def _alert(event, reasons, z, mean, std, ratio) -> dict:
+        alert = {field: event.get(field) for field in ALERT_FIELDS}
+        alert.update({
+            "reasons": reasons,
+            "z_score": round(float(z), 3),
+            "baseline_mean": None if np.isnan(mean) else round(float(mean), 3),
+            "baseline_std": None if np.isnan(std) else round(float(std), 3),
+            "capacity_ratio": None if np.isnan(ratio) else round(float(ratio), 3),
+            "detected_at": time.time(),
+        })
+        return alert
+
+    def stats(self) -> dict:
+        return {"streams": len(self.state), "events": self.events, "alerts": self.alerts}
@@ -0,0 +1,239 @@
+import time
+import queue
+import logging
+import threading
+from kafka.structs import OffsetAndMetadata, TopicPartition
+from Packages.Metrics import REGISTRY, SIZE_BUCKETS, sampled_log
+
+FLUSH_SECONDS = REGISTRY.histogram("sink_flush_seconds", "Time to write one batch to a sink", ["sink"])
+BATCH_ROWS = REGISTRY.histogram("sink_batch_rows", "Rows per flushed batch", ["sink"], buckets=SIZE_BUCKETS)
+FLUSH_FAILURES = REGISTRY.counter("sink_flush_failures_total", "Failed batch writes", ["sink"])
+QUEUE_DEPTH = REGISTRY.gauge("sink_queue_depth", "Rows queued for a background sink", ["sink"])
+QUEUE_DROPPED = REGISTRY.counter("sink_queue_dropped_total", "Rows dropped because a background sink queue was full", ["sink"])
+
+
+class BatchWriter:
+    """
+    Buffers rows for a bulk sink and flushes them by row count or linger time.
+
+    Alongside the rows it tracks the next offset to consume for every Kafka
+    partition the rows came from, so the caller can commit offsets only once
+    the batch has landed. A failed flush keeps the buffer for the next attempt.
+    With ``with_offsets`` the sink is called as ``sink(rows, offsets)`` so it
+    can store the offsets in the same transaction as the rows, also when
+    every message of the batch was skipped. ``landed`` holds, per partition,
+    the next offset of everything flushed so far.
+    """
+
+    def __init__(self, sink, max_rows: int = 500, max_linger_seconds: float = 1.0, name: str = "sink",
+                 with_offsets: bool = False):
+        self.sink = sink
+        self.max_rows = max_rows
+        self.max_linger_seconds = max_linger_seconds
+        self.name = name
+        self.with_offsets = with_offsets
+
+        self.rows = []
+        self.offsets = {}
+        self.landed = {}
+        self._first_added = None
+
+    def _track(self, message):
+        if message is not None:
+            tp = (message.topic, message.partition)
+            self.offsets[tp] = max(self.offsets.get(tp, 0), message.offset + 1)
+        if self._first_added is None:
+            self._first_added = time.monotonic()
+
+    def add(self, row, message=None):
+        self.rows.append(row)
+        self._track(message)
+
+    def skip(self, message):
+        """Advances the offset for a message that produced no row."""
+        self._track(message)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def full(self) -> bool:
+        return len(self.rows) >= self.max_rows
+
+    def due(self) -> bool:
+        if self._first_added is None:
+            return False
+        if self.full():
+            return True
+        return time.monotonic() - self._first_added >= self.max_linger_seconds
+
+    def flush(self):
+        """
+        Sends buffered rows to the sink in one call.
+
+        Returns the flushed offsets as ``{(topic, partition): next_offset}``,
+        or None if the sink failed and the rows were kept for a retry.
+        """
+        if not self.rows and not self.offsets:
+            self._first_added = None
+            return {}
+
+        if self.rows or self.with_offsets:
+            started = time.monotonic()
+            try:
+                if self.with_offsets:
+                    self.sink(self.rows, self.offsets)
+                else:
+                    self.sink(self.rows)
+            except Exception as e:
+                FLUSH_FAILURES.inc(sink=self.name)
+                logging.error(f"❌ Failed to flush {len(self.rows)} rows to {self.name}: {e}")
+                return None
+            elapsed = time.monotonic() - started
+            FLUSH_SECONDS.observe(elapsed, sink=self.name)
+            BATCH_ROWS.observe(len(self.rows), sink=self.name)
+            sampled_log(logging.INFO, f"flush:{self.name}", f"✅ Flushed {len(self.rows)} rows to {self.name} in {elapsed * 1000:.1f} ms")
+
+        offsets = self.offsets
+        for tp, offset in offsets.items():
+            self.landed[tp] = max(self.landed.get(tp, 0), offset)
+        self.rows = []
+        self.offsets = {}
+        self._first_added = None
+        return offsets
+
+    def forget(self, partitions):
+        """Drops ``landed`` for ``(topic, partition)`` pairs this consumer no longer owns."""
+        for tp in partitions:
+            self.landed.pop(tp, None)
+
+    def discard(self) -> int:
+        """Drops the buffered rows and their offsets uncommitted; returns how many rows were dropped."""
+        dropped = len(self.rows)
+        self.rows = []
+        self.offsets = {}
+        self._first_added = None
+        return dropped
+
+    @staticmethod
+    def to_commit(offsets, held=None) -> dict:
+        """
+        Converts flushed offsets into the structure expected by
+        ``KafkaConsumer.commit``. A partition with a lower ``held`` offset
+        commits that one, with the flushed offset as metadata.
+        """
+        held = held or {}
+        commit = {}
+        for (topic, partition), offset in offsets.items():
+            position = held.get((topic, partition), offset)
+            metadata = str(offset) if position < offset else None
+            commit[TopicPartition(topic, partition)] = OffsetAndMetadata(min(position, offset), metadata, -1)
+        return commit
+
+
+class BackgroundWriter:
+    """
+    Runs a BatchWriter on its own thread behind a bounded queue.
+
+    By default ``submit`` never blocks the caller: when the queue is full
+    the row is dropped and counted. With ``block`` it waits for room
+    instead, so a slow sink holds back the consumer; ``landed`` then tells
+    the caller which offsets reached the sink, and stops advancing once a
+    row had to be dropped at shutdown. Failed flushes are retried with
+    backoff on the background thread.
+    """
+
+    def __init__(self, writer: BatchWriter, max_queue: int = 50000, block: bool = False):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.block = block
+        self.dropped = 0
+        # Snapshot of writer.landed published by the background thread
+        self.landed = {}
+        self._complete = True
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{writer.name}-writer", daemon=True)
+        self._thread.start()
+        QUEUE_DEPTH.track(self.queue.qsize, sink=writer.name)
+
+    def submit(self, row, message=None, stop_event=None) -> bool:
+        """Queues a row; ``message`` is the Kafka record it came from, tracked for ``landed``."""
+        if self._put((row, message), stop_event):
+            return True
+        self.dropped += 1
+        QUEUE_DROPPED.inc(sink=self.writer.name)
+        if self.dropped % 1000 == 1:
+            logging.warning(f"⚠️ {self.writer.name} queue full, dropped {self.dropped} rows so far")
+        return False
+
+    def skip(self, message, stop_event=None):
+        """Advances ``landed`` past a record that produced no row."""
+        self._put((None, message), stop_event)
+
+    def forget(self, partitions):
+        """Drops ``landed`` for partitions given up in a rebalance."""
+        partitions = list(partitions)
+        self.landed = {tp: offset for tp, offset in self.landed.items() if tp not in partitions}
+        self.queue.put((_FORGET, partitions))
+
+    def _put(self, item, stop_event) -> bool:
+        if not self.block:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                return False
+        # Backpressure: wait for room until the caller stops
+        while True:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if stop_event is not None and stop_event.is_set():
+                    # The sink now misses a row, so its offsets must not be trusted past this point
+                    self._complete = False
+                    return False
+
+    def _flush(self):
+        backoff = 1.0
+        while self.writer.flush() is None:
+            if self._stopping.wait(backoff):
+                # Give up on a dead sink at shutdown rather than hang forever
+                if self.writer.flush() is None:
+                    logging.error(f"❌ Discarding {len(self.writer)} unflushed rows for {self.writer.name}")
+                    self.writer.discard()
+                    return
+                break
+            backoff = min(backoff * 2, 30.0)
+        if self._complete:
+            self.landed = dict(self.writer.landed)
+
+    def _run(self):
+        while True:
+            try:
+                row = self.queue.get(timeout=min(self.writer.max_linger_seconds, 0.5))
+            except queue.Empty:
+                row = None
+
+            if row is _STOP:
+                self._flush()
+                return
+            if row is not None:
+                row, message = row
+                if row is _FORGET:
+                    self.writer.forget(message)
+                elif row is not None:
+                    self.writer.add(row, message)
+                else:
+                    self.writer.skip(message)
+            if self.writer.due():
+                self._flush()
+
+    def stop(self, timeout: float = 30.0):
+        """Flushes what is queued and stops the background thread."""
+        self.queue.put(_STOP)
+        self._stopping.set()
+        self._thread.join(timeout)
+
+
+_STOP = object()
+_FORGET = object()
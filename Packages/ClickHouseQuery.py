@@ -1,62 +1,133 @@
 from Packages.ClickHouseService import ClickHouseService
 from Packages.GeocodingService import GeocodingService
+from Packages.ClickHouseSchema import ClickHouseSchema
+from datetime import datetime, timezone
+from decimal import Decimal
+import hashlib
 import logging
 
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value
+
+
+def _to_date(value):
+    # The day key is the local date of the event's own timestamp, before UTC conversion
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _to_decimal(value):
+    return None if value is None else Decimal(str(value))
+
+
+def _to_int(value):
+    return None if value is None else int(value)
+
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
 class ClickHouseQuery:
+    # Columns written by the consumer; created_at is filled by its DEFAULT
+    TRAFFIC_DATA_COLUMNS = [
+        "stream_id",
+        "timestamp",
+        "day_month_year",
+        "location",
+        "longitude",
+        "latitude",
+        "total_in_area",
+        "estimated_max_people",
+        "label",
+        "type",
+        "fulladdress",
+        "city",
+        "province"
+    ]
+
     def __init__(self):
         self.client = ClickHouseService.get_connection()
-    
+
     def init_traffic_table(self):
-        """Creates the traffic_data table in ClickHouse if it doesn't exist."""
-        self.client.execute("""
-            CREATE TABLE IF NOT EXISTS traffic_data (
-                stream_id String,
-                timestamp DateTime64(3, 'UTC'),
-                location String,
-                longitude Decimal(10, 6),
-                latitude Decimal(10, 6),
-                total_in_area Int32,
-                estimated_max_people Int32,
-                label String,
-                type String,
-                fulladdress Nullable(String),
-                created_at DateTime DEFAULT now()
-            ) ENGINE = ReplacingMergeTree()
-            ORDER BY stream_id
-        """)
-        logging.info("✅ ClickHouse traffic_data table initialized")
-    
+        """Creates or upgrades traffic_data and its rollups (see ClickHouseSchema)."""
+        applied = ClickHouseSchema.from_env(self.client).migrate()
+        logging.info(f"✅ ClickHouse traffic_data table initialized ({len(applied)} migrations applied)")
+
+    # Typed conversion per column, applied once per value while building columns
+    CONVERTERS = {
+        "stream_id": _to_str,
+        "timestamp": _to_datetime,
+        "day_month_year": _to_date,
+        "location": _to_str,
+        "longitude": _to_decimal,
+        "latitude": _to_decimal,
+        "total_in_area": _to_int,
+        "estimated_max_people": _to_int,
+        "label": _to_str,
+        "type": _to_str,
+        "fulladdress": _to_str,
+        "city": _to_str,
+        "province": _to_str
+    }
+
+    def to_columns(self, rows):
+        """
+        Converts row dicts into one typed list per column, in TRAFFIC_DATA_COLUMNS
+        order. Rows without a day key get the date of their timestamp.
+        """
+        return [
+            [_to_date(data.get("day_month_year") or data.get("timestamp")) for data in rows]
+            if column == "day_month_year" else
+            [self.CONVERTERS[column](data.get(column)) for data in rows]
+            for column in self.TRAFFIC_DATA_COLUMNS
+        ]
+
+    def insert_traffic_data_batch(self, rows):
+        """
+        Inserts many rows with a single columnar INSERT, which ClickHouse
+        turns into one part instead of one part per row.
+        """
+        if not rows:
+            return
+
+        insert_query = f"INSERT INTO traffic_data ({', '.join(self.TRAFFIC_DATA_COLUMNS)}) VALUES"
+        self.client.execute(insert_query, self.to_columns(rows), columnar=True, types_check=True,
+                            settings=self.deduplication_settings(rows))
+
+    @staticmethod
+    def deduplication_settings(rows):
+        """
+        Insert settings that make a retried batch a no-op: the token is derived
+        from the readings in the batch, so resending a batch whose first insert
+        was not acknowledged is dropped by traffic_data and by the rollup views.
+        """
+        digest = hashlib.sha1()
+        for data in rows:
+            digest.update(f"{data.get('stream_id')}|{data.get('timestamp')}|{data.get('location')}\n".encode('utf-8'))
+        return {
+            "insert_deduplication_token": f"traffic_data-{len(rows)}-{digest.hexdigest()}",
+            "deduplicate_blocks_in_dependent_materialized_views": 1,
+        }
+
     def insert_traffic_data(self, data):
         """
         Insert traffic data into ClickHouse.
-        ReplacingMergeTree will automatically handle duplicates based on ORDER BY key (stream_id).
+        ReplacingMergeTree collapses repeated writes of the same reading
+        (location, timestamp, stream_id), e.g. from replays; the rollups do
+        not, see ClickHouseSchema.rebuild_rollups.
         """
         try:
-            insert_query = """
-                INSERT INTO traffic_data 
-                (stream_id, timestamp, location, longitude, latitude, total_in_area, estimated_max_people, label, type, fulladdress, created_at)
-                VALUES
-            """
-            
-            # Prepare data tuple
-            values = [(
-                data.get('stream_id'),
-                data.get('timestamp'),
-                data.get('location'),
-                data.get('longitude'),
-                data.get('latitude'),
-                data.get('total_in_area'),
-                data.get('estimated_max_people'),
-                data.get('label'),
-                data.get('type'),
-                data.get('fulladdress'),
-                'now()'
-            )]
-            
-            self.client.execute(insert_query, values)
-            
+            self.insert_traffic_data_batch([data])
+
             logging.info(f"✅ Inserted traffic data to ClickHouse for stream_id: {data.get('stream_id')}")
-            
+
         except Exception as e:
             logging.error(f"❌ Failed to insert traffic data to ClickHouse: {e}")
             raise
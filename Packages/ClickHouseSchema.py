@@ -0,0 +1,249 @@
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# (table, grain in seconds, bucketing function), coarsest first
+ROLLUPS = (
+    ("traffic_rollup_1h", 3600, "toStartOfHour"),
+    ("traffic_rollup_1m", 60, "toStartOfMinute"),
+)
+
+PARTITIONS = {"month": "toYYYYMM(timestamp)", "day": "toDate(timestamp)"}
+SORTING_KEY = "location, timestamp, stream_id"
+LEGACY_TABLE = "traffic_data_v0"
+# Recent insert blocks remembered per table, so a retried batch is dropped
+# instead of written (and rolled up) twice
+DEDUPLICATION_WINDOW = 1000
+COLUMNS = (
+    "stream_id", "timestamp", "day_month_year", "location", "longitude", "latitude", "total_in_area",
+    "estimated_max_people", "label", "type", "fulladdress", "city", "province", "created_at"
+)
+
+# Values for columns a legacy table may lack when its rows are copied over;
+# its day key is the UTC date since the event's own offset was not stored
+_COPY_DEFAULTS = {
+    "day_month_year": "toDate(timestamp)",
+    "fulladdress": "NULL",
+    "city": "NULL",
+    "province": "NULL",
+    "created_at": "now()",
+}
+
+
+def _floor(value: datetime, grain: int) -> datetime:
+    """Start of the ``grain``-second bucket holding ``value``, in UTC; naive values are UTC."""
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromtimestamp(value.timestamp() // grain * grain, tz=timezone.utc)
+
+
+class ClickHouseSchema:
+    """
+    Versioned ClickHouse schema, created or upgraded from code by ``migrate``.
+
+    Applied versions are recorded in ``schema_migrations``; every migration
+    is idempotent, so an interrupted run can simply be repeated.
+
+    1. ``traffic_data`` partitioned by month (or day) and ordered by
+       ``(location, timestamp, stream_id)``, with LowCardinality labels and
+       regions and the ``day_month_year`` key. A table in the old layout
+       (ordered by ``stream_id`` only) is renamed to ``traffic_data_v0`` and
+       its rows are copied into the new one.
+    2. Per-minute and per-hour rollups: AggregatingMergeTree tables fed by
+       materialized views on every insert into ``traffic_data``, backfilled
+       from the rows already there.
+    3. Insert deduplication on all three tables, so a batch retried after an
+       unacknowledged insert is not counted twice in the rollups.
+
+    The views aggregate every insert, including rows that ``traffic_data``
+    later collapses as duplicates (e.g. from a replay); ``rebuild_rollups``
+    recomputes a time range from the deduplicated rows.
+    """
+
+    MIGRATIONS_DDL = """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version UInt32,
+            name String,
+            applied_at DateTime DEFAULT now()
+        ) ENGINE = MergeTree
+        ORDER BY version
+    """
+
+    def __init__(self, client, partition_by: str = "month"):
+        if partition_by not in PARTITIONS:
+            raise ValueError(f"partition_by must be one of {', '.join(PARTITIONS)}")
+        self.client = client
+        self.partition_by = partition_by
+        self.migrations = [
+            (1, "traffic_data_layout", self._traffic_data),
+            (2, "traffic_rollups", self._rollups),
+            (3, "insert_deduplication", self._deduplication),
+        ]
+
+    @classmethod
+    def from_env(cls, client):
+        return cls(client, partition_by=os.getenv("CLICKHOUSE_PARTITION_BY", "month").lower())
+
+    def traffic_data_ddl(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS traffic_data (
+                stream_id String,
+                timestamp DateTime64(3, 'UTC'),
+                day_month_year Date,
+                location LowCardinality(String),
+                longitude Decimal(10, 6),
+                latitude Decimal(10, 6),
+                total_in_area Int32,
+                estimated_max_people Int32,
+                label LowCardinality(String),
+                type LowCardinality(String),
+                fulladdress Nullable(String),
+                city LowCardinality(Nullable(String)),
+                province LowCardinality(Nullable(String)),
+                created_at DateTime DEFAULT now(),
+                INDEX idx_coordinates (longitude, latitude) TYPE minmax GRANULARITY 4
+            ) ENGINE = ReplacingMergeTree(created_at)
+            PARTITION BY {PARTITIONS[self.partition_by]}
+            ORDER BY ({SORTING_KEY})
+            SETTINGS non_replicated_deduplication_window = {DEDUPLICATION_WINDOW}
+        """
+
+    @staticmethod
+    def rollup_ddl(table: str) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket_start DateTime('UTC'),
+                location LowCardinality(String),
+                city LowCardinality(String),
+                province LowCardinality(String),
+                events SimpleAggregateFunction(sum, UInt64),
+                sum_total_in_area SimpleAggregateFunction(sum, Int64),
+                max_total_in_area SimpleAggregateFunction(max, Int32),
+                sum_estimated_max_people SimpleAggregateFunction(sum, Int64)
+            ) ENGINE = AggregatingMergeTree
+            PARTITION BY toYYYYMM(bucket_start)
+            ORDER BY (location, bucket_start, city, province)
+            SETTINGS non_replicated_deduplication_window = {DEDUPLICATION_WINDOW}
+        """
+
+    @staticmethod
+    def rollup_select(function: str, where: str = "", final: bool = False) -> str:
+        # Qualified names: the bare aliases would refer to themselves; a missing region groups as ''
+        # FINAL reads each reading once even before its duplicates are merged away
+        return f"""
+            SELECT {function}(timestamp) AS bucket_start,
+                   location,
+                   ifNull(traffic_data.city, '') AS city,
+                   ifNull(traffic_data.province, '') AS province,
+                   toUInt64(count()) AS events,
+                   toInt64(sum(total_in_area)) AS sum_total_in_area,
+                   max(total_in_area) AS max_total_in_area,
+                   toInt64(sum(estimated_max_people)) AS sum_estimated_max_people
+            FROM traffic_data {'FINAL' if final else ''} {where}
+            GROUP BY bucket_start, location, city, province
+        """
+
+    def _table(self, name: str) -> Optional[dict]:
+        rows = self.client.execute(
+            "SELECT engine, sorting_key FROM system.tables WHERE database = currentDatabase() AND name = %(name)s",
+            {"name": name}
+        )
+        return {"engine": rows[0][0], "sorting_key": rows[0][1]} if rows else None
+
+    def _columns(self, table: str) -> set:
+        rows = self.client.execute(
+            "SELECT name FROM system.columns WHERE database = currentDatabase() AND table = %(table)s",
+            {"table": table}
+        )
+        return {row[0] for row in rows}
+
+    def _traffic_data(self):
+        existing = self._table("traffic_data")
+        if existing is not None and existing["sorting_key"] != SORTING_KEY:
+            if self._table(LEGACY_TABLE) is not None:
+                raise RuntimeError(f"{LEGACY_TABLE} already exists; drop or rename it before upgrading traffic_data")
+            logger.info(f"🗄️ traffic_data is ordered by ({existing['sorting_key']}), moving it to {LEGACY_TABLE}")
+            self.client.execute(f"RENAME TABLE traffic_data TO {LEGACY_TABLE}")
+            self.client.execute(self.traffic_data_ddl())
+            self._copy_legacy()
+            return
+        self.client.execute(self.traffic_data_ddl())
+
+    def _copy_legacy(self):
+        available = self._columns(LEGACY_TABLE)
+        select = [name if name in available else f"{_COPY_DEFAULTS[name]} AS {name}" for name in COLUMNS]
+        self.client.execute(
+            f"INSERT INTO traffic_data ({', '.join(COLUMNS)}) SELECT {', '.join(select)} FROM {LEGACY_TABLE}"
+        )
+        logger.info(f"🗄️ Copied {LEGACY_TABLE} into traffic_data; drop {LEGACY_TABLE} once verified")
+
+    def _rollups(self):
+        for table, _, function in ROLLUPS:
+            self.client.execute(self.rollup_ddl(table))
+            exists = self._table(f"{table}_mv") is not None
+            self.client.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_mv TO {table} AS {self.rollup_select(function)}")
+            if not exists:
+                # The cutoff is read once the view exists, so no row is missed:
+                # it is either aggregated by the view or created before the
+                # cutoff. Only rows inserted in the second the view was created
+                # can be counted by both
+                cutoff = self.client.execute("SELECT now()")[0][0]
+                self.client.execute(
+                    f"INSERT INTO {table} {self.rollup_select(function, 'WHERE created_at < %(cutoff)s', final=True)}",
+                    {"cutoff": cutoff}
+                )
+                logger.info(f"🗄️ Created {table} and backfilled it from traffic_data")
+
+    def _deduplication(self):
+        for table in ("traffic_data",) + tuple(table for table, _, _ in ROLLUPS):
+            self.client.execute(
+                f"ALTER TABLE {table} MODIFY SETTING non_replicated_deduplication_window = {DEDUPLICATION_WINDOW}"
+            )
+
+    def rebuild_rollups(self, start: datetime, end: datetime) -> list:
+        """
+        Recomputes the rollup buckets overlapping ``[start, end]`` from the
+        deduplicated rows of ``traffic_data``, e.g. after a replay. Rows
+        inserted into those buckets while the rebuild runs may be counted
+        twice, so rebuild ranges the consumers are no longer writing.
+        Returns the rebuilt ``(table, bucket_start, bucket_end)`` ranges.
+        """
+        rebuilt = []
+        for table, grain, function in ROLLUPS:
+            first, last = _floor(start, grain), _floor(end, grain) + timedelta(seconds=grain)
+            bounds = {"start": first, "end": last}
+            self.client.execute(
+                f"ALTER TABLE {table} DELETE WHERE bucket_start >= %(start)s AND bucket_start < %(end)s",
+                bounds, settings={"mutations_sync": 1}
+            )
+            self.client.execute(
+                f"INSERT INTO {table} "
+                f"{self.rollup_select(function, 'WHERE timestamp >= %(start)s AND timestamp < %(end)s', final=True)}",
+                bounds
+            )
+            logger.info(f"🗄️ Rebuilt {table} from {first.isoformat()} to {last.isoformat()}")
+            rebuilt.append((table, first, last))
+        return rebuilt
+
+    def pending(self) -> list:
+        self.client.execute(self.MIGRATIONS_DDL)
+        applied = {row[0] for row in self.client.execute("SELECT version FROM schema_migrations")}
+        return [(version, name, apply) for version, name, apply in self.migrations if version not in applied]
+
+    def migrate(self) -> list:
+        """Applies every pending migration in order; returns the names applied."""
+        done = []
+        for version, name, apply in self.pending():
+            logger.info(f"🗄️ Applying ClickHouse migration {version}: {name}")
+            apply()
+            self.client.execute("INSERT INTO schema_migrations (version, name) VALUES", [(version, name)])
+            done.append(name)
+        if not done:
+            logger.info("🗄️ ClickHouse schema is up to date")
+        return done
+
@@ -0,0 +1,131 @@
+from datetime import datetime
+from typing import Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the consumer falls back to per-event enrichment
+    np = None
+
+# Character positions in an ISO date and time: YYYY-MM-DD HH:MM:SS
+_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_DASHES = [4, 7]
+_COLONS = [13, 16]
+
+
+class ColumnBatch:
+    """
+    Columnar view of one poll's events for vectorized enrichment.
+
+    Coordinates become float64 arrays (NaN where missing), so coordinate
+    validation, cache-key quantization and day keys are computed for the
+    whole poll at once instead of once per event in Python.
+    """
+
+    def __init__(self, events: Sequence):
+        self.events = events
+        self.latitude = np.array([_float(e.get("latitude")) for e in events], dtype=np.float64)
+        self.longitude = np.array([_float(e.get("longitude")) for e in events], dtype=np.float64)
+        self.timestamp = [e.get("timestamp") for e in events]
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    def __len__(self):
+        return len(self.events)
+
+    def has_coordinates(self):
+        return ~(np.isnan(self.latitude) | np.isnan(self.longitude))
+
+    def valid_coordinates(self):
+        """Mask of events whose coordinates pass ``GeocodingService.validate_coordinates``."""
+        with np.errstate(invalid="ignore"):
+            return (
+                (self.longitude >= -180) & (self.longitude <= 180)
+                & (self.latitude >= -90) & (self.latitude <= 90)
+            )
+
+    def unique_coordinates(self, mask, precision: Optional[int] = None):
+        """
+        Groups the masked events by coordinate, quantized to ``precision``
+        decimal places like the geocoding cache key (exact when None).
+
+        Returns ``(positions, group)``: the index of the first event of every
+        distinct coordinate, and for every event its group number (-1 where
+        masked out), so each distinct coordinate is geocoded once. Groups are
+        numbered in order of first appearance.
+        """
+        group = np.full(len(self.events), -1, dtype=np.int64)
+        selected = np.flatnonzero(mask)
+        if not len(selected):
+            return selected, group
+        keys = np.column_stack((self.latitude[selected], self.longitude[selected]))
+        if precision is not None:
+            keys = np.round(keys, precision)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        group[selected] = rank[inverse.reshape(-1)]
+        return selected[first[order]], group
+
+    def day_keys(self, fallback) -> list:
+        """
+        ``YYYY-MM-DD`` day key of every event's own timestamp, or None where
+        it cannot be parsed.
+
+        ISO timestamp strings carry their local date in the first ten
+        characters. Their date and time part is validated for the whole
+        batch at once and only the distinct suffixes (fraction and offset)
+        are parsed in Python, so a string is accepted exactly when
+        ``datetime.fromisoformat`` would accept it. Anything else goes
+        through ``fallback`` one by one.
+        """
+        days = [None] * len(self.events)
+        strings = np.array([i for i, value in enumerate(self.timestamp) if isinstance(value, str)], dtype=np.int64)
+        done = np.zeros(len(self.events), dtype=bool)
+        if len(strings):
+            values = np.array([self.timestamp[i] for i in strings], dtype=str)
+            heads = values.astype("U19")
+            chars = heads.view("U1").reshape(-1, 19)
+            shaped = (
+                (np.char.str_len(heads) == 19)
+                & np.isin(chars[:, _DIGITS], list("0123456789")).all(axis=1)
+                & (chars[:, _DASHES] == "-").all(axis=1)
+                & np.isin(chars[:, 10], ["T", " "])
+                & (chars[:, _COLONS] == ":").all(axis=1)
+            )
+            try:
+                # Out-of-range months, days, hours etc. fail here
+                heads[shaped].astype("datetime64[s]")
+            except ValueError:
+                shaped[:] = False
+
+            tails = np.array([value[19:] for value in values[shaped]], dtype=str)
+            if len(tails):
+                distinct, inverse = np.unique(tails, return_inverse=True)
+                accepted = np.array([_valid_suffix(tail) for tail in distinct], dtype=bool)
+                shaped[np.flatnonzero(shaped)] = accepted[inverse.reshape(-1)]
+
+            for i, day in zip(strings[shaped], heads[shaped].astype("U10")):
+                days[i] = str(day)
+            done[strings[shaped]] = True
+
+        for i in np.flatnonzero(~done):
+            try:
+                days[i] = fallback(self.timestamp[i])
+            except (TypeError, ValueError, AttributeError):
+                days[i] = None
+        return days
+
+
+def _valid_suffix(tail: str) -> bool:
+    try:
+        datetime.fromisoformat("2000-01-01T00:00:00" + tail.replace('Z', '+00:00'))
+        return True
+    except ValueError:
+        return False
+
+
+def _float(value):
+    return np.nan if value is None else float(value)
@@ -0,0 +1,151 @@
+import struct
+import zlib
+from typing import List
+from Packages.ConfigService import ConfigService
+
+# Registry of compact layouts by schema id. An id's layout never changes:
+# a changed traffic_data field list is added under the next id, so records
+# written with an earlier layout still decode
+_schemas = ConfigService.load()['compact_schemas']
+
+# 0xC1 is never used by MessagePack and cannot start a JSON document, so
+# compact records are recognisable without their content-type header
+MAGIC = 0xC1
+# Version 1 records carried a crc32 fingerprint of the layout instead of its id
+VERSION = 2
+
+_DOUBLE = struct.Struct("<d")
+_HEADER = struct.Struct(">BBI")
+
+
+def _layout(schema):
+    """Field layout of one registry entry."""
+    return tuple((field, schema['types'][field]) for field in schema['fields'])
+
+
+def _fingerprint(layout) -> int:
+    return zlib.crc32(",".join(f"{field}:{kind}" for field, kind in layout).encode("utf-8"))
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+        if shift > 63:
+            raise ValueError("Varint too long")
+
+
+class CompactCodec:
+    """
+    Versioned binary encoding of traffic events with layouts taken from the
+    ``compact_schemas`` registry of Config.json.
+
+    A record is ``MAGIC, VERSION, schema id`` followed by the event count
+    and, per event, a presence bitmap and the present values in the
+    layout's field order: strings as varint length plus UTF-8, numbers as
+    float64 and integers as zigzag varints. Field names are never repeated,
+    so records are a fraction of the JSON size. Records are written with the
+    highest schema id and decoded with the layout of the id they carry;
+    fields outside a layout are not carried.
+    """
+
+    def __init__(self, schemas=None, schema_id=None):
+        schemas = schemas or _schemas
+        self.layouts = {int(number): _layout(schema) for number, schema in schemas.items()}
+        self.schema_id = max(self.layouts) if schema_id is None else schema_id
+        self.layout = self.layouts[self.schema_id]
+        self._fingerprints = {_fingerprint(layout): number for number, layout in self.layouts.items()}
+
+    @staticmethod
+    def is_compact(value: bytes) -> bool:
+        return bool(value) and value[0] == MAGIC
+
+    def encode(self, events: List[dict]) -> bytes:
+        out = bytearray(_HEADER.pack(MAGIC, VERSION, self.schema_id))
+        _write_varint(out, len(events))
+        bitmap_bytes = (len(self.layout) + 7) // 8
+        for event in events:
+            bitmap_at = len(out)
+            out.extend(bytes(bitmap_bytes))
+            for index, (field, kind) in enumerate(self.layout):
+                value = event.get(field)
+                if value is None:
+                    continue
+                out[bitmap_at + index // 8] |= 1 << (index % 8)
+                if kind == "string":
+                    if not isinstance(value, str):
+                        raise ValueError(f"{field} must be a string, got {type(value).__name__}")
+                    encoded = value.encode("utf-8")
+                    _write_varint(out, len(encoded))
+                    out.extend(encoded)
+                elif kind == "number":
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        raise ValueError(f"{field} must be a number, got {type(value).__name__}")
+                    out.extend(_DOUBLE.pack(value))
+                else:
+                    if isinstance(value, float) and value.is_integer():
+                        value = int(value)
+                    if isinstance(value, bool) or not isinstance(value, int):
+                        raise ValueError(f"{field} must be an integer, got {type(value).__name__}")
+                    _write_varint(out, (value << 1) ^ (value >> 63))
+        return bytes(out)
+
+    def decode(self, data: bytes) -> List[dict]:
+        if len(data) < _HEADER.size:
+            raise ValueError("Compact record too short")
+        magic, version, schema = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a compact record")
+        if version == 1:
+            schema = self._fingerprints.get(schema)
+        elif version != VERSION:
+            raise ValueError(f"Unsupported compact record version {version}")
+        layout = self.layouts.get(schema)
+        if layout is None:
+            raise ValueError("Compact record was written with a schema missing from compact_schemas in Config.json")
+        bitmap_bytes = (len(layout) + 7) // 8
+
+        try:
+            count, position = _read_varint(data, _HEADER.size)
+            events = []
+            for _ in range(count):
+                bitmap = data[position:position + bitmap_bytes]
+                position += bitmap_bytes
+                event = {}
+                for index, (field, kind) in enumerate(layout):
+                    if not bitmap[index // 8] & (1 << (index % 8)):
+                        continue
+                    if kind == "string":
+                        length, position = _read_varint(data, position)
+                        end = position + length
+                        if end > len(data):
+                            raise ValueError("Truncated compact record")
+                        event[field] = data[position:end].decode("utf-8")
+                        position = end
+                    elif kind == "number":
+                        event[field] = _DOUBLE.unpack_from(data, position)[0]
+                        position += _DOUBLE.size
+                    else:
+                        raw, position = _read_varint(data, position)
+                        event[field] = (raw >> 1) ^ -(raw & 1)
+                events.append(event)
+        except (IndexError, struct.error) as e:
+            raise ValueError(f"Truncated compact record: {e}")
+        if position != len(data):
+            raise ValueError("Trailing bytes after compact record")
+        return events
+
+
+CODEC = CompactCodec()
@@ -0,0 +1,15 @@
+import os
+import json
+
+
+class ConfigService:
+    _config = None
+
+    @staticmethod
+    def load() -> dict:
+        """Loads Configs/Config.json once per process."""
+        if ConfigService._config is None:
+            config_path = os.path.join(os.path.dirname(__file__), '..', 'Configs', 'Config.json')
+            with open(config_path, 'r') as f:
+                ConfigService._config = json.load(f)
+        return ConfigService._config
@@ -0,0 +1,209 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+from Packages.GeocodingService import GeocodingService
+from Packages.ColumnBatch import ColumnBatch
+from Packages.Metrics import REGISTRY, sampled_log
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMPTY_ADDRESS = {"city": None, "province": None, "fulladdress": None}
+
+LOOKUPS = REGISTRY.counter("enrichment_lookups_total", "Geocoding lookups started, or joined onto an identical in-flight one", ["result"])
+IN_FLIGHT = REGISTRY.gauge("enrichment_in_flight_lookups", "Distinct geocoding lookups currently running")
+PENDING = REGISTRY.gauge("enrichment_pending_messages", "Messages waiting for their geocoding result")
+
+
+class EnrichmentStage:
+    """
+    Bounded concurrent geocoding stage for the consumer.
+
+    Lookups run on a thread pool and identical in-flight coordinates share one
+    request. Results are released strictly in input order, so per-partition
+    ordering is preserved, and at most ``max_in_flight`` messages are pending
+    at any time, which holds back the next poll.
+    """
+
+    def __init__(self, enrich, max_workers: int = 4, max_in_flight: int = 256, defer: bool = False):
+        self.enrich = enrich
+        self.max_in_flight = max_in_flight
+        # Deferred mode writes rows without an address; AddressBackfill fills them in later
+        self.defer = defer
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geocode")
+
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.coalesced = 0
+        self._pending = 0
+        IN_FLIGHT.track(lambda: len(self._in_flight))
+        PENDING.track(lambda: self._pending)
+
+    @classmethod
+    def from_env(cls, enrich):
+        return cls(
+            enrich,
+            max_workers=int(os.getenv("GEOCODING_WORKERS", "4")),
+            max_in_flight=int(os.getenv("GEOCODING_MAX_IN_FLIGHT", "256")),
+            defer=os.getenv("GEOCODING_MODE", "inline").lower() == "deferred"
+        )
+
+    def key(self, latitude, longitude):
+        """Identity of a coordinate for lookups: the cache key, or the exact coordinate without a cache."""
+        cache = GeocodingService.get_cache()
+        if cache is not None:
+            return cache.key(latitude, longitude)
+        return (float(latitude), float(longitude))
+
+    def geocode(self, latitude, longitude) -> Future:
+        """Returns a future for the address, joining an identical in-flight lookup if there is one."""
+        key = self.key(latitude, longitude)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                LOOKUPS.inc(result="coalesced")
+                return future
+
+            future = self.executor.submit(GeocodingService.reverse_geocode, latitude, longitude)
+            self._in_flight[key] = future
+            self.lookups += 1
+            LOOKUPS.inc(result="started")
+
+        future.add_done_callback(lambda _, key=key: self._release(key))
+        return future
+
+    def _release(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def submit(self, data) -> Future:
+        longitude = data.get("longitude")
+        latitude = data.get("latitude")
+
+        if longitude is not None and latitude is not None and not self.defer:
+            if GeocodingService.validate_coordinates(latitude, longitude):
+                return self.geocode(latitude, longitude)
+            sampled_log(logging.WARNING, "invalid-coordinates", f"⚠️ Invalid coordinates ({latitude}, {longitude})")
+
+        done = Future()
+        done.set_result(EMPTY_ADDRESS)
+        return done
+
+    def _complete(self, message, data, future):
+        if data is None:
+            return message, None
+        try:
+            try:
+                results = future.result()
+            except Exception as e:
+                sampled_log(logging.ERROR, "geocoding-failed", f"Geocoding failed for stream_id {data.get('stream_id')}: {e}")
+                results = EMPTY_ADDRESS
+            return message, self.enrich(data, results)
+        except Exception as e:
+            logging.error(f"Error processing message: {e}")
+            return message, None
+
+    def process(self, events):
+        """
+        Takes ``(message, data)`` pairs and yields ``(message, enriched_data)``
+        in input order. A Kafka message carrying a batch appears once per event.
+        ``enriched_data`` is None when the event could not be decoded or enriched.
+        """
+        pending = deque()
+        for message, data in events:
+            future = None
+            if data is not None:
+                try:
+                    future = self.submit(data)
+                except Exception as e:
+                    future = Future()
+                    future.set_exception(e)
+            pending.append((message, data, future))
+            self._pending = len(pending)
+
+            while pending and (len(pending) >= self.max_in_flight or pending[0][2] is None or pending[0][2].done()):
+                yield self._complete(*pending.popleft())
+
+        while pending:
+            yield self._complete(*pending.popleft())
+        self._pending = 0
+
+    def process_batch(self, events, day_key):
+        """
+        Columnar variant of ``process`` for one whole poll.
+
+        Coordinates are validated and grouped, and day keys derived, for the
+        batch at once (see ``ColumnBatch``); each distinct coordinate is
+        geocoded once, with at most ``max_in_flight`` lookups started ahead of
+        the event being released. ``enrich`` is called as ``enrich(data,
+        results, day_month_year)``. Events whose timestamp cannot be parsed
+        yield None.
+        """
+        events = list(events)
+        decoded = [data for _, data in events if data is not None]
+        if not decoded:
+            yield from ((message, None) for message, _ in events)
+            return
+
+        batch = ColumnBatch(decoded)
+        present = batch.has_coordinates()
+        valid = batch.valid_coordinates()
+        invalid = int((present & ~valid).sum())
+        if invalid:
+            sampled_log(logging.WARNING, "invalid-coordinates", f"⚠️ {invalid} events with invalid coordinates in batch")
+
+        if self.defer:
+            valid[:] = False
+        cache = GeocodingService.get_cache()
+        positions, group = batch.unique_coordinates(valid, cache.precision if cache is not None else None)
+        futures = []
+
+        def submit_through(number):
+            # Groups are numbered by first appearance, so lookups start in event order
+            while len(futures) < min(number + self.max_in_flight, len(positions)):
+                data = decoded[positions[len(futures)]]
+                try:
+                    futures.append(self.geocode(data.get("latitude"), data.get("longitude")))
+                except Exception as e:
+                    future = Future()
+                    future.set_exception(e)
+                    futures.append(future)
+
+        days = batch.day_keys(day_key)
+        self._pending = len(decoded)
+        submit_through(0)
+
+        index = 0
+        for message, data in events:
+            if data is None:
+                yield message, None
+                continue
+            day, number = days[index], group[index]
+            index += 1
+            if day is None:
+                sampled_log(logging.ERROR, "invalid-timestamp", f"Unparseable timestamp for stream_id {data.get('stream_id')}")
+                yield message, None
+                continue
+            if number >= 0:
+                submit_through(number)
+            try:
+                results = futures[number].result() if number >= 0 else EMPTY_ADDRESS
+            except Exception as e:
+                sampled_log(logging.ERROR, "geocoding-failed", f"Geocoding failed for stream_id {data.get('stream_id')}: {e}")
+                results = EMPTY_ADDRESS
+            try:
+                yield message, self.enrich(data, results, day)
+            except Exception as e:
+                logging.error(f"Error processing message: {e}")
+                yield message, None
+        self._pending = 0
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
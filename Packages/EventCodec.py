@@ -0,0 +1,149 @@
+import json
+from typing import List, Optional, Tuple
+from Packages.CompactCodec import CODEC as COMPACT_CODEC
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+CONTENT_TYPE_HEADER = "content-type"
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+COMPACT = "application/x-traffic-compact"
+
+
+class EventCodec:
+    """
+    Encodings of traffic events on the ws_incoming topic.
+
+    A Kafka record holds either one event object or an array of events, in
+    JSON, MessagePack or the compact binary format (see ``CompactCodec``).
+    The encoding travels in the ``content-type`` record header; records
+    without it are JSON, or compact when they start with its magic byte.
+    """
+
+    @staticmethod
+    def supports(content_type: str) -> bool:
+        return content_type in (JSON, COMPACT) or (content_type == MSGPACK and msgpack is not None)
+
+    @staticmethod
+    def _events(obj) -> List[dict]:
+        events = obj if isinstance(obj, list) else [obj]
+        for event in events:
+            if not isinstance(event, dict):
+                raise ValueError(f"Expected an event object, got {type(event).__name__}")
+        return events
+
+    @staticmethod
+    def parse_text_frame(text: str) -> Tuple[List[dict], bytes]:
+        """
+        Parses a JSON object, JSON array or NDJSON frame.
+
+        Returns the events and a payload that can be forwarded to Kafka as-is:
+        the original bytes for JSON, or the lines joined into one JSON array
+        for NDJSON, so events are never re-serialized one by one. An NDJSON
+        line holding an array contributes each of its events.
+        """
+        stripped = text.strip()
+        try:
+            return EventCodec._events(json.loads(stripped)), stripped.encode("utf-8")
+        except json.JSONDecodeError:
+            lines = [line.strip() for line in stripped.splitlines() if line.strip()]
+            if len(lines) < 2:
+                raise
+            events, parts = [], []
+            for line in lines:
+                parsed = json.loads(line)
+                events.extend(EventCodec._events(parsed))
+                # An array line is spliced in by its elements, not nested
+                part = line[1:-1].strip() if isinstance(parsed, list) else line
+                if part:
+                    parts.append(part.encode("utf-8"))
+            return events, b"[" + b",".join(parts) + b"]"
+
+    @staticmethod
+    def decode_lines(lines: List[bytes]) -> Tuple[List[dict], int]:
+        """
+        Decodes NDJSON lines, each an event object or array of events, with
+        one parse for all of them. Returns the events and the number of
+        lines that were not valid JSON, which are dropped.
+        """
+        try:
+            parsed = _loads(b"[" + b",".join(lines) + b"]")
+            undecodable = 0
+        except ValueError:
+            parsed, undecodable = [], 0
+            for line in lines:
+                try:
+                    parsed.append(_loads(line))
+                except ValueError:
+                    undecodable += 1
+        events = []
+        for item in parsed:
+            if isinstance(item, list):
+                events.extend(item)
+            else:
+                events.append(item)
+        return events, undecodable
+
+    @staticmethod
+    def parse_binary_frame(data: bytes) -> List[dict]:
+        """Parses a MessagePack frame holding one event map or an array of them."""
+        if msgpack is None:
+            raise ValueError("MessagePack support requires the msgpack package")
+        return EventCodec._events(msgpack.unpackb(data, raw=False))
+
+    @staticmethod
+    def is_compact(value) -> bool:
+        return isinstance(value, (bytes, bytearray)) and COMPACT_CODEC.is_compact(value)
+
+    @staticmethod
+    def content_type(headers) -> str:
+        for name, value in headers or []:
+            if name == CONTENT_TYPE_HEADER:
+                return value.decode("utf-8") if isinstance(value, bytes) else value
+        return JSON
+
+    @staticmethod
+    def headers(content_type: str) -> Optional[list]:
+        if content_type == JSON:
+            return None
+        return [(CONTENT_TYPE_HEADER, content_type.encode("utf-8"))]
+
+    @staticmethod
+    def decode(value: bytes, content_type: str = JSON) -> List[dict]:
+        """Decodes a Kafka record value into its list of events."""
+        if content_type == MSGPACK:
+            return EventCodec.parse_binary_frame(value)
+        if content_type == COMPACT or COMPACT_CODEC.is_compact(value):
+            return COMPACT_CODEC.decode(value)
+        # orjson parses bytes directly when it is installed
+        return EventCodec._events(_loads(value))
+
+    @staticmethod
+    def encode(events: List[dict], content_type: str = JSON) -> bytes:
+        """Encodes events into one record value; a single JSON event stays an object."""
+        if content_type == COMPACT:
+            return COMPACT_CODEC.encode(events)
+        if content_type == MSGPACK:
+            return msgpack.packb(events if len(events) != 1 else events[0])
+        return json.dumps(events if len(events) != 1 else events[0]).encode("utf-8")
+
+    @staticmethod
+    def group_by_stream(events: List[dict]) -> List[Tuple[Optional[str], List[dict]]]:
+        """
+        Splits events into ``(stream_id, events)`` groups in first-seen order,
+        keeping the order of events within each stream.
+        """
+        groups = {}
+        for event in events:
+            stream_id = event.get("stream_id")
+            groups.setdefault(stream_id if stream_id is None else str(stream_id), []).append(event)
+        return list(groups.items())
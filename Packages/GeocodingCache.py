@@ -0,0 +1,139 @@
+import os
+import time
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodingCache:
+    """
+    Two-tier cache for reverse geocoding results.
+
+    Coordinates are rounded to a fixed number of decimal places so that
+    readings from the same camera share one entry. Hot entries live in an
+    in-process LRU with TTL, backed by a SQLite file that survives restarts.
+    """
+
+    def __init__(self, precision: int = 4, max_entries: int = 10000,
+                 ttl_seconds: float = 86400.0, db_path: Optional[str] = None):
+        self.precision = precision
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if db_path:
+            self._open_db(db_path)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            precision=int(os.getenv("GEOCODING_CACHE_PRECISION", "4")),
+            max_entries=int(os.getenv("GEOCODING_CACHE_SIZE", "10000")),
+            ttl_seconds=float(os.getenv("GEOCODING_CACHE_TTL", "86400")),
+            db_path=os.getenv("GEOCODING_CACHE_PATH") or None
+        )
+
+    def _open_db(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                lat_key REAL NOT NULL,
+                lon_key REAL NOT NULL,
+                result TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                PRIMARY KEY (lat_key, lon_key)
+            )
+        """)
+        self._db.commit()
+
+    def key(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        return (round(float(latitude), self.precision), round(float(longitude), self.precision))
+
+    def get(self, latitude: float, longitude: float) -> Optional[dict]:
+        key = self.key(latitude, longitude)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, stored_at = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT result, stored_at FROM geocode_cache WHERE lat_key = ? AND lon_key = ?",
+                    key
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    result = json.loads(row[0])
+                    self._store_memory(key, result, row[1])
+                    self.disk_hits += 1
+                    return result
+
+            self.misses += 1
+            return None
+
+    def put(self, latitude: float, longitude: float, result: dict):
+        key = self.key(latitude, longitude)
+        now = time.time()
+
+        with self._lock:
+            self._store_memory(key, result, now)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO geocode_cache (lat_key, lon_key, result, stored_at) VALUES (?, ?, ?, ?)",
+                        (key[0], key[1], json.dumps(result), now)
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to persist geocoding cache entry {key}: {e}")
+
+    def _store_memory(self, key, result, stored_at):
+        self._entries[key] = (result, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries)
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM geocode_cache")
+                self._db.commit()
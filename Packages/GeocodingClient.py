@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from itertools import count
+from typing import List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from Packages.Metrics import REGISTRY
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RATE_WAIT_SECONDS = REGISTRY.histogram("geocoder_rate_limit_wait_seconds", "Time a lookup waited for a rate limit token")
+CIRCUIT_STATE = REGISTRY.gauge("geocoder_circuit_state", "Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open)", ["endpoint"])
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class RateLimited(Exception):
+    """Raised when no request token became available within the wait limit."""
+
+
+class CircuitOpen(Exception):
+    """Raised without a request when every endpoint's circuit is open."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: ``rate`` requests per second on average with
+    bursts of up to ``burst``. A ``rate`` of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token, returning how long to wait before it may be used."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, max_wait: float) -> bool:
+        if self.rate <= 0:
+            return True
+        delay = self._reserve()
+        if delay > max_wait:
+            # Give the token back; the caller will not use it
+            with self._lock:
+                self._tokens += 1
+            return False
+        if delay:
+            time.sleep(delay)
+        RATE_WAIT_SECONDS.observe(delay)
+        return True
+
+
+class CircuitBreaker:
+    """
+    Opens when at least ``failure_ratio`` of the last ``window`` requests
+    failed (once ``min_requests`` were seen), so callers fail fast instead of
+    waiting out timeouts. After ``open_seconds`` one trial request is let
+    through; its success closes the circuit, its failure reopens it.
+    """
+
+    def __init__(self, name: str, failure_ratio: float = 0.5, window: int = 20,
+                 min_requests: int = 5, open_seconds: float = 30.0):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._opened_at = None
+        self._trial = False
+        self.state = CLOSED
+        self.reason = None
+        CIRCUIT_STATE.set(0, endpoint=name)
+
+    def _set(self, state):
+        if state != self.state:
+            logger.warning(f"⚡ Geocoding circuit for {self.name} {self.state} -> {state}"
+                           + (f": {self.reason}" if state == OPEN else ""))
+        self.state = state
+        CIRCUIT_STATE.set(_STATE_VALUES[state], endpoint=self.name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def release(self):
+        """Hands back a half-open trial slot that was not used for a request."""
+        with self._lock:
+            self._trial = False
+
+    def record(self, success: bool, reason: Optional[str] = None):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial = False
+                if success:
+                    self._outcomes.clear()
+                    self.reason = None
+                    self._set(CLOSED)
+                else:
+                    self._open(reason)
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_requests
+                    and failures / len(self._outcomes) >= self.failure_ratio):
+                self._open(reason)
+
+    def _open(self, reason):
+        self.reason = reason
+        self._opened_at = time.monotonic()
+        self._set(OPEN)
+
+
+class Endpoint:
+    __slots__ = ("url", "bucket", "breaker")
+
+    def __init__(self, url, bucket, breaker):
+        self.url = url
+        self.bucket = bucket
+        self.breaker = breaker
+
+
+class GeocodingClient:
+    """
+    Reverse geocoding HTTP client shared by all lookups of a process.
+
+    Requests go through one keep-alive ``requests.Session`` whose connection
+    pool fits the geocoding workers. Lookups are spread round-robin over the
+    configured endpoints; each has its own token bucket matching the
+    provider's quota and its own circuit breaker. Endpoints with an open
+    circuit are skipped, and with none left ``CircuitOpen`` is raised
+    immediately, carrying the reason the circuits opened.
+    """
+
+    def __init__(self, endpoints: List[str], api_key: Optional[str] = None, timeout: float = 5,
+                 rate: float = 0, burst: float = 1, max_wait: float = 5, pool_size: int = 10,
+                 failure_ratio: float = 0.5, window: int = 20, min_requests: int = 5, open_seconds: float = 30):
+        if not endpoints:
+            raise ValueError("At least one geocoding endpoint is required")
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.endpoints = [
+            Endpoint(url, TokenBucket(rate, burst),
+                     CircuitBreaker(url, failure_ratio, window, min_requests, open_seconds))
+            for url in endpoints
+        ]
+        self._next = count()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(endpoints), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "TrafficMonitoringService/1.0"
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    @classmethod
+    def from_env(cls):
+        urls = os.getenv("GEOCODING_API_URL", "https://nominatim.openstreetmap.org/reverse")
+        return cls(
+            [url.strip() for url in urls.split(",") if url.strip()],
+            api_key=os.getenv("GEOCODING_API_KEY") or None,
+            timeout=float(os.getenv("GEOCODING_TIMEOUT", "5")),
+            rate=float(os.getenv("GEOCODING_RATE_LIMIT", "0")),
+            burst=float(os.getenv("GEOCODING_RATE_BURST", "1")),
+            max_wait=float(os.getenv("GEOCODING_RATE_MAX_WAIT", "5")),
+            pool_size=int(os.getenv("GEOCODING_WORKERS", "4")),
+            failure_ratio=float(os.getenv("GEOCODING_CIRCUIT_FAILURE_RATIO", "0.5")),
+            window=int(os.getenv("GEOCODING_CIRCUIT_WINDOW", "20")),
+            min_requests=int(os.getenv("GEOCODING_CIRCUIT_MIN_REQUESTS", "5")),
+            open_seconds=float(os.getenv("GEOCODING_CIRCUIT_OPEN_SECONDS", "30"))
+        )
+
+    def _endpoint(self) -> Endpoint:
+        start = next(self._next)
+        for i in range(len(self.endpoints)):
+            endpoint = self.endpoints[(start + i) % len(self.endpoints)]
+            if endpoint.breaker.allow():
+                return endpoint
+        reasons = "; ".join(f"{e.url}: {e.breaker.reason}" for e in self.endpoints)
+        raise CircuitOpen(f"All geocoding circuits open ({reasons})")
+
+    def get(self, params: dict) -> requests.Response:
+        """
+        Sends one lookup and returns the successful response. HTTP 429 and
+        5xx and every other ``requests`` error (timeouts, connection errors,
+        redirect loops, ...) count against the endpoint's circuit and
+        propagate to the caller.
+        """
+        endpoint = self._endpoint()
+        if not endpoint.bucket.acquire(self.max_wait):
+            endpoint.breaker.release()
+            raise RateLimited(f"No request token for {endpoint.url} within {self.max_wait}s")
+        try:
+            response = self.session.get(endpoint.url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            endpoint.breaker.record(not (status == 429 or (status or 0) >= 500), f"HTTP {status}")
+            raise
+        except requests.exceptions.RequestException as e:
+            # Timeouts, connection and TLS errors, but also redirect loops or a
+            # bad URL: the request never produced a usable answer
+            endpoint.breaker.record(False, type(e).__name__)
+            raise
+        except BaseException:
+            # Anything else says nothing about the endpoint; free a half-open trial slot
+            endpoint.breaker.release()
+            raise
+        endpoint.breaker.record(True)
+        return response
+
+    def close(self):
+        self.session.close()
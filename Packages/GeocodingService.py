@@ -1,53 +1,123 @@
 import os
+import time
 import logging
+import threading
 import requests
 from typing import Optional
 from dotenv import load_dotenv
+from Packages.GeocodingCache import GeocodingCache
+from Packages.OfflineGeocoder import OfflineGeocoder
+from Packages.GeocodingClient import GeocodingClient, CircuitOpen, RateLimited
+from Packages.Metrics import REGISTRY, sampled_log
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+LOOKUPS = REGISTRY.counter("geocoder_lookups_total", "Reverse geocoding lookups by where they were answered", ["source"])
+REQUEST_SECONDS = REGISTRY.histogram("geocoder_request_seconds", "Latency of geocoding API requests")
+ERRORS = REGISTRY.counter("geocoder_errors_total", "Failed geocoding API requests", ["kind"])
+
 
 class GeocodingService:
+    # Lookups run on the enrichment thread pool; the shared objects below are
+    # built once, under this lock
+    _lock = threading.Lock()
+    _configured = False
+    _offline_backend = False
+    _cache_enabled = True
+    _cache = None
+    _offline = None
+    _client = None
+
+    @staticmethod
+    def configure():
+        """
+        Reads GEOCODING_BACKEND and GEOCODING_CACHE_ENABLED. Called on the
+        first lookup; call it again to pick up changed variables.
+        """
+        with GeocodingService._lock:
+            GeocodingService._offline_backend = os.getenv("GEOCODING_BACKEND", "nominatim").lower() == "offline"
+            GeocodingService._cache_enabled = os.getenv("GEOCODING_CACHE_ENABLED", "true").lower() == "true"
+            GeocodingService._configured = True
+
     @staticmethod
     def validate_coordinates(latitude: float, longitude: float) -> bool:
         return -180 <= longitude <= 180 and -90 <= latitude <= 90
 
+    @staticmethod
+    def get_cache() -> Optional[GeocodingCache]:
+        """
+        Returns the shared geocoding cache, or None when disabled
+        through GEOCODING_CACHE_ENABLED.
+        """
+        if not GeocodingService._configured:
+            GeocodingService.configure()
+        if not GeocodingService._cache_enabled:
+            return None
+        if GeocodingService._cache is None:
+            with GeocodingService._lock:
+                if GeocodingService._cache is None:
+                    GeocodingService._cache = GeocodingCache.from_env()
+        return GeocodingService._cache
+
+    @staticmethod
+    def get_offline_geocoder() -> OfflineGeocoder:
+        if GeocodingService._offline is None:
+            with GeocodingService._lock:
+                if GeocodingService._offline is None:
+                    GeocodingService._offline = OfflineGeocoder.from_env()
+        return GeocodingService._offline
+
     @staticmethod
     def reverse_geocode(latitude: float, longitude: float) -> dict:
-        # Get configuration from environment
-        api_url = os.getenv("GEOCODING_API_URL", "https://nominatim.openstreetmap.org/reverse")
-        api_key = os.getenv("GEOCODING_API_KEY")
-        timeout = int(os.getenv("GEOCODING_TIMEOUT", "5"))
-        
-        # Build request parameters
+        if not GeocodingService._configured:
+            GeocodingService.configure()
+        # The offline backend answers from a local index, so it skips the cache
+        if GeocodingService._offline_backend:
+            LOOKUPS.inc(source="offline")
+            return GeocodingService.get_offline_geocoder().reverse_geocode(latitude, longitude)
+
+        cache = GeocodingService.get_cache()
+        if cache is not None:
+            cached = cache.get(latitude, longitude)
+            if cached is not None:
+                LOOKUPS.inc(source="cache")
+                return cached
+
+        LOOKUPS.inc(source="api")
+        result = GeocodingService.fetch_address(latitude, longitude)
+
+        # Only successful lookups are cached so failures get retried
+        if cache is not None and any(result.values()):
+            cache.put(latitude, longitude, result)
+
+        return result
+
+    @staticmethod
+    def get_client() -> GeocodingClient:
+        """Returns the process-wide HTTP client, configured from the environment once."""
+        if GeocodingService._client is None:
+            with GeocodingService._lock:
+                if GeocodingService._client is None:
+                    GeocodingService._client = GeocodingClient.from_env()
+        return GeocodingService._client
+
+    @staticmethod
+    def fetch_address(latitude: float, longitude: float) -> dict:
         params = {
             "lat": latitude,
             "lon": longitude,
             "format": "json"
         }
-        
-        # Build headers
-        headers = {
-            "User-Agent": "TrafficMonitoringService/1.0"
-        }
-        
-        # Include API key if configured
-        if api_key:
-            headers["Authorization"] = f"Bearer {api_key}"
-        
+
+        started = time.perf_counter()
         try:
             # Make API request with timeout
-            response = requests.get(
-                api_url,
-                params=params,
-                headers=headers,
-                timeout=timeout
-            )
-            
-            # Check for HTTP errors
-            response.raise_for_status()
+            try:
+                response = GeocodingService.get_client().get(params)
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - started)
             
             # Parse response
             data = response.json()
@@ -79,15 +149,28 @@ class GeocodingService:
                 "fulladdress": data.get("display_name")
             }
                 
+        except CircuitOpen as e:
+            # Fails fast during an outage instead of waiting out the timeout
+            ERRORS.inc(kind="circuit_open")
+            sampled_log(logging.WARNING, "geocoder-circuit", f"⚡ Geocoding skipped for ({latitude}, {longitude}): {e}", logger)
+            return {"city": None, "province": None, "fulladdress": None}
+        except RateLimited as e:
+            ERRORS.inc(kind="rate_limited")
+            sampled_log(logging.WARNING, "geocoder-rate", f"⚠️ Geocoding skipped for ({latitude}, {longitude}): {e}", logger)
+            return {"city": None, "province": None, "fulladdress": None}
         except requests.exceptions.Timeout:
-            logger.error(f"Geocoding API timeout for coordinates ({latitude}, {longitude})")
+            ERRORS.inc(kind="timeout")
+            sampled_log(logging.ERROR, "geocoder-timeout", f"Geocoding API timeout for coordinates ({latitude}, {longitude})", logger)
             return {"city": None, "province": None, "fulladdress": None}
         except requests.exceptions.HTTPError as e:
-            logger.error(f"Geocoding API HTTP error for coordinates ({latitude}, {longitude}): {e}")
+            ERRORS.inc(kind="http")
+            sampled_log(logging.ERROR, "geocoder-http", f"Geocoding API HTTP error for coordinates ({latitude}, {longitude}): {e}", logger)
             return {"city": None, "province": None, "fulladdress": None}
         except requests.exceptions.RequestException as e:
-            logger.error(f"Geocoding API request failed for coordinates ({latitude}, {longitude}): {e}")
+            ERRORS.inc(kind="request")
+            sampled_log(logging.ERROR, "geocoder-request", f"Geocoding API request failed for coordinates ({latitude}, {longitude}): {e}", logger)
             return {"city": None, "province": None, "fulladdress": None}
         except (ValueError, KeyError) as e:
-            logger.error(f"Failed to parse geocoding API response for coordinates ({latitude}, {longitude}): {e}")
+            ERRORS.inc(kind="parse")
+            sampled_log(logging.ERROR, "geocoder-parse", f"Failed to parse geocoding API response for coordinates ({latitude}, {longitude}): {e}", logger)
             return {"city": None, "province": None, "fulladdress": None}
@@ -0,0 +1,145 @@
+import os
+import queue
+import asyncio
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class PublisherBusy(Exception):
+    """Raised when the publish queue is full and the message was not accepted."""
+
+
+class KafkaPublisher:
+    """
+    Publishes to Kafka from asyncio handlers without blocking the event loop.
+
+    Messages are handed to a dedicated producer thread. The number of
+    messages queued or awaiting broker acknowledgement is bounded by
+    ``max_pending``; when it is reached ``publish`` either waits up to
+    ``wait_timeout`` seconds (policy ``wait``) or fails immediately (policy
+    ``reject``) with PublisherBusy so the caller can push back on the client.
+    ``publish_many`` reserves room for all of its messages before queueing
+    any, so a batch is accepted or rejected as a whole.
+    """
+
+    def __init__(self, producer, max_pending: int = 10000, policy: str = "reject", wait_timeout: float = 1.0):
+        self.producer = producer
+        self.max_pending = max_pending
+        self.policy = policy
+        self.wait_timeout = wait_timeout
+
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+
+        self.published = 0
+        self.failed = 0
+        self.rejected = 0
+
+        self._thread = threading.Thread(target=self._run, name="kafka-publisher", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, producer):
+        return cls(
+            producer,
+            max_pending=int(os.getenv("WS_MAX_PENDING", "10000")),
+            policy=os.getenv("WS_BACKPRESSURE", "reject").lower(),
+            wait_timeout=float(os.getenv("WS_BACKPRESSURE_WAIT", "1.0"))
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _reserve(self, timeout: float, count: int = 1) -> bool:
+        with self._space:
+            if self._pending + count > self.max_pending:
+                if count > self.max_pending or timeout <= 0:
+                    return False
+                if not self._space.wait_for(lambda: self._pending + count <= self.max_pending, timeout):
+                    return False
+            self._pending += count
+            return True
+
+    def _release(self):
+        with self._space:
+            self._pending -= 1
+            self._space.notify_all()
+
+    async def publish(self, topic: str, value, key=None, headers=None) -> asyncio.Future:
+        """
+        Queues ``value`` for ``topic`` and returns a future resolved with the
+        record metadata once the broker acknowledges it.
+        """
+        return (await self.publish_many(topic, [(key, value, headers)]))[0]
+
+    async def publish_many(self, topic: str, records) -> list:
+        """
+        Queues ``(key, value, headers)`` records for ``topic`` all together,
+        or raises PublisherBusy without queueing any. Returns one future per
+        record, as ``publish`` does.
+        """
+        loop = asyncio.get_running_loop()
+        count = len(records)
+
+        if not self._reserve(0, count):
+            if self.policy != "wait" or not await loop.run_in_executor(None, self._reserve, self.wait_timeout, count):
+                self.rejected += 1
+                raise PublisherBusy(f"{self._pending} messages pending, {count} more do not fit")
+
+        futures = []
+        for key, value, headers in records:
+            future = loop.create_future()
+            # Failures are already logged; mark them retrieved for callers that do not await
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._queue.put((topic, value, key, headers, loop, future))
+            futures.append(future)
+        return futures
+
+    def _resolve(self, loop, future, metadata=None, error=None):
+        self._release()
+        if error is None:
+            self.published += 1
+        else:
+            self.failed += 1
+            logger.error(f"❌ Failed to publish to Kafka: {error}")
+
+        def settle():
+            if future.done():
+                return
+            if error is None:
+                future.set_result(metadata)
+            else:
+                future.set_exception(error)
+
+        try:
+            loop.call_soon_threadsafe(settle)
+        except RuntimeError:
+            # Event loop already closed; nobody is waiting for this result
+            pass
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            topic, value, key, headers, loop, future = item
+            try:
+                send = self.producer.send(topic, value=value, key=key, headers=headers)
+                send.add_callback(lambda metadata, loop=loop, future=future: self._resolve(loop, future, metadata))
+                send.add_errback(lambda error, loop=loop, future=future: self._resolve(loop, future, error=error))
+            except Exception as e:
+                self._resolve(loop, future, error=e)
+
+    def close(self, timeout: float = 10.0):
+        """Stops the producer thread and flushes buffered messages."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self.producer.flush(timeout)
@@ -1,37 +1,108 @@
 import os
+import logging
 from dotenv import load_dotenv
 from kafka import KafkaProducer, KafkaConsumer
+from kafka.codec import has_gzip, has_snappy, has_lz4, has_zstd
+from Packages.EventCodec import EventCodec
 import json
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Broker-side compression codecs and whether their Python library is installed
+_CODECS = {"gzip": has_gzip, "snappy": has_snappy, "lz4": has_lz4, "zstd": has_zstd}
+
+
+def _key_bytes(key):
+    # Record keys are stream ids; the default partitioner hashes them so a stream stays on one partition
+    if key is None or isinstance(key, bytes):
+        return key
+    return str(key).encode('utf-8')
+
+
+def _key_str(key):
+    return None if key is None else key.decode('utf-8', errors='replace')
+
+
 class KafkaService:
+    @staticmethod
+    def compression_type():
+        """
+        KAFKA_COMPRESSION_TYPE if its codec library is installed (lz4 needs
+        ``lz4``, zstd ``zstandard``, snappy ``python-snappy``), otherwise gzip.
+        """
+        codec = (os.getenv("KAFKA_COMPRESSION_TYPE") or "").lower() or None
+        if codec is None or codec == "none":
+            return None
+        check = _CODECS.get(codec)
+        if check is None:
+            raise ValueError(f"Unknown KAFKA_COMPRESSION_TYPE: {codec}")
+        if not check():
+            logger.warning(f"⚠️ {codec} compression library is not installed, using gzip")
+            return "gzip"
+        return codec
+
     @staticmethod
     def get_producer():
+        # Batch records for a few milliseconds instead of one request per send
         return KafkaProducer(
             bootstrap_servers=os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
+            # Pre-encoded payloads (batched frames) are forwarded untouched
+            value_serializer=lambda v: v if isinstance(v, bytes) else json.dumps(v).encode('utf-8'),
+            key_serializer=_key_bytes,
+            linger_ms=int(os.getenv("KAFKA_LINGER_MS", "20")),
+            batch_size=int(os.getenv("KAFKA_BATCH_SIZE", "65536")),
+            compression_type=KafkaService.compression_type()
         )
 
     @staticmethod
-    def get_consumer(topic):
+    def get_consumer(topic, enable_auto_commit=True, group_id=None):
+        """
+        Returns a consumer whose values are decoded automatically: JSON as
+        before, compact records into their list of events.
+        """
         return KafkaConsumer(
             topic,
             bootstrap_servers=os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
+            group_id=group_id or os.getenv("KAFKA_GROUP_ID") or None,
             auto_offset_reset=os.getenv("KAFKA_OFFSET_RESET", "latest"),
-            enable_auto_commit=True,
-            value_deserializer=lambda v: json.loads(v.decode('utf-8'))
+            enable_auto_commit=enable_auto_commit,
+            key_deserializer=_key_str,
+            value_deserializer=lambda v: EventCodec.decode(v) if EventCodec.is_compact(v) else json.loads(v.decode('utf-8'))
         )
     
     @staticmethod
-    def get_raw_consumer(topic):
+    def get_raw_consumer(topic, enable_auto_commit=True, group_id=None, listener=None):
         """
         Returns a Kafka consumer without automatic JSON deserialization.
         Used when manual deserialization with error handling is needed.
+        A ConsumerRebalanceListener can be given to react to partition
+        assignment changes within the consumer group. Keys (stream ids) are
+        decoded to strings.
         """
-        return KafkaConsumer(
-            topic,
+        consumer = KafkaConsumer(
             bootstrap_servers=os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
+            group_id=group_id or os.getenv("KAFKA_GROUP_ID") or None,
             auto_offset_reset=os.getenv("KAFKA_OFFSET_RESET", "latest"),
-            enable_auto_commit=True
+            enable_auto_commit=enable_auto_commit,
+            max_poll_records=int(os.getenv("KAFKA_MAX_POLL_RECORDS", "500")),
+            key_deserializer=_key_str
+        )
+        consumer.subscribe([topic], listener=listener)
+        return consumer
+
+    @staticmethod
+    def get_reader(max_poll_records=None):
+        """
+        Returns a consumer without a consumer group, for reading explicitly
+        assigned partitions and offset ranges (replays) without touching
+        any committed offsets.
+        """
+        return KafkaConsumer(
+            bootstrap_servers=os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
+            group_id=None,
+            enable_auto_commit=False,
+            max_poll_records=max_poll_records or int(os.getenv("KAFKA_MAX_POLL_RECORDS", "500")),
+            key_deserializer=_key_str
         )
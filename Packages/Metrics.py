@@ -0,0 +1,370 @@
+import os
+import sys
+import hmac
+import time
+import logging
+import threading
+import traceback
+from bisect import bisect_left
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers cache hits (sub-millisecond) up to slow geocoder and database calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Gauge set explicitly or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+        self._callbacks = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def track(self, callback, **labels):
+        """Reads ``callback()`` on every scrape, e.g. a queue's current depth."""
+        with self._lock:
+            self._callbacks[self._key(labels)] = callback
+
+    def remove(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+            self._callbacks.pop(key, None)
+
+    def value(self, **labels):
+        key = self._key(labels)
+        callback = self._callbacks.get(key)
+        return callback() if callback is not None else self._values.get(key, 0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            callbacks = list(self._callbacks.items())
+        for key, callback in callbacks:
+            try:
+                values[key] = callback()
+            except Exception:
+                continue
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # key -> [count per bucket (+Inf last), sum, count]
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._series.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """Process-wide set of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class SamplingProfiler:
+    """
+    Opt-in wall-clock sampling profiler for all threads of the process.
+
+    While running, a background thread records every thread's stack each
+    ``interval`` seconds. ``report`` returns the samples in collapsed-stack
+    format (``frame;frame;frame count``), ready for flame graph tools.
+    Nothing is sampled until ``start`` is called.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._stacks = _Tally()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks.clear()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.report()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = [names.get(ident, str(ident))]
+                stack.extend(f"{f.name} ({os.path.basename(f.filename)}:{f.lineno})"
+                             for f in traceback.extract_stack(frame))
+                with self._lock:
+                    self._stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def report(self) -> str:
+        with self._lock:
+            items = self._stacks.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in items) + "\n"
+
+
+PROFILER = SamplingProfiler(interval=float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000)
+# Bearer token for /debug/profile on the metrics server; empty leaves the endpoint off
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+
+
+def profile(seconds: float) -> str:
+    """Samples the process for ``seconds`` and returns collapsed stacks."""
+    if not PROFILER.start():
+        return "profiler already running\n"
+    time.sleep(seconds)
+    return PROFILER.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            body, content_type = REGISTRY.render(), CONTENT_TYPE
+        elif url.path == "/debug/profile" and PROFILER_TOKEN:
+            if not self._authorized():
+                self.send_error(401)
+                return
+            seconds = float(parse_qs(url.query).get("seconds", ["10"])[0])
+            body, content_type = profile(min(seconds, 300)), "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self) -> bool:
+        supplied = self.headers.get("Authorization", "")
+        return hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {PROFILER_TOKEN}".encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """
+    Serves /metrics and, when PROFILER_TOKEN is set, /debug/profile from a
+    daemon thread; returns the server.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class SampledLog:
+    """
+    Rate-limited logging for per-message events: at most one record per
+    ``interval`` seconds per key, carrying how many were suppressed since.
+    """
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self._last = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, level: int, key: str, message: str, log=logging):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            suppressed = self._suppressed.pop(key, 0)
+            self._last[key] = now
+        if suppressed:
+            message = f"{message} (+{suppressed} similar in the last {self.interval:g}s)"
+        log.log(level, message)
+        return True
+
+
+sampled_log = SampledLog(interval=float(os.getenv("LOG_SAMPLE_SECONDS", "10")))
+
+
+def serve_from_env(offset: int = 0):
+    """Starts the metrics server on METRICS_PORT + ``offset`` (one port per worker); None when unset."""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    return serve(int(port) + offset, os.getenv("METRICS_HOST", "127.0.0.1"))
+
+
+def toggle_profiler(signum=None, frame=None):
+    """
+    Signal handler (SIGUSR2) switching the sampling profiler on and off. When
+    switched off, collapsed stacks are written to PROFILER_OUTPUT.
+    """
+    if not PROFILER.running:
+        PROFILER.start()
+        logger.info("🔬 Sampling profiler started")
+        return
+    path = os.getenv("PROFILER_OUTPUT") or f"profile-{os.getpid()}.txt"
+    with open(path, "w") as f:
+        f.write(PROFILER.stop())
+    logger.info(f"🔬 Sampling profiler stopped after {PROFILER.samples} samples, wrote {path}")
@@ -0,0 +1,250 @@
+import os
+import csv
+import json
+import math
+import logging
+from typing import List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+EMPTY_RESULT = {"city": None, "province": None, "fulladdress": None}
+
+
+def _to_xyz(latitude: float, longitude: float) -> tuple:
+    """Projects a coordinate onto the unit sphere so euclidean distance follows great-circle distance."""
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def _point_in_ring(longitude: float, latitude: float, ring: list) -> bool:
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > latitude) != (yj > latitude):
+            if longitude < (xj - xi) * (latitude - yi) / (yj - yi) + xi:
+                inside = not inside
+        j = i
+    return inside
+
+
+class Place:
+    __slots__ = ("city", "province", "fulladdress", "latitude", "longitude", "xyz", "polygons")
+
+    def __init__(self, city, province, fulladdress, latitude, longitude, polygons=None):
+        self.city = city
+        self.province = province
+        self.fulladdress = fulladdress
+        self.latitude = latitude
+        self.longitude = longitude
+        self.xyz = _to_xyz(latitude, longitude)
+        # List of polygons, each a list of rings of [lon, lat] pairs (GeoJSON order)
+        self.polygons = polygons
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        for rings in self.polygons or []:
+            if rings and _point_in_ring(longitude, latitude, rings[0]):
+                if not any(_point_in_ring(longitude, latitude, hole) for hole in rings[1:]):
+                    return True
+        return False
+
+    def as_result(self) -> dict:
+        return {"city": self.city, "province": self.province, "fulladdress": self.fulladdress}
+
+
+class KDTree:
+    """Static 3-d tree over place centroids on the unit sphere."""
+
+    def __init__(self, places: List[Place]):
+        self.root = self._build(list(places), 0)
+
+    def _build(self, places, depth):
+        if not places:
+            return None
+        axis = depth % 3
+        places.sort(key=lambda p: p.xyz[axis])
+        mid = len(places) // 2
+        return (
+            places[mid],
+            axis,
+            self._build(places[:mid], depth + 1),
+            self._build(places[mid + 1:], depth + 1)
+        )
+
+    def nearest(self, xyz: tuple, k: int = 1) -> list:
+        """Returns up to k (squared_distance, place) pairs, nearest first."""
+        best = []
+
+        def visit(node):
+            if node is None:
+                return
+            place, axis, left, right = node
+            dist = sum((a - b) ** 2 for a, b in zip(place.xyz, xyz))
+            if len(best) < k or dist < best[-1][0]:
+                best.append((dist, place))
+                best.sort(key=lambda item: item[0])
+                del best[k:]
+
+            diff = xyz[axis] - place.xyz[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if len(best) < k or diff * diff < best[-1][0]:
+                visit(far)
+
+        visit(self.root)
+        return best
+
+
+class PolygonIndex:
+    """
+    Grid over polygon bounding boxes: every place is listed in each
+    ``cell_degrees`` cell its bounding box overlaps, smallest box first, so a
+    lookup tests only the polygons whose box can contain the point.
+    """
+
+    def __init__(self, places: List[Place], cell_degrees: float = 1.0):
+        self.cell_degrees = cell_degrees
+        self.cells = {}
+        boxes = []
+        for place in places:
+            points = [point for rings in place.polygons for point in (rings[0] if rings else [])]
+            if not points:
+                continue
+            box = (min(p[0] for p in points), min(p[1] for p in points), max(p[0] for p in points), max(p[1] for p in points))
+            boxes.append(((box[2] - box[0]) * (box[3] - box[1]), box, place))
+        for _, box, place in sorted(boxes, key=lambda item: item[0]):
+            for x in range(self._cell(box[0]), self._cell(box[2]) + 1):
+                for y in range(self._cell(box[1]), self._cell(box[3]) + 1):
+                    self.cells.setdefault((x, y), []).append((box, place))
+
+    def _cell(self, degrees: float) -> int:
+        return math.floor(degrees / self.cell_degrees)
+
+    def find(self, latitude: float, longitude: float) -> Optional[Place]:
+        """The smallest polygon containing the point, or None."""
+        for (west, south, east, north), place in self.cells.get((self._cell(longitude), self._cell(latitude)), ()):
+            if west <= longitude <= east and south <= latitude <= north and place.contains(latitude, longitude):
+                return place
+        return None
+
+
+class OfflineGeocoder:
+    """
+    Reverse geocoder answering from a local gazetteer with no network calls.
+
+    Accepts a CSV with city, province, latitude, longitude (and optional
+    fulladdress) columns, or a GeoJSON FeatureCollection of Point or
+    (Multi)Polygon features carrying the same properties. A point inside a
+    polygon resolves to the smallest polygon containing it; otherwise to the
+    nearest place known by its centroid alone.
+    """
+
+    def __init__(self, places: List[Place], max_distance_km: Optional[float] = None):
+        self.places = places
+        self.max_distance_km = max_distance_km
+        self.polygons = PolygonIndex([place for place in places if place.polygons])
+        # A boundary that does not contain the point is never an answer
+        self.tree = KDTree([place for place in places if not place.polygons])
+        logger.info(f"🗺️ Offline geocoder loaded {len(places)} places")
+
+    @classmethod
+    def from_env(cls):
+        path = os.getenv("GEOCODING_GAZETTEER_PATH")
+        if not path:
+            raise ValueError("GEOCODING_GAZETTEER_PATH is required for the offline geocoding backend")
+        max_distance = os.getenv("GEOCODING_OFFLINE_MAX_KM", "50")
+        return cls.from_file(path, float(max_distance) if max_distance else None)
+
+    @classmethod
+    def from_file(cls, path: str, max_distance_km: Optional[float] = None):
+        if path.lower().endswith((".geojson", ".json")):
+            places = cls._load_geojson(path)
+        else:
+            places = cls._load_csv(path)
+        return cls(places, max_distance_km)
+
+    @staticmethod
+    def _fulladdress(name, city, province, explicit=None):
+        if explicit:
+            return explicit
+        parts = [part for part in (name, city, province) if part]
+        # Avoid "Jakarta, Jakarta" when the place name is the city itself
+        return ", ".join(dict.fromkeys(parts)) or None
+
+    @staticmethod
+    def _load_csv(path: str) -> List[Place]:
+        places = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    latitude = float(row["latitude"])
+                    longitude = float(row["longitude"])
+                except (KeyError, TypeError, ValueError):
+                    logger.warning(f"⚠️ Skipping gazetteer row without valid coordinates: {row}")
+                    continue
+                city = row.get("city") or None
+                province = row.get("province") or None
+                fulladdress = OfflineGeocoder._fulladdress(row.get("name"), city, province, row.get("fulladdress"))
+                places.append(Place(city, province, fulladdress, latitude, longitude))
+        return places
+
+    @staticmethod
+    def _load_geojson(path: str) -> List[Place]:
+        with open(path, encoding="utf-8") as f:
+            collection = json.load(f)
+
+        places = []
+        for feature in collection.get("features", []):
+            geometry = feature.get("geometry") or {}
+            props = feature.get("properties") or {}
+            city = props.get("city")
+            province = props.get("province") or props.get("state")
+            fulladdress = OfflineGeocoder._fulladdress(
+                props.get("name"), city, province, props.get("fulladdress") or props.get("display_name")
+            )
+
+            kind = geometry.get("type")
+            coords = geometry.get("coordinates")
+            if kind == "Point":
+                places.append(Place(city, province, fulladdress, coords[1], coords[0]))
+                continue
+            if kind == "Polygon":
+                polygons = [coords]
+            elif kind == "MultiPolygon":
+                polygons = coords
+            else:
+                logger.warning(f"⚠️ Skipping unsupported gazetteer geometry: {kind}")
+                continue
+
+            outer = [point for rings in polygons for point in rings[0]]
+            longitude = sum(point[0] for point in outer) / len(outer)
+            latitude = sum(point[1] for point in outer) / len(outer)
+            places.append(Place(city, province, fulladdress, latitude, longitude, polygons))
+        return places
+
+    def reverse_geocode(self, latitude: float, longitude: float) -> dict:
+        if not self.places:
+            return dict(EMPTY_RESULT)
+
+        place = self.polygons.find(latitude, longitude)
+        if place is not None:
+            return place.as_result()
+
+        candidates = self.tree.nearest(_to_xyz(latitude, longitude))
+        if not candidates:
+            return dict(EMPTY_RESULT)
+        dist, place = candidates[0]
+        if self.max_distance_km is not None and _chord_to_km(math.sqrt(dist)) > self.max_distance_km:
+            return dict(EMPTY_RESULT)
+        return place.as_result()
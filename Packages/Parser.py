@@ -1,7 +1,18 @@
 from Packages.KafkaService import KafkaService
+from kafka import ConsumerRebalanceListener
 from Packages.GeocodingService import GeocodingService
 from Packages.Query import QuerySql
-# from Packages.ClickHouseQuery import ClickHouseQuery
+from Packages.PostgresService import PostgresService
+from Packages.PartitionManager import PartitionManager
+from Packages.Enrichment import EnrichmentStage
+from Packages.ColumnBatch import ColumnBatch
+from Packages.BatchWriter import BatchWriter, BackgroundWriter
+from Packages.ClickHouseQuery import ClickHouseQuery
+from Packages.EventCodec import EventCodec
+from Packages.TrafficEvent import TrafficEvent, InvalidEvent
+from Packages.WindowAggregator import WindowAggregator, BATCHES
+from Packages.AnomalyDetector import AnomalyDetector
+from Packages.Metrics import REGISTRY, SIZE_BUCKETS, sampled_log
 
 import os
 import time
@@ -9,6 +20,7 @@ import logging
 import json
 from dotenv import load_dotenv
 from datetime import datetime
+from kafka.structs import TopicPartition
 
 load_dotenv()
 
@@ -17,6 +29,14 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+POLL_SECONDS = REGISTRY.histogram("consumer_poll_seconds", "Time spent in KafkaConsumer.poll")
+POLL_RECORDS = REGISTRY.histogram("consumer_poll_records", "Records returned per poll", buckets=SIZE_BUCKETS)
+DECODE_SECONDS = REGISTRY.histogram("consumer_decode_seconds", "Time to decode one Kafka record into events")
+EVENTS = REGISTRY.counter("consumer_events_total", "Events seen by the consumer by outcome", ["result"])
+PROCESS_SECONDS = REGISTRY.histogram("consumer_batch_process_seconds", "Time to enrich and buffer one poll batch")
+COMMIT_SECONDS = REGISTRY.histogram("consumer_commit_seconds", "Time to commit offsets after a flush")
+LAG = REGISTRY.gauge("consumer_lag", "Records between the committed position and the partition end", ["topic", "partition"])
+
 class Parser:
     @staticmethod
     def time_to_day_month_year(timestamp):
@@ -28,45 +48,437 @@ class Parser:
         return timestamp.strftime("%Y-%m-%d")
 
 class KafkaParser:
-    def consumer_kafka(topic):
-        
-        consumer = KafkaService.get_consumer(topic)
-        postgres_service = QuerySql()
-        # clickhouse_service = ClickHouseQuery()
+    @staticmethod
+    def enrich(data, results, day_month_year=None):
+        """
+        Adds geocoded address fields and the day key to a traffic message.
+        The day key is derived from the timestamp unless already computed.
+        """
+        data['city'] = results['city']
+        data['province'] = results['province']
+        data['fulladdress'] = results['fulladdress']
+        if day_month_year is None:
+            day_month_year = Parser.time_to_day_month_year(data.get('timestamp'))
+        data['day_month_year'] = day_month_year
+        return data
 
-        logging.info("📡 Consumer listening...")
-        for message in consumer:
+    @staticmethod
+    def decode(messages):
+        """
+        Yields ``(message, TrafficEvent)`` for every event in the polled records.
+        Undecodable records and invalid events yield ``(message, None)`` so
+        their offsets still advance.
+        """
+        for message in messages:
+            started = time.perf_counter()
             try:
-                data = message.value
-                
-                # Get coordinates
-                longitude = data.get('longitude')
-                latitude = data.get('latitude')
-                time = data.get('timestamp')
-                
-                # Reverse geocode to get full address
-                fulladdress = None
-                if longitude is not None and latitude is not None:
-                    if GeocodingService.validate_coordinates(latitude, longitude):
-                        results = GeocodingService.reverse_geocode(latitude, longitude)
-                    else:
-                        logging.warning(f"⚠️ Invalid coordinates ({latitude}, {longitude})")
-                
-                # Add fulladdress to data
-                data['city'] = results['city']
-                data['province'] = results['province']
-                data['fulladdress'] = results['fulladdress']
-                data['day_month_year'] = Parser.time_to_day_month_year(time)
-                
-                # Insert traffic data into PostgreSQL
-                postgres_service.insert_traffic_data(data)
-                
-                # Insert traffic data into ClickHouse
-                # clickhouse_service.insert_traffic_data(data)
-                
+                events = EventCodec.decode(message.value, EventCodec.content_type(message.headers))
             except Exception as e:
-                logging.error(f"Error processing message: {e}")
+                EVENTS.inc(result="undecodable")
+                sampled_log(logging.ERROR, "undecodable", f"Failed to deserialize message at offset {message.offset}: {e}. Skipping message.")
+                yield message, None
                 continue
+            decoded = []
+            valid = 0
+            for event in events:
+                try:
+                    decoded.append(TrafficEvent.from_dict(event))
+                    valid += 1
+                except InvalidEvent as e:
+                    EVENTS.inc(result="invalid")
+                    sampled_log(logging.ERROR, "invalid-event", f"Invalid event at offset {message.offset}: {e}. Skipping event.")
+                    decoded.append(None)
+            DECODE_SECONDS.observe(time.perf_counter() - started)
+            EVENTS.inc(valid, result="decoded")
+            for data in decoded:
+                yield message, data
+
+    # Longest a stopping or rebalancing consumer retries a sink that is down
+    DRAIN_SECONDS = float(os.getenv("CONSUMER_DRAIN_SECONDS", "20"))
+
+    @staticmethod
+    def flush(consumer, writer, stop_event=None, max_seconds=None, held_by=None, hold=None) -> bool:
+        """
+        Flushes the writer, retrying with backoff until the batch lands, then
+        commits the offsets it covered. Polling stops while the sink is down.
+
+        Retries end ``max_seconds`` after the call, or DRAIN_SECONDS after
+        ``stop_event`` is set. The batch is then discarded without committing
+        its offsets, so Kafka redelivers it. With ``held_by`` (a blocking
+        BackgroundWriter) only offsets that also reached its sink are
+        committed. ``hold`` returns offsets that must not be committed past
+        yet, see ``commit``. Returns whether the batch landed.
+        """
+        backoff = 1.0
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        while True:
+            offsets = writer.flush()
+            if offsets is not None:
+                break
+            now = time.monotonic()
+            if stop_event is not None and stop_event.is_set():
+                deadline = min(deadline or now + KafkaParser.DRAIN_SECONDS, now + KafkaParser.DRAIN_SECONDS)
+            if deadline is not None and now >= deadline:
+                logging.error(f"❌ Gave up on {writer.discard()} rows for {writer.name}, "
+                              f"their offsets stay uncommitted for redelivery")
+                return False
+            wait = backoff if deadline is None else min(backoff, deadline - now)
+            if stop_event is not None:
+                stop_event.wait(wait)
+            else:
+                time.sleep(wait)
+            backoff = min(backoff * 2, 30.0)
+
+        if offsets:
+            if held_by is not None:
+                offsets = KafkaParser.committable(writer, held_by)
+            KafkaParser.commit(consumer, offsets, hold() if hold is not None else None)
+        return True
+
+    @staticmethod
+    def committable(writer, held_by) -> dict:
+        """
+        Offsets landed both in ``writer``'s sink and in the background
+        writer ``held_by``'s, partition by partition.
+        """
+        landed = held_by.landed
+        return {tp: min(offset, landed[tp]) for tp, offset in writer.landed.items() if tp in landed}
+
+    @staticmethod
+    def commit(consumer, offsets, held=None):
+        """
+        Commits ``offsets``. A partition ``held`` back by rollup windows
+        commits the held offset instead, with the written offset as
+        metadata, so its next owner does not write those records again.
+        """
+        if offsets and consumer.config.get('group_id'):
+            with COMMIT_SECONDS.time():
+                consumer.commit(BatchWriter.to_commit(offsets, held))
+
+    @staticmethod
+    def written_offsets(consumer, partitions) -> dict:
+        """
+        Offsets the sinks were written up to when they are past the committed
+        one, read from the commit metadata: records before them only rebuild
+        rollup windows.
+        """
+        written = {}
+        for tp in partitions:
+            committed = consumer.committed(TopicPartition(tp.topic, tp.partition), metadata=True)
+            try:
+                offset = int(committed.metadata)
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if offset > committed.offset:
+                written[(tp.topic, tp.partition)] = offset
+        return written
+
+    @staticmethod
+    def columnar() -> bool:
+        """
+        Whether poll batches are enriched column-wise with NumPy
+        (CONSUMER_BATCH_MODE=columnar, the default) or event by event (row).
+        Without NumPy installed the consumer falls back to row mode.
+        """
+        mode = os.getenv("CONSUMER_BATCH_MODE", "columnar").lower()
+        if mode == "columnar" and not ColumnBatch.available():
+            logging.warning("⚠️ NumPy is not installed, enriching events one by one")
+            return False
+        return mode == "columnar"
+
+    @staticmethod
+    def seek_to_stored(consumer, store, partitions) -> dict:
+        """
+        Seeks each partition to the offset stored in PostgreSQL with its data.
+        Partitions without a stored offset keep the committed or reset position.
+        Returns the written offsets past the stored ones, as ``written_offsets``.
+        """
+        partitions = list(partitions)
+        if not partitions:
+            return {}
+        stored = store.stored_positions(consumer.config.get('group_id'), {tp.topic for tp in partitions})
+        written = {}
+        for tp in partitions:
+            offset, written_offset = stored.get((tp.topic, tp.partition), (None, None))
+            if offset is not None:
+                consumer.seek(tp, offset)
+                logging.info(f"⏩ Partition {tp.topic}[{tp.partition}] resumes at stored offset {offset}")
+                if written_offset is not None and written_offset > offset:
+                    written[(tp.topic, tp.partition)] = written_offset
+        return written
+
+    @staticmethod
+    def update_lag(consumer):
+        """Publishes per-partition lag (end offset minus position) for the assigned partitions."""
+        try:
+            assigned = list(consumer.assignment())
+            if not assigned:
+                return
+            ends = consumer.end_offsets(assigned)
+            for tp in assigned:
+                LAG.set(max(ends[tp] - consumer.position(tp), 0), topic=tp.topic, partition=tp.partition)
+        except Exception as e:
+            sampled_log(logging.WARNING, "lag", f"⚠️ Failed to read consumer lag: {e}")
+
+    @staticmethod
+    def rollup_sink(sinks):
+        """
+        Returns the sink for closed window rollups: traffic_rollup in
+        PostgreSQL when it is a configured sink, and ROLLUP_TOPIC when set.
+        A batch of rollups is published as one JSON array record.
+        """
+        query = QuerySql() if "postgres" in sinks else None
+        topic = os.getenv("ROLLUP_TOPIC")
+        producer = KafkaService.get_producer() if topic else None
+
+        def write(rows):
+            if query is not None:
+                query.insert_rollup_batch(rows)
+            if producer is not None:
+                producer.send(topic, json.dumps(rows, default=str).encode('utf-8'))
+                producer.flush()
+
+        return write
+
+    def consumer_kafka(topic, group_id=None, stop_event=None, worker=0):
+        """
+        Consumes, enriches and stores traffic events until ``stop_event`` is set,
+        then drains: pending rows are flushed and their offsets committed.
+        ``worker`` is the process's index in a WorkerPool.
+        """
+        writer = None
+        clickhouse_writer = None
+        consumer = None
+        offset_store = None
+        aggregator = None
+        hold = None
+        # Records below these offsets were written before a restart or rebalance
+        # and only rebuild rollup windows
+        rebuilding = {}
+
+        class FlushOnRevoke(ConsumerRebalanceListener):
+            # Rows for partitions we are about to lose must land, and their
+            # offsets be committed, before another worker takes them over
+            def on_partitions_revoked(self, revoked):
+                if writer is not None and consumer is not None:
+                    # Rows that cannot land in time are redelivered to the new owner
+                    KafkaParser.flush(consumer, writer, stop_event, max_seconds=KafkaParser.DRAIN_SECONDS,
+                                      held_by=clickhouse_writer, hold=hold)
+                    partitions = [(tp.topic, tp.partition) for tp in revoked]
+                    writer.forget(partitions)
+                    if clickhouse_writer is not None:
+                        clickhouse_writer.forget(partitions)
+                    if aggregator is not None:
+                        # The new owner rebuilds the open windows from the held offsets
+                        aggregator.forget(partitions)
+                    for partition in partitions:
+                        rebuilding.pop(partition, None)
+                for tp in revoked:
+                    LAG.remove(topic=tp.topic, partition=tp.partition)
+                logging.info(f"🔀 Partitions revoked: {sorted(tp.partition for tp in revoked)}")
+
+            def on_partitions_assigned(self, assigned):
+                logging.info(f"🔀 Partitions assigned: {sorted(tp.partition for tp in assigned)}")
+                if offset_store is not None:
+                    rebuilding.update(KafkaParser.seek_to_stored(consumer, offset_store, assigned))
+                elif aggregator is not None:
+                    rebuilding.update(KafkaParser.written_offsets(consumer, assigned))
+                if aggregator is not None:
+                    aggregator.assign([(tp.topic, tp.partition) for tp in assigned])
+
+        # Records are decoded here: a record may hold a batch of events and its
+        # encoding is carried in the content-type header
+        consumer = KafkaService.get_raw_consumer(
+            topic, enable_auto_commit=False, group_id=group_id, listener=FlushOnRevoke()
+        )
+        sinks = [sink.strip() for sink in os.getenv("TRAFFIC_SINKS", "postgres").lower().split(",")]
+
+        # Geocoding runs concurrently; results come back in poll order
+        stage = EnrichmentStage.from_env(KafkaParser.enrich)
+        columnar = KafkaParser.columnar()
+        poll_timeout_ms = int(os.getenv("KAFKA_POLL_TIMEOUT_MS", "1000"))
+        lag_interval = float(os.getenv("METRICS_LAG_SECONDS", "10"))
+        lag_updated = 0.0
+
+        # Rows are written in batches; offsets are committed once a batch lands
+        # in the primary sink: PostgreSQL, or ClickHouse when it is the only one
+        batch_size = int(os.getenv("POSTGRES_BATCH_SIZE", "500"))
+        linger_ms = int(os.getenv("POSTGRES_BATCH_LINGER_MS", "1000"))
+        sink_name = "PostgreSQL"
+        if "postgres" in sinks:
+            pool = PostgresService.get_pool()
+            postgres_service = QuerySql(pool, partitions=PartitionManager.from_env(pool))
+            sink = postgres_service.insert_traffic_data_batch
+            # With KAFKA_OFFSET_STORE=postgres the offsets are stored in the same
+            # transaction as the rows, and partitions resume from them when assigned
+            if os.getenv("KAFKA_OFFSET_STORE", "kafka").lower() == "postgres":
+                offset_store = postgres_service
+                group = consumer.config.get('group_id')
+                sink = lambda rows, offsets: postgres_service.insert_traffic_data_batch(
+                    rows, offsets=offsets, group=group, held=hold() if hold is not None else None
+                )
+        elif "clickhouse" in sinks:
+            # The background queue drops rows when full, so a sole ClickHouse
+            # sink is written inline and a failed insert holds back the commit
+            sink = ClickHouseQuery().insert_traffic_data_batch
+            batch_size = int(os.getenv("CLICKHOUSE_BATCH_SIZE", "5000"))
+            linger_ms = int(os.getenv("CLICKHOUSE_BATCH_LINGER_MS", "2000"))
+            sink_name = "ClickHouse"
+        else:
+            sink = lambda rows: None
+        writer = BatchWriter(
+            sink,
+            max_rows=batch_size,
+            max_linger_seconds=linger_ms / 1000,
+            name=sink_name,
+            with_offsets=offset_store is not None
+        )
+
+        # Next to PostgreSQL, ClickHouse is written from its own thread. A full
+        # queue holds back polling, and offsets are committed only once a row
+        # landed in both databases, so ClickHouse never misses committed rows
+        if "clickhouse" in sinks and "postgres" in sinks:
+            clickhouse_service = ClickHouseQuery()
+            clickhouse_writer = BackgroundWriter(
+                BatchWriter(
+                    clickhouse_service.insert_traffic_data_batch,
+                    max_rows=int(os.getenv("CLICKHOUSE_BATCH_SIZE", "5000")),
+                    max_linger_seconds=int(os.getenv("CLICKHOUSE_BATCH_LINGER_MS", "2000")) / 1000,
+                    name="ClickHouse"
+                ),
+                max_queue=int(os.getenv("CLICKHOUSE_QUEUE_SIZE", "50000")),
+                block=True
+            )
+
+        # Enriched events are republished for live subscribers of the WebSocket API
+        enriched_topic = os.getenv("ENRICHED_TOPIC")
+        enriched_producer = KafkaService.get_producer() if enriched_topic else None
+
+        # Windowed rollups are aggregated in-stream and written as their windows
+        # close. Offsets are committed no further than the first record of a
+        # window that is open or not written yet, so it is rebuilt whole
+        aggregator = WindowAggregator.from_env()
+        rollup_writer = None
+        if aggregator is not None:
+            rollup_writer = BackgroundWriter(
+                BatchWriter(
+                    KafkaParser.rollup_sink(sinks),
+                    max_rows=int(os.getenv("ROLLUP_BATCH_SIZE", "1000")),
+                    max_linger_seconds=int(os.getenv("ROLLUP_BATCH_LINGER_MS", "1000")) / 1000,
+                    name="Rollup"
+                ),
+                max_queue=int(os.getenv("ROLLUP_QUEUE_SIZE", "50000")),
+                block=True
+            )
+            hold = lambda: aggregator.held(rollup_writer.landed.get(BATCHES, 0))
+
+        # Per-stream anomalies are detected in-stream and published to ALERTS_TOPIC
+        detector = AnomalyDetector.from_env(worker=worker)
+        alerts_topic = os.getenv("ALERTS_TOPIC")
+        alerts_producer = None
+        if detector is not None and alerts_topic:
+            alerts_producer = enriched_producer or KafkaService.get_producer()
+
+        logging.info(f"📡 Consumer listening on '{topic}' (group: {consumer.config.get('group_id')})...")
+        try:
+            while stop_event is None or not stop_event.is_set():
+                with POLL_SECONDS.time():
+                    batch = consumer.poll(timeout_ms=poll_timeout_ms)
+                messages = [message for records in batch.values() for message in records]
+                enriched = []
+                observed = []
+                if messages:
+                    POLL_RECORDS.observe(len(messages))
+                started = time.perf_counter()
+
+                if columnar:
+                    enriched_events = stage.process_batch(KafkaParser.decode(messages), Parser.time_to_day_month_year)
+                else:
+                    enriched_events = stage.process(KafkaParser.decode(messages))
+
+                for message, data in enriched_events:
+                    if rebuilding and message.offset < rebuilding.get((message.topic, message.partition), 0):
+                        writer.skip(message)
+                        if clickhouse_writer is not None:
+                            clickhouse_writer.skip(message, stop_event)
+                        if data is not None and aggregator is not None:
+                            aggregator.add(data, message)
+                        continue
+
+                    if data is None:
+                        writer.skip(message)
+                        if clickhouse_writer is not None:
+                            clickhouse_writer.skip(message, stop_event)
+                        continue
+
+                    writer.add(data, message)
+                    if clickhouse_writer is not None:
+                        clickhouse_writer.submit(data, message, stop_event)
+                    if aggregator is not None:
+                        aggregator.add(data, message)
+                    if enriched_producer is not None:
+                        enriched.append(data.to_dict())
+                    if detector is not None:
+                        observed.append(data)
+
+                    if writer.full():
+                        KafkaParser.flush(consumer, writer, stop_event, held_by=clickhouse_writer, hold=hold)
+
+                if messages:
+                    PROCESS_SECONDS.observe(time.perf_counter() - started)
+
+                if writer.due():
+                    KafkaParser.flush(consumer, writer, stop_event, held_by=clickhouse_writer, hold=hold)
+
+                if time.monotonic() - lag_updated >= lag_interval:
+                    KafkaParser.update_lag(consumer)
+                    lag_updated = time.monotonic()
+
+                if enriched:
+                    # One record per poll; delivery is best effort and never blocks the consumer
+                    enriched_producer.send(enriched_topic, json.dumps(enriched).encode('utf-8'))
+
+                if observed:
+                    alerts = detector.observe(observed)
+                    if alerts:
+                        logging.info(f"🚨 {len(alerts)} anomaly alerts")
+                        if alerts_producer is not None:
+                            alerts_producer.send(alerts_topic, json.dumps(alerts, default=str).encode('utf-8'))
+                if detector is not None:
+                    detector.checkpoint()
+
+                if aggregator is not None:
+                    rows = aggregator.close()
+                    if rows:
+                        marker = aggregator.marker()
+                        for row in rows:
+                            rollup_writer.submit(row, marker, stop_event)
+        finally:
+            logging.info("🛑 Draining consumer...")
+            KafkaParser.flush(consumer, writer, stop_event, max_seconds=KafkaParser.DRAIN_SECONDS,
+                              held_by=clickhouse_writer, hold=hold)
+            if clickhouse_writer is not None:
+                clickhouse_writer.stop()
+                KafkaParser.commit(consumer, KafkaParser.committable(writer, clickhouse_writer),
+                                   hold() if hold is not None else None)
+            if aggregator is not None:
+                # Windows still open are emitted with what this worker has seen;
+                # their records stay held and the next owner replaces the rows
+                rows = aggregator.close(final=True)
+                if rows:
+                    marker = aggregator.marker()
+                    for row in rows:
+                        rollup_writer.submit(row, marker, stop_event)
+                rollup_writer.stop()
+            stage.shutdown()
+            if detector is not None:
+                detector.checkpoint(force=True)
+            if alerts_producer is not None and alerts_producer is not enriched_producer:
+                alerts_producer.close(timeout=5)
+            if enriched_producer is not None:
+                enriched_producer.close(timeout=5)
+            consumer.close(autocommit=False)
+            logging.info("🛑 Consumer stopped")
 
 class GeocodingParser:
     """
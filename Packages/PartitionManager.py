@@ -0,0 +1,239 @@
+import os
+import re
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+from zoneinfo import ZoneInfo
+from psycopg2 import sql
+from Packages.Query import QuerySql
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+class PartitionManager:
+    """
+    Creates and expires the daily range partitions of a table partitioned on
+    ``timestamp``.
+
+    Partition ``<table>_pYYYYMMDD`` holds one calendar day in ``timezone``.
+    New partitions take over any rows of that day that landed in the
+    ``<table>_default`` partition, and pick up the parent's index set when
+    attached. Partitions older than ``retention_days`` are detached (kept as
+    standalone tables) or dropped, depending on ``retention_action``.
+
+    If the table is not partitioned (created before partitioning and not yet
+    upgraded with Query/ddl_query.sql), ``ensure`` logs one error and does
+    nothing from then on, and ``maintain`` raises. The manager is safe to
+    share between threads.
+    """
+
+    def __init__(self, pool, table: str = "traffic_data", timezone: str = "UTC",
+                 premake_days: int = 7, retention_days: Optional[int] = None,
+                 retention_action: str = "detach"):
+        if retention_action not in ("detach", "drop"):
+            raise ValueError(f"Unknown retention action: {retention_action}")
+        self.pool = pool
+        self.table = table
+        self.timezone = ZoneInfo(timezone)
+        self.premake_days = premake_days
+        self.retention_days = retention_days
+        self.retention_action = retention_action
+
+        self._known = None
+        self.disabled = False
+        # Guards _known; creation runs under it so threads do not race for the same day
+        self._lock = threading.RLock()
+        self._name = re.compile(rf"^{re.escape(table)}_p(\d{{8}})$")
+
+    @classmethod
+    def from_env(cls, pool) -> Optional["PartitionManager"]:
+        """Builds the manager from POSTGRES_PARTITION_* variables; None when partitioning is off."""
+        if os.getenv("POSTGRES_PARTITIONING", "true").lower() != "true":
+            return None
+        retention = os.getenv("POSTGRES_RETENTION_DAYS")
+        return cls(
+            pool,
+            timezone=os.getenv("POSTGRES_PARTITION_TIMEZONE", "UTC"),
+            premake_days=int(os.getenv("POSTGRES_PARTITION_PREMAKE_DAYS", "7")),
+            retention_days=int(retention) if retention else None,
+            retention_action=os.getenv("POSTGRES_RETENTION_ACTION", "detach").lower()
+        )
+
+    def partition_name(self, day: date) -> str:
+        return f"{self.table}_p{day:%Y%m%d}"
+
+    def bounds(self, day: date):
+        """Start (inclusive) and end (exclusive) of a day as aware datetimes."""
+        start = datetime.combine(day, time.min, tzinfo=self.timezone)
+        end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=self.timezone)
+        return start, end
+
+    def partitioned(self) -> bool:
+        """Whether the table exists and is partitioned."""
+        def read(conn):
+            with conn.cursor() as cur:
+                cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (self.table,))
+                row = cur.fetchone()
+            conn.rollback()
+            return row is not None and row[0] == "p"
+
+        return self.pool.run(read)
+
+    def stranded(self) -> set:
+        """Days with rows in the default partition, which their own partitions would take over."""
+        def read(conn):
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL("SELECT DISTINCT (timestamp AT TIME ZONE %s)::date FROM {}").format(
+                        sql.Identifier(f"{self.table}_default")),
+                    (self.timezone.key,)
+                )
+                days = {row[0] for row in cur.fetchall()}
+            conn.rollback()
+            return days
+
+        return self.pool.run(read)
+
+    def existing(self) -> set:
+        """Days that currently have an attached partition."""
+        def read(conn):
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT c.relname FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = %s::regclass
+                    """,
+                    (self.table,)
+                )
+                names = [row[0] for row in cur.fetchall()]
+            conn.rollback()
+            return names
+
+        days = set()
+        for name in self.pool.run(read):
+            match = self._name.match(name)
+            if match:
+                days.add(datetime.strptime(match.group(1), "%Y%m%d").date())
+        return days
+
+    def _create(self, conn, day: date) -> bool:
+        name = self.partition_name(day)
+        start, end = self.bounds(day)
+        table = sql.Identifier(self.table)
+        partition = sql.Identifier(name)
+        default = sql.Identifier(f"{self.table}_default")
+
+        with conn.cursor() as cur:
+            # Serialize with other workers creating the same partition
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (name,))
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+            if cur.fetchone()[0]:
+                conn.rollback()
+                return False
+
+            cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(partition, table))
+            # Rows of this day written before the partition existed sit in the default partition
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{self.table}_default",))
+            if cur.fetchone()[0]:
+                cur.execute(
+                    sql.SQL(
+                        "WITH moved AS (DELETE FROM {} WHERE timestamp >= %s AND timestamp < %s RETURNING *) "
+                        "INSERT INTO {} SELECT * FROM moved"
+                    ).format(default, partition),
+                    (start, end)
+                )
+                if cur.rowcount:
+                    logging.info(f"📦 Moved {cur.rowcount} rows from the default partition into {name}")
+            cur.execute(
+                sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(table, partition),
+                (start, end)
+            )
+        return True
+
+    def create(self, day: date) -> bool:
+        """Creates the partition for ``day``; returns False if it already existed."""
+        created = self.pool.run(lambda conn: self._create(conn, day))
+        if created:
+            logging.info(f"📦 Created partition {self.partition_name(day)}")
+        with self._lock:
+            if self._known is not None:
+                self._known.add(day)
+        return created
+
+    def ensure(self, days: Iterable) -> None:
+        """
+        Makes sure partitions exist for the given days (``date`` or
+        ``YYYY-MM-DD`` strings, as in ``day_month_year``). The day key is the
+        event's local date, so the neighbouring days are covered too.
+        Days already known to exist cost a set lookup.
+        """
+        wanted = set()
+        for day in days:
+            if isinstance(day, str):
+                try:
+                    day = datetime.strptime(day, DAY_FORMAT).date()
+                except ValueError:
+                    continue
+            if day is not None:
+                wanted.update(day + timedelta(days=offset) for offset in (-1, 0, 1))
+
+        with self._lock:
+            if self.disabled:
+                return
+            if self._known is None:
+                if not self.partitioned():
+                    self.disabled = True
+                    logging.error(f"❌ {self.table} is not a partitioned table; partition management is off. "
+                                  f"Apply Query/ddl_query.sql to upgrade it")
+                    return
+                self._known = self.existing()
+
+            for day in sorted(wanted - self._known):
+                self.create(day)
+
+    def expire(self, today: date) -> list:
+        """Detaches or drops partitions older than the retention window."""
+        if self.retention_days is None:
+            return []
+
+        cutoff = today - timedelta(days=self.retention_days)
+        expired = sorted(day for day in self.existing() if day < cutoff)
+        for day in expired:
+            partition = sql.Identifier(self.partition_name(day))
+
+            def apply(conn):
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(sql.Identifier(self.table), partition))
+                    if self.retention_action == "drop":
+                        cur.execute(sql.SQL("DROP TABLE {}").format(partition))
+                    cur.execute(QuerySql.WRITE_SEQUENCE_QUERY, (None,))
+
+            self.pool.run(apply)
+            with self._lock:
+                if self._known is not None:
+                    self._known.discard(day)
+            logging.info(f"🗑️ {'Dropped' if self.retention_action == 'drop' else 'Detached'} partition {self.partition_name(day)}")
+        return expired
+
+    def maintain(self, today: Optional[date] = None) -> dict:
+        """
+        Pre-creates partitions for the next ``premake_days`` days, creates the
+        partitions of days stranded in the default partition and applies
+        retention.
+        """
+        today = today or datetime.now(self.timezone).date()
+        with self._lock:
+            if not self.partitioned():
+                raise RuntimeError(f"{self.table} is not a partitioned table; apply Query/ddl_query.sql to upgrade it")
+            self.disabled = False
+            self._known = self.existing()
+
+            # Days still in the default partition, e.g. copied from an upgraded table
+            wanted = {today + timedelta(days=offset) for offset in range(-1, self.premake_days + 1)}
+            wanted |= self.stranded()
+            created = [day for day in sorted(wanted - self._known) if self.create(day)]
+
+        expired = self.expire(today)
+        return {"created": created, "expired": expired}
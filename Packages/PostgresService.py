@@ -1,10 +1,247 @@
 import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.pool
+from psycopg2 import extensions
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class CommitUnknown(psycopg2.OperationalError):
+    """The connection dropped during COMMIT and the transaction's outcome could not be read back."""
+
+
+class PostgresPool:
+    """
+    Thread-safe connection pool with health checks and reconnect backoff.
+
+    Connections idle for longer than ``health_check_seconds`` are pinged
+    before reuse, broken connections are discarded instead of returned,
+    and new connections are retried with exponential backoff.
+
+    With ``prepare_statements`` the statements passed to ``prepare`` are
+    PREPAREd once per connection and then run with EXECUTE, skipping the
+    parse and plan on every call. Each connection's prepared statements are
+    forgotten when it is discarded.
+    """
+
+    def __init__(self, connect, min_size: int = 1, max_size: int = 8,
+                 health_check_seconds: float = 30.0, reconnect_attempts: int = 5,
+                 reconnect_backoff: float = 0.5, acquire_timeout: float = 30.0,
+                 prepare_statements: bool = True):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_seconds = health_check_seconds
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_backoff = reconnect_backoff
+        self.acquire_timeout = acquire_timeout
+        self.prepare_statements = prepare_statements
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        # statement text -> prepared name, and connection -> names prepared on it
+        self._names = {}
+        self._prepared = {}
+
+        self.opened = 0
+        self.discarded = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            PostgresService.get_connection,
+            min_size=int(os.getenv("POSTGRES_POOL_MIN", "1")),
+            max_size=int(os.getenv("POSTGRES_POOL_MAX", "8")),
+            health_check_seconds=float(os.getenv("POSTGRES_HEALTH_CHECK_SECONDS", "30")),
+            reconnect_attempts=int(os.getenv("POSTGRES_RECONNECT_ATTEMPTS", "5")),
+            reconnect_backoff=float(os.getenv("POSTGRES_RECONNECT_BACKOFF", "0.5")),
+            # Off behind a transaction-pooling proxy such as PgBouncer, where
+            # consecutive transactions may run on different server sessions
+            prepare_statements=os.getenv("POSTGRES_PREPARED_STATEMENTS", "true").lower() == "true"
+        )
+
+    def _open(self):
+        for attempt in range(self.reconnect_attempts):
+            try:
+                conn = self._connect()
+                self.opened += 1
+                return conn
+            except CONNECTION_ERRORS as e:
+                if attempt == self.reconnect_attempts - 1:
+                    raise
+                delay = self.reconnect_backoff * (2 ** attempt)
+                logger.warning(f"⚠️ PostgreSQL connection failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _discard(self, conn):
+        self.discarded += 1
+        with self._lock:
+            self._prepared.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, conn, last_used) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def warm_up(self):
+        """Opens connections up to ``min_size`` so the first batch does not pay for them."""
+        conns = [self.acquire() for _ in range(self.min_size)]
+        for conn in conns:
+            self.release(conn)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise psycopg2.pool.PoolError(f"No PostgreSQL connection available within {self.acquire_timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._open()
+                conn, last_used = item
+                if self._healthy(conn, last_used):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard: bool = False):
+        try:
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection, rolling back and returning it when the block exits."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def prepare(self, conn, query: str) -> str:
+        """
+        Returns the statement that runs ``query`` on ``conn``: ``EXECUTE`` of
+        a statement prepared on this connection on first use, with the same
+        ``%s`` parameters. ``query`` itself when preparing is off.
+        """
+        if not self.prepare_statements:
+            return query
+        with self._lock:
+            name = self._names.setdefault(query, f"traffic_stmt_{len(self._names)}")
+            prepared = self._prepared.setdefault(conn, set())
+        parts = query.split("%s")
+        count = len(parts) - 1
+        if name not in prepared:
+            # PREPARE takes numbered parameters: the n-th %s becomes $n
+            numbered = parts[0] + "".join(f"${number}{part}" for number, part in enumerate(parts[1:], 1))
+            with conn.cursor() as cur:
+                cur.execute(f"PREPARE {name} AS {numbered}")
+            prepared.add(name)
+        return f"EXECUTE {name} ({', '.join(['%s'] * count)})" if count else f"EXECUTE {name}"
+
+    def _outcome(self, txid) -> str:
+        """``committed``, ``aborted`` or ``unknown`` for a transaction whose COMMIT was cut off."""
+        for attempt in range(self.reconnect_attempts):
+            try:
+                with self.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT txid_status(%s)", (txid,))
+                        status = cur.fetchone()[0]
+                    conn.rollback()
+                if status in ("committed", "aborted"):
+                    return status
+            except CONNECTION_ERRORS:
+                pass
+            time.sleep(self.reconnect_backoff * (2 ** attempt))
+        return "unknown"
+
+    def run(self, work):
+        """
+        Runs ``work(conn)`` as one transaction and commits it; ``work`` may
+        roll back to end it early. Work interrupted by a dropped connection is
+        retried on a fresh connection with backoff.
+
+        A connection dropped during COMMIT leaves the outcome open, so the
+        transaction id is read before committing and its status looked up
+        afterwards: a committed transaction is not run again, an aborted one
+        is retried, and one whose status cannot be read raises CommitUnknown.
+        """
+        for attempt in range(self.reconnect_attempts):
+            txid = None
+            committing = False
+            try:
+                with self.connection() as conn:
+                    result = work(conn)
+                    # Work that already ended its transaction has nothing to commit
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT txid_current_if_assigned()")
+                            txid = cur.fetchone()[0]
+                    committing = True
+                    conn.commit()
+                    return result
+            except CONNECTION_ERRORS as e:
+                if committing and txid is not None:
+                    outcome = self._outcome(txid)
+                    if outcome == "committed":
+                        logger.warning(f"⚠️ PostgreSQL connection lost during commit ({e}), transaction {txid} had committed")
+                        return result
+                    if outcome == "unknown":
+                        raise CommitUnknown(f"Outcome of transaction {txid} is unknown: {e}") from e
+                if attempt == self.reconnect_attempts - 1:
+                    raise
+                delay = self.reconnect_backoff * (2 ** attempt)
+                logger.warning(f"⚠️ PostgreSQL connection lost ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
 class PostgresService:
+    _pool = None
+    _pool_lock = threading.Lock()
+
     def get_connection():
         return psycopg2.connect(
             host=os.getenv("PGHOST"),
@@ -13,3 +250,11 @@ class PostgresService:
             user=os.getenv("PGUSER"),
             password=os.getenv("PGPASSWORD")
         )
+
+    @staticmethod
+    def get_pool() -> PostgresPool:
+        """Returns the process-wide connection pool shared by every QuerySql instance."""
+        with PostgresService._pool_lock:
+            if PostgresService._pool is None:
+                PostgresService._pool = PostgresPool.from_env()
+            return PostgresService._pool
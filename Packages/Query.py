@@ -1,54 +1,276 @@
-from Packages.PostgresService import PostgresService
+from Packages.PostgresService import PostgresService, CONNECTION_ERRORS
 from Packages.GeocodingService import GeocodingService
+from Packages.ConfigService import ConfigService
+from Packages.TrafficEvent import TrafficEvent
+from Packages.Metrics import sampled_log
+from psycopg2.extras import execute_values, Json
 import logging
-import json
 import os
+from datetime import datetime
 
 class QuerySql:
     # Load configuration from Config.json
-    @staticmethod
-    def _load_config():
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'Configs', 'Config.json')
-        with open(config_path, 'r') as f:
-            return json.load(f)
-    
-    _config = _load_config()
+    _config = ConfigService.load()
     
     # Configuration for traffic_data table
     TRAFFIC_DATA_FIELDS = _config['traffic_data']['fields']
     TRAFFIC_DATA_CONFLICT_KEY = _config['traffic_data']['conflict_key']
     TRAFFIC_DATA_UPDATE_FIELDS = _config['traffic_data']['update_fields']
+    TRAFFIC_DATA_UPSERT_TABLE = _config['traffic_data']['upsert_table']
+
+    # Statements are rendered once from the configuration and reused by every call
+    _FIELD_LIST = ', '.join(TRAFFIC_DATA_FIELDS)
+    INSERT_QUERY = f"""
+        INSERT INTO traffic_data ({_FIELD_LIST})
+        VALUES ({', '.join(['%s'] * len(TRAFFIC_DATA_FIELDS))})
+    """
+    BATCH_INSERT_QUERY = f"INSERT INTO traffic_data ({_FIELD_LIST}) VALUES %s"
+    # Older events arriving late must not overwrite a newer state
+    UPSERT_QUERY = f"""
+        INSERT INTO {TRAFFIC_DATA_UPSERT_TABLE} ({_FIELD_LIST}) VALUES %s
+        ON CONFLICT ({TRAFFIC_DATA_CONFLICT_KEY}) DO UPDATE SET
+        {', '.join(f"{field} = EXCLUDED.{field}" for field in TRAFFIC_DATA_UPDATE_FIELDS)}
+        WHERE {TRAFFIC_DATA_UPSERT_TABLE}.timestamp <= EXCLUDED.timestamp
+    """
+
+    # Replayed rows replace stored rows of the same reading, identified like
+    # the ClickHouse sorting key; the bounds let partitions be pruned
+    REPLACE_DELETE_QUERY = """
+        DELETE FROM traffic_data AS t
+        USING unnest(%(stream_ids)s::uuid[], %(timestamps)s::timestamptz[], %(locations)s::text[])
+            AS r(stream_id, timestamp, location)
+        WHERE t.stream_id = r.stream_id AND t.timestamp = r.timestamp AND t.location = r.location
+        AND t.timestamp BETWEEN (SELECT min(x) FROM unnest(%(timestamps)s::timestamptz[]) AS x)
+                            AND (SELECT max(x) FROM unnest(%(timestamps)s::timestamptz[]) AS x)
+    """
+
+    # Closed window aggregates, one row per key, window and source partition.
+    # A window rebuilt from the same records replaces its row; an emission
+    # from fewer records, e.g. a window reopened by a replay, is ignored
+    ROLLUP_FIELDS = _config['traffic_rollup']['fields']
+    ROLLUP_CONFLICT_KEY = _config['traffic_rollup']['conflict_key']
+    ROLLUP_UPDATE_FIELDS = _config['traffic_rollup']['update_fields']
+    ROLLUP_UPSERT_QUERY = f"""
+        INSERT INTO traffic_rollup ({', '.join(ROLLUP_FIELDS)}) VALUES %s
+        ON CONFLICT ({', '.join(ROLLUP_CONFLICT_KEY)}) DO UPDATE SET
+        {', '.join(f"{field} = EXCLUDED.{field}" for field in ROLLUP_UPDATE_FIELDS)}
+        WHERE traffic_rollup.event_count <= EXCLUDED.event_count
+    """
+
+    # Bumped in the same transaction as every write to the traffic tables, so
+    # the analytics API drops cached results computed before it. The newest
+    # event time written is kept along with it
+    WRITE_SEQUENCE_QUERY = """
+        INSERT INTO ingest_watermark (name, watermark, sequence, updated_at) VALUES ('traffic_data', %s, 1, now())
+        ON CONFLICT (name) DO UPDATE SET
+        watermark = GREATEST(ingest_watermark.watermark, EXCLUDED.watermark),
+        sequence = ingest_watermark.sequence + 1, updated_at = now()
+    """
+
+    # Consumed offsets stored with the data (KAFKA_OFFSET_STORE=postgres)
+    OFFSETS_UPSERT_QUERY = """
+        INSERT INTO kafka_offsets (consumer_group, topic, partition, next_offset, written_offset) VALUES %s
+        ON CONFLICT (consumer_group, topic, partition) DO UPDATE SET
+        next_offset = EXCLUDED.next_offset, written_offset = EXCLUDED.written_offset, updated_at = now()
+    """
+    OFFSETS_SELECT_QUERY = """
+        SELECT topic, partition, next_offset, written_offset FROM kafka_offsets
+        WHERE consumer_group = %s AND topic = ANY(%s)
+    """
+
+    # insert | upsert | both
+    write_mode = os.getenv("POSTGRES_WRITE_MODE", "insert").lower()
     
-    def __init__(self):
-        self.conn = PostgresService.get_connection()
+    def __init__(self, pool=None, partitions=None):
+        # Connections come from the process-wide pool shared by all writers
+        self.pool = pool or PostgresService.get_pool()
+        # PartitionManager that creates traffic_data partitions for new days
+        self.partitions = partitions
     
     def insert_traffic_data(self, data):
         try:
-            cur = self.conn.cursor()
-            
-            # Build query dynamically from configuration
-            fields = ', '.join(self.TRAFFIC_DATA_FIELDS)
-            placeholders = ', '.join(['%s'] * len(self.TRAFFIC_DATA_FIELDS))
-            
-            insert_query = f"""
-                INSERT INTO traffic_data ({fields})
-                VALUES ({placeholders})
-            """
-            
             # Extract values in the same order as fields
-            values = tuple(data.get(field) for field in self.TRAFFIC_DATA_FIELDS)
-            
-            cur.execute(insert_query, values)
-            
-            self.conn.commit()
-            cur.close()
+            values = self._row(data)
+
+            def write(conn):
+                statement = self.pool.prepare(conn, self.INSERT_QUERY)
+                with conn.cursor() as cur:
+                    cur.execute(statement, values)
+
+            self.pool.run(write)
             
-            logging.info(f"✅ Inserted traffic data for stream_id: {data.get('stream_id')}")
+            sampled_log(logging.INFO, "insert", f"✅ Inserted traffic data for stream_id: {data.get('stream_id')}")
             
         except Exception as e:
             logging.error(f"❌ Failed to insert traffic data: {e}")
-            self.conn.rollback()
+
+    @staticmethod
+    def _timestamp_key(value):
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                return None
+        return value
+
+    @classmethod
+    def dedupe_latest(cls, rows):
+        """
+        Keeps one row per conflict key, the one with the latest timestamp.
+        Rows with equal or unparseable timestamps resolve to the later arrival.
+        """
+        latest = {}
+        for data in rows:
+            key = data.get(cls.TRAFFIC_DATA_CONFLICT_KEY)
+            current = latest.get(key)
+            if current is not None:
+                try:
+                    if cls._timestamp_key(data.get('timestamp')) < cls._timestamp_key(current.get('timestamp')):
+                        continue
+                except TypeError:
+                    pass
+            latest[key] = data
+        return list(latest.values())
+
+    @classmethod
+    def _watermark(cls, rows):
+        """Newest timezone-aware event timestamp in the rows, or None."""
+        times = [cls._timestamp_key(data.get('timestamp')) for data in rows]
+        times = [t for t in times if isinstance(t, datetime) and t.tzinfo is not None]
+        return max(times) if times else None
+
+    def _row(self, data):
+        # Decoded events already hold their values in column order
+        if isinstance(data, TrafficEvent):
+            return data.as_row()
+        return tuple(data.get(field) for field in self.TRAFFIC_DATA_FIELDS)
+
+    def _values(self, rows):
+        return [self._row(data) for data in rows]
+
+    def _write_offsets(self, cur, offsets, group, held=None):
+        held = held or {}
+        values = [(group, topic, partition, min(offset, held.get((topic, partition), offset)), offset)
+                  for (topic, partition), offset in offsets.items()]
+        execute_values(cur, self.OFFSETS_UPSERT_QUERY, values, page_size=len(values))
+
+    def _write_rows(self, conn, rows, offsets=None, group=None, held=None):
+        with conn.cursor() as cur:
+            if rows and self.write_mode in ('insert', 'both'):
+                execute_values(cur, self.BATCH_INSERT_QUERY, self._values(rows), page_size=len(rows))
+            if rows and self.write_mode in ('upsert', 'both'):
+                latest = self.dedupe_latest(rows)
+                execute_values(cur, self.UPSERT_QUERY, self._values(latest), page_size=len(latest))
+            if rows:
+                cur.execute(self.pool.prepare(conn, self.WRITE_SEQUENCE_QUERY), (self._watermark(rows),))
+            if offsets:
+                self._write_offsets(cur, offsets, group, held)
+
+    def insert_traffic_data_batch(self, rows, offsets=None, group=None, held=None):
+        """
+        Writes a batch of traffic rows in one transaction according to
+        POSTGRES_WRITE_MODE: ``insert`` appends to traffic_data, ``upsert``
+        keeps the latest row per conflict key in the upsert table, ``both``
+        does both. Missing traffic_data partitions for the batch's days are
+        created first when a PartitionManager is set.
+
+        ``offsets`` (``{(topic, partition): next_offset}``) are stored in
+        kafka_offsets for consumer ``group`` in the same transaction, so the
+        data and the position it was read up to commit together. A partition
+        ``held`` back by open rollup windows stores the held offset as its
+        position and the written one as ``written_offset``.
+
+        Dropped connections are retried on a fresh pooled connection; if the
+        database stays unreachable the error is raised so the caller can keep
+        the batch. Any other failure falls back to row-by-row writes so one bad
+        message does not drop the rest of the batch; the offsets are then
+        stored once every row was tried.
+        """
+        if not rows and not offsets:
+            return
+
+        if self.partitions is not None and self.write_mode in ('insert', 'both'):
+            try:
+                self.partitions.ensure({data.get('day_month_year') for data in rows})
+            except CONNECTION_ERRORS:
+                raise
+            except Exception as e:
+                # Rows for a missing day still land in the default partition
+                logging.error(f"❌ Failed to create traffic_data partitions: {e}")
+
+        try:
+            self.pool.run(lambda conn: self._write_rows(conn, rows, offsets, group, held))
+        except CONNECTION_ERRORS:
+            raise
         except Exception as e:
-            logging.error(f"❌ Failed to insert traffic data: {e}")
-            self.conn.rollback()
-            raise
\ No newline at end of file
+            logging.error(f"❌ Batch write of {len(rows)} rows failed, retrying row by row: {e}")
+            for data in rows:
+                try:
+                    self.pool.run(lambda conn: self._write_rows(conn, [data]))
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    logging.error(f"❌ Failed to write traffic data for stream_id {data.get('stream_id')}: {e}")
+            if offsets:
+                self.pool.run(lambda conn: self._write_rows(conn, [], offsets, group, held))
+
+    def replace_traffic_data_batch(self, rows):
+        """
+        Loads replayed rows so that replaying a range again leaves one copy:
+        traffic_data rows with the same stream_id, timestamp and location as
+        a replayed row are deleted in the same transaction as the insert.
+        Any failure is raised, there is no row-by-row fallback.
+        """
+        if not rows:
+            return
+
+        latest = {}
+        for data in rows:
+            latest[(str(data.get('stream_id')), str(data.get('timestamp')), data.get('location'))] = data
+        rows = list(latest.values())
+
+        if self.partitions is not None and self.write_mode in ('insert', 'both'):
+            self.partitions.ensure({data.get('day_month_year') for data in rows})
+
+        keys = {
+            "stream_ids": [str(data.get('stream_id')) for data in rows],
+            "timestamps": [data.get('timestamp') for data in rows],
+            "locations": [data.get('location') for data in rows],
+        }
+
+        def write(conn):
+            if self.write_mode in ('insert', 'both'):
+                with conn.cursor() as cur:
+                    cur.execute(self.REPLACE_DELETE_QUERY, keys)
+            self._write_rows(conn, rows)
+
+        self.pool.run(write)
+
+    def stored_positions(self, group, topics) -> dict:
+        """
+        Positions stored for consumer ``group`` as
+        ``{(topic, partition): (next_offset, written_offset)}``.
+        """
+        def read(conn):
+            statement = self.pool.prepare(conn, self.OFFSETS_SELECT_QUERY)
+            with conn.cursor() as cur:
+                cur.execute(statement, (group, list(topics)))
+                return cur.fetchall()
+
+        return {(topic, partition): (offset, written) for topic, partition, offset, written in self.pool.run(read)}
+
+    def insert_rollup_batch(self, rows):
+        """Upserts closed window aggregates into traffic_rollup in one statement."""
+        if not rows:
+            return
+
+        values = [
+            tuple(Json(row[field]) if field == 'label_counts' else row[field] for field in self.ROLLUP_FIELDS)
+            for row in rows
+        ]
+
+        def write(conn):
+            with conn.cursor() as cur:
+                execute_values(cur, self.ROLLUP_UPSERT_QUERY, values, page_size=len(values))
+
+        self.pool.run(write)
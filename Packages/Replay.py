@@ -0,0 +1,421 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+from dotenv import load_dotenv
+from kafka import TopicPartition
+from Packages.ColumnBatch import ColumnBatch
+from Packages.Enrichment import EnrichmentStage, EMPTY_ADDRESS
+from Packages.EventCodec import EventCodec
+from Packages.GeocodingService import GeocodingService
+from Packages.TrafficEvent import TrafficEvent, InvalidEvent
+from Packages.Metrics import REGISTRY, sampled_log
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EVENTS = REGISTRY.counter("replay_events_total", "Events handled by the replay by outcome", ["result"])
+LOAD_SECONDS = REGISTRY.histogram("replay_load_seconds", "Time to bulk load one replay chunk", ["sink"])
+
+
+def _event_time(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+    return None
+
+
+def parse_bound(value: Optional[str]):
+    """A replay range bound: an integer offset, or an ISO timestamp (UTC when it has no offset)."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+class FileSource:
+    """
+    Events from NDJSON dump files, one event object or array of events per
+    line. Files ending in .gz, .bz2 or .xz are decompressed while read, .zst
+    and .lz4 when ``zstandard`` or ``lz4`` is installed.
+    """
+
+    def __init__(self, paths: List[str], chunk_size: int = 5000):
+        self.paths = list(paths)
+        self.chunk_size = chunk_size
+        self.total = sum(os.path.getsize(path) for path in self.paths)
+        self._finished = 0
+        self._raw = None
+
+    def describe(self) -> str:
+        return f"{len(self.paths)} file(s), {self.total / 1e6:.1f} MB"
+
+    def progress(self) -> Optional[float]:
+        """Fraction of the input bytes (compressed size for compressed files) read so far."""
+        if not self.total:
+            return None
+        raw = self._raw
+        position = raw.tell() if raw is not None and not raw.closed else 0
+        return min((self._finished + position) / self.total, 1.0)
+
+    @staticmethod
+    def _open(path: str, raw):
+        if path.endswith(".gz"):
+            return gzip.GzipFile(fileobj=raw)
+        if path.endswith(".bz2"):
+            return bz2.BZ2File(raw)
+        if path.endswith(".xz"):
+            return lzma.LZMAFile(raw)
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise ValueError(f"Reading {path} requires the zstandard package")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+        if path.endswith(".lz4"):
+            if lz4_frame is None:
+                raise ValueError(f"Reading {path} requires the lz4 package")
+            return lz4_frame.LZ4FrameFile(raw)
+        return raw
+
+    def chunks(self) -> Iterator[tuple]:
+        """Yields ``(events, undecodable lines)`` for every ``chunk_size`` lines."""
+        for path in self.paths:
+            with open(path, "rb") as raw:
+                self._raw = raw
+                lines = []
+                for line in self._open(path, raw):
+                    line = line.strip()
+                    if line:
+                        lines.append(line)
+                    if len(lines) >= self.chunk_size:
+                        yield EventCodec.decode_lines(lines)
+                        lines = []
+                if lines:
+                    yield EventCodec.decode_lines(lines)
+            self._raw = None
+            self._finished += os.path.getsize(path)
+
+
+class KafkaRangeSource:
+    """
+    Events in an offset or time range of a topic, read with a consumer
+    without a group (``KafkaService.get_reader``) so no committed offsets
+    are touched.
+
+    ``start`` and ``end`` are offsets applied to every partition, or
+    datetimes looked up per partition. The end is exclusive; by default the
+    range runs from the oldest retained record to the partition ends at the
+    time the replay starts.
+    """
+
+    def __init__(self, consumer, topic: str, start=None, end=None, partitions=None, poll_timeout_ms: int = 1000):
+        self.consumer = consumer
+        self.topic = topic
+        self.start = start
+        self.end = end
+        self.partitions = partitions
+        self.poll_timeout_ms = poll_timeout_ms
+        self.total = 0
+        self.consumed = 0
+
+    def describe(self) -> str:
+        return f"topic '{self.topic}' from {self.start if self.start is not None else 'the beginning'} " \
+               f"to {self.end if self.end is not None else 'the end'}"
+
+    def progress(self) -> Optional[float]:
+        return min(self.consumed / self.total, 1.0) if self.total else None
+
+    def _bounds(self):
+        numbers = self.partitions or sorted(self.consumer.partitions_for_topic(self.topic) or [])
+        if not numbers:
+            raise ValueError(f"Topic {self.topic} has no partitions")
+        partitions = [TopicPartition(self.topic, number) for number in numbers]
+        first = self.consumer.beginning_offsets(partitions)
+        last = self.consumer.end_offsets(partitions)
+
+        def resolve(bound, default):
+            if bound is None:
+                return dict(default)
+            if isinstance(bound, datetime):
+                found = self.consumer.offsets_for_times({tp: int(bound.timestamp() * 1000) for tp in partitions})
+                # No record at or after the time: the range is empty from there
+                return {tp: found[tp].offset if found.get(tp) is not None else last[tp] for tp in partitions}
+            return {tp: min(max(bound, first[tp]), last[tp]) for tp in partitions}
+
+        return resolve(self.start, first), resolve(self.end, last)
+
+    def chunks(self) -> Iterator[tuple]:
+        """Yields ``(events, undecodable records)`` for every poll until each partition reaches its end."""
+        start, end = self._bounds()
+        remaining = {tp: end[tp] for tp in start if start[tp] < end[tp]}
+        self.total = sum(end[tp] - start[tp] for tp in remaining)
+        if not remaining:
+            return
+        self.consumer.assign(list(remaining))
+        for tp in remaining:
+            self.consumer.seek(tp, start[tp])
+
+        while remaining:
+            batch = self.consumer.poll(timeout_ms=self.poll_timeout_ms)
+            events, undecodable = [], 0
+            for tp, records in batch.items():
+                stop = remaining.get(tp)
+                if stop is None:
+                    continue
+                for message in records:
+                    if message.offset >= stop:
+                        break
+                    self.consumed += 1
+                    try:
+                        events.extend(EventCodec.decode(message.value, EventCodec.content_type(message.headers)))
+                    except Exception as e:
+                        undecodable += 1
+                        sampled_log(logging.ERROR, "replay-undecodable", f"Failed to decode record at offset {message.offset}: {e}")
+            for tp in list(remaining):
+                if self.consumer.position(tp) >= remaining[tp]:
+                    del remaining[tp]
+                    self.consumer.pause(tp)
+            if events or undecodable:
+                yield events, undecodable
+
+    def close(self):
+        self.consumer.close(autocommit=False)
+
+
+class Replay:
+    """
+    Reprocesses traffic events in bulk, from dump files or a Kafka range,
+    for table rebuilds and enrichment changes.
+
+    Chunks of the source are decoded with one parse each. Each distinct
+    coordinate is geocoded once per replay: new coordinates in a chunk are
+    looked up concurrently on the enrichment stage and their addresses are
+    kept for the rest of the run. Enriched chunks are bulk loaded by
+    ``loaders`` threads, every sink in parallel, while the next chunk is
+    prepared; at most ``2 * loaders`` chunks are in flight. A failed load
+    stops the replay. Progress and throughput are logged every
+    ``progress_seconds``. ``event_range`` is the span of event times loaded,
+    for rebuilding aggregates derived from the replayed rows.
+    """
+
+    def __init__(self, source, sinks: dict, stage: EnrichmentStage, day_key,
+                 loaders: int = 4, progress_seconds: float = 10.0):
+        self.source = source
+        self.sinks = sinks
+        self.stage = stage
+        self.day_key = day_key
+        self.loaders = loaders
+        self.progress_seconds = progress_seconds
+        # coordinate key -> address, for the whole run
+        self._addresses = {}
+        self.read = 0
+        self.written = 0
+        self.skipped = 0
+        self.lookups = 0
+        self.failed_lookups = 0
+        self.first_event = None
+        self.last_event = None
+
+    @classmethod
+    def from_env(cls, source, loaders: Optional[int] = None) -> Optional["Replay"]:
+        from Packages.Parser import KafkaParser, Parser
+        sinks = cls.sinks_from_env()
+        if not sinks:
+            return None
+        return cls(
+            source,
+            sinks,
+            EnrichmentStage.from_env(KafkaParser.enrich),
+            Parser.time_to_day_month_year,
+            loaders=loaders or int(os.getenv("REPLAY_LOADERS", "4")),
+            progress_seconds=float(os.getenv("REPLAY_PROGRESS_SECONDS", "10"))
+        )
+
+    @staticmethod
+    def sinks_from_env() -> dict:
+        """Bulk loaders of the TRAFFIC_SINKS, safe to call from several threads at once."""
+        names = [sink.strip() for sink in os.getenv("TRAFFIC_SINKS", "postgres").lower().split(",")]
+        sinks = {}
+        if "postgres" in names:
+            from Packages.PostgresService import PostgresService
+            from Packages.PartitionManager import PartitionManager
+            from Packages.Query import QuerySql
+            pool = PostgresService.get_pool()
+            # Replayed readings replace stored copies instead of being appended again
+            sinks["postgres"] = QuerySql(pool, partitions=PartitionManager.from_env(pool)).replace_traffic_data_batch
+        if "clickhouse" in names:
+            from Packages.ClickHouseQuery import ClickHouseQuery
+            # ClickHouse clients are not thread-safe; each loader thread gets its own
+            local = threading.local()
+
+            def clickhouse(rows):
+                if not hasattr(local, "query"):
+                    local.query = ClickHouseQuery()
+                local.query.insert_traffic_data_batch(rows)
+
+            sinks["clickhouse"] = clickhouse
+        return sinks
+
+    def _geocode(self, rows: list) -> list:
+        """Addresses of the rows, looking up only coordinates not seen before in this replay."""
+        keys = []
+        futures = {}
+        for data in rows:
+            latitude, longitude = data.get("latitude"), data.get("longitude")
+            if (self.stage.defer or latitude is None or longitude is None
+                    or not GeocodingService.validate_coordinates(latitude, longitude)):
+                keys.append(None)
+                continue
+            key = self.stage.key(latitude, longitude)
+            keys.append(key)
+            if key not in self._addresses and key not in futures:
+                futures[key] = self.stage.geocode(latitude, longitude)
+
+        for key, future in futures.items():
+            try:
+                self._addresses[key] = future.result()
+            except Exception as e:
+                # Left empty for the rest of the run; the backfill worker can fill it in
+                sampled_log(logging.ERROR, "replay-geocoding", f"Geocoding failed for {key}: {e}")
+                self._addresses[key] = EMPTY_ADDRESS
+                self.failed_lookups += 1
+        self.lookups += len(futures)
+        return [EMPTY_ADDRESS if key is None else self._addresses[key] for key in keys]
+
+    def _days(self, rows: list) -> list:
+        if ColumnBatch.available():
+            return ColumnBatch(rows).day_keys(self.day_key)
+        days = []
+        for data in rows:
+            try:
+                days.append(self.day_key(data.get("timestamp")))
+            except (TypeError, ValueError, AttributeError):
+                days.append(None)
+        return days
+
+    def prepare(self, events: list) -> list:
+        """Validates, geocodes and enriches one chunk; returns the rows to load."""
+        rows = []
+        for event in events:
+            try:
+                rows.append(TrafficEvent.from_dict(event))
+            except InvalidEvent as e:
+                sampled_log(logging.ERROR, "replay-invalid", f"Invalid event in replay: {e}. Skipping event.")
+        if not rows:
+            return rows
+
+        enriched = []
+        for data, address, day in zip(rows, self._geocode(rows), self._days(rows)):
+            if day is None:
+                sampled_log(logging.ERROR, "replay-timestamp", f"Unparseable timestamp for stream_id {data.get('stream_id')}")
+                continue
+            enriched.append(self.stage.enrich(data, address, day))
+        self._track_range(enriched)
+        return enriched
+
+    def _track_range(self, rows: list):
+        times = [t for t in (_event_time(data.get("timestamp")) for data in rows) if t is not None]
+        if times:
+            first, last = min(times), max(times)
+            self.first_event = first if self.first_event is None else min(self.first_event, first)
+            self.last_event = last if self.last_event is None else max(self.last_event, last)
+
+    def event_range(self) -> Optional[tuple]:
+        """``(first, last)`` event time of the rows prepared so far, or None."""
+        if self.first_event is None:
+            return None
+        return self.first_event, self.last_event
+
+    def _load(self, name, sink, rows):
+        with LOAD_SECONDS.time(sink=name):
+            sink(rows)
+
+    def _collect(self, chunk):
+        futures, count = chunk
+        for future in futures:
+            future.result()
+        self.written += count
+        EVENTS.inc(count, result="written")
+
+    def summary(self, started: float) -> dict:
+        seconds = time.monotonic() - started
+        return {
+            "read": self.read, "written": self.written, "skipped": self.skipped,
+            "lookups": self.lookups, "failed_lookups": self.failed_lookups,
+            "seconds": round(seconds, 3), "events_per_second": round(self.read / seconds, 1) if seconds else 0.0
+        }
+
+    def _report(self, started: float):
+        summary = self.summary(started)
+        progress = self.source.progress()
+        done = f" ({progress:.1%})" if progress is not None else ""
+        logger.info(f"🔁 Replay{done}: {summary['read']:,} read, {summary['written']:,} written, "
+                    f"{summary['skipped']:,} skipped, {summary['lookups']:,} lookups, "
+                    f"{summary['events_per_second']:,.0f} events/s")
+
+    def run(self, stop_event=None) -> dict:
+        """Replays the whole source, or until ``stop_event`` is set, and returns the totals."""
+        started = reported = time.monotonic()
+        in_flight = deque()
+        logger.info(f"🔁 Replaying {self.source.describe()} into {', '.join(self.sinks)} with {self.loaders} loaders")
+        with ThreadPoolExecutor(max_workers=self.loaders, thread_name_prefix="replay-load") as executor:
+            try:
+                for events, undecodable in self.source.chunks():
+                    rows = self.prepare(events)
+                    self.read += len(events) + undecodable
+                    self.skipped += len(events) + undecodable - len(rows)
+                    EVENTS.inc(len(events) + undecodable, result="read")
+                    EVENTS.inc(len(events) + undecodable - len(rows), result="skipped")
+                    if rows:
+                        futures = [executor.submit(self._load, name, sink, rows) for name, sink in self.sinks.items()]
+                        in_flight.append((futures, len(rows)))
+                    while in_flight and (len(in_flight) > 2 * self.loaders or all(f.done() for f in in_flight[0][0])):
+                        self._collect(in_flight.popleft())
+
+                    if time.monotonic() - reported >= self.progress_seconds:
+                        self._report(started)
+                        reported = time.monotonic()
+                    if stop_event is not None and stop_event.is_set():
+                        logger.info("🛑 Replay interrupted")
+                        break
+                while in_flight:
+                    self._collect(in_flight.popleft())
+            except Exception as e:
+                for futures, _ in in_flight:
+                    for future in futures:
+                        future.cancel()
+                logger.error(f"❌ Replay stopped after {self.read:,} events ({self.written:,} written): {e}")
+                raise
+
+        self._report(started)
+        return self.summary(started)
+
+    def shutdown(self):
+        self.stage.shutdown()
+        close = getattr(self.source, "close", None)
+        if close is not None:
+            close()
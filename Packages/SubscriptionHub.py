@@ -0,0 +1,258 @@
+import os
+import json
+import math
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Iterable, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("city", "province", "label")
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+
+
+class Subscription:
+    """
+    One subscriber's filters and bounded outbox.
+
+    ``drop_oldest`` keeps the newest ``max_queue`` events. ``coalesce`` keeps
+    only the newest event per ``stream_id``, so a slow viewer still sees the
+    current state of every stream. Events are held pre-encoded.
+    """
+
+    def __init__(self, filters: Optional[dict] = None, bbox: Optional[Tuple[float, float, float, float]] = None,
+                 max_queue: int = 1000, policy: str = DROP_OLDEST):
+        if policy not in (DROP_OLDEST, COALESCE):
+            raise ValueError(f"Unknown policy: {policy}")
+        self.filters = {field: frozenset(values) for field, values in (filters or {}).items() if values}
+        self.bbox = bbox
+        self.max_queue = max_queue
+        self.policy = policy
+
+        self._queue = OrderedDict() if policy == COALESCE else deque()
+        self._seq = 0
+        self.ready = asyncio.Event()
+        self.delivered = 0
+        self.dropped = 0
+
+    def contains(self, longitude, latitude) -> bool:
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return min_lon <= longitude <= max_lon and min_lat <= latitude <= max_lat
+
+    def offer(self, stream_id, encoded: bytes):
+        if self.policy == COALESCE:
+            if stream_id in self._queue:
+                # A newer reading replaces the pending one for the same stream
+                self._queue[stream_id] = encoded
+                self.dropped += 1
+                self.ready.set()
+                return
+            key = stream_id if stream_id is not None else ("seq", self._seq)
+            self._seq += 1
+            self._queue[key] = encoded
+        else:
+            self._queue.append(encoded)
+
+        if len(self._queue) > self.max_queue:
+            if self.policy == COALESCE:
+                self._queue.popitem(last=False)
+            else:
+                self._queue.popleft()
+            self.dropped += 1
+        self.ready.set()
+
+    def drain(self) -> list:
+        """Takes every pending event, oldest first."""
+        if self.policy == COALESCE:
+            pending = list(self._queue.values())
+        else:
+            pending = list(self._queue)
+        self._queue.clear()
+        self.ready.clear()
+        self.delivered += len(pending)
+        return pending
+
+    async def next_frame(self) -> bytes:
+        """Waits for pending events and returns them as one JSON array frame."""
+        await self.ready.wait()
+        return b"[" + b",".join(self.drain()) + b"]"
+
+
+class SubscriptionHub:
+    """
+    Routes events to many subscriptions with filters evaluated once per event.
+
+    Subscriptions are indexed by every filter value of city, province and
+    label, and by the grid cells (``cell_degrees`` wide) their bounding box
+    covers. An event is matched by intersecting the index entries for its
+    values with the subscriptions that do not filter on that field, so the
+    cost grows with the number of matches rather than with the number of
+    subscribers. Boxes spanning more than ``max_cells`` cells are kept in a
+    short list checked directly. Each event is JSON-encoded once for all of
+    them.
+
+    ``publish`` and ``subscribe`` must run on the event loop thread.
+    """
+
+    def __init__(self, cell_degrees: float = 0.1, max_cells: int = 10000):
+        self.cell_degrees = cell_degrees
+        self.max_cells = max_cells
+        self.subscriptions = set()
+
+        self._by_value = {field: {} for field in FIELDS}
+        self._unfiltered = {field: set() for field in FIELDS}
+        self._by_cell = {}
+        self._anywhere = set()
+        self._wide = set()
+
+        self.published = 0
+
+    def _cell(self, longitude, latitude):
+        return (math.floor(longitude / self.cell_degrees), math.floor(latitude / self.cell_degrees))
+
+    def _cells(self, bbox) -> Iterable[tuple]:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        (x0, y0), (x1, y1) = self._cell(min_lon, min_lat), self._cell(max_lon, max_lat)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            return None
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def subscribe(self, subscription: Subscription) -> Subscription:
+        self.subscriptions.add(subscription)
+        for field in FIELDS:
+            values = subscription.filters.get(field)
+            if values is None:
+                self._unfiltered[field].add(subscription)
+            else:
+                for value in values:
+                    self._by_value[field].setdefault(value, set()).add(subscription)
+        if subscription.bbox is None:
+            self._anywhere.add(subscription)
+        else:
+            cells = self._cells(subscription.bbox)
+            if cells is None:
+                self._wide.add(subscription)
+            else:
+                for cell in cells:
+                    self._by_cell.setdefault(cell, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        for field in FIELDS:
+            self._unfiltered[field].discard(subscription)
+            for value in subscription.filters.get(field, ()):
+                index = self._by_value[field].get(value)
+                if index is not None:
+                    index.discard(subscription)
+                    if not index:
+                        del self._by_value[field][value]
+        self._anywhere.discard(subscription)
+        self._wide.discard(subscription)
+        if subscription.bbox is not None:
+            for cell in self._cells(subscription.bbox) or ():
+                index = self._by_cell.get(cell)
+                if index is not None:
+                    index.discard(subscription)
+                    if not index:
+                        del self._by_cell[cell]
+
+    def match(self, event: dict) -> set:
+        """Subscriptions whose filters accept the event."""
+        longitude, latitude = event.get("longitude"), event.get("latitude")
+        in_box = set()
+        if longitude is not None and latitude is not None:
+            nearby = self._by_cell.get(self._cell(longitude, latitude), set())
+            in_box = {s for s in nearby.union(self._wide) if s.contains(longitude, latitude)}
+        candidates = [self._anywhere | in_box]
+
+        for field in FIELDS:
+            matched = self._by_value[field].get(event.get(field))
+            unfiltered = self._unfiltered[field]
+            candidates.append(unfiltered | matched if matched else unfiltered)
+
+        # Intersect smallest first so the work tracks the number of matches
+        candidates.sort(key=len)
+        result = candidates[0]
+        for candidate in candidates[1:]:
+            if not result:
+                break
+            result = result & candidate
+        return result
+
+    def publish(self, events: Iterable[dict]):
+        for event in events:
+            self.published += 1
+            matches = self.match(event)
+            if not matches:
+                continue
+            encoded = json.dumps(event, default=str).encode("utf-8")
+            stream_id = event.get("stream_id")
+            for subscription in matches:
+                subscription.offer(stream_id, encoded)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscriptions),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in self.subscriptions),
+        }
+
+
+class EnrichedFeed:
+    """
+    Consumes the enriched events topic (or another topic of JSON event
+    arrays, such as the alerts) on a background thread and hands each
+    record's events to the hub on the event loop. Without a consumer group,
+    every API node receives every event.
+    """
+
+    def __init__(self, hub: SubscriptionHub, topic: str, loop: asyncio.AbstractEventLoop):
+        self.hub = hub
+        self.topic = topic
+        self.loop = loop
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"feed-{topic}", daemon=True)
+
+    @staticmethod
+    def from_env(hub: SubscriptionHub, loop: asyncio.AbstractEventLoop) -> Optional["EnrichedFeed"]:
+        topic = os.getenv("ENRICHED_TOPIC")
+        return EnrichedFeed(hub, topic, loop) if topic else None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        from kafka import KafkaConsumer
+        consumer = KafkaConsumer(
+            self.topic,
+            bootstrap_servers=os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
+            auto_offset_reset="latest",
+            enable_auto_commit=False
+        )
+        logger.info(f"📡 Live feed reading '{self.topic}'")
+        try:
+            while not self._stopping.is_set():
+                for records in consumer.poll(timeout_ms=500).values():
+                    for record in records:
+                        try:
+                            events = json.loads(record.value)
+                        except (ValueError, TypeError) as e:
+                            logger.error(f"Skipping undecodable enriched record at offset {record.offset}: {e}")
+                            continue
+                        if isinstance(events, dict):
+                            events = [events]
+                        self.loop.call_soon_threadsafe(self.hub.publish, events)
+        finally:
+            consumer.close()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join(5)
@@ -0,0 +1,110 @@
+import math
+from operator import attrgetter
+from Packages.ConfigService import ConfigService
+
+_config = ConfigService.load()['traffic_data']
+
+FIELDS = tuple(_config['fields'])
+REQUIRED = frozenset(_config['required'])
+TYPES = _config['types']
+
+
+class InvalidEvent(ValueError):
+    """Raised when an event is missing a required field or has a mistyped one."""
+
+
+def _string(field, value):
+    if isinstance(value, str):
+        return value
+    raise InvalidEvent(f"{field} must be a string, got {type(value).__name__}")
+
+
+def _parse(field, value, kind):
+    # Some cameras quote their numbers; a numeric string counts as the number it spells
+    try:
+        number = float(value)
+    except ValueError:
+        raise InvalidEvent(f"{field} must be {kind}, got string {value!r}") from None
+    if not math.isfinite(number):
+        raise InvalidEvent(f"{field} must be {kind}, got string {value!r}")
+    return number
+
+
+def _number(field, value):
+    if isinstance(value, str):
+        return _parse(field, value, "a number")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    raise InvalidEvent(f"{field} must be a number, got {type(value).__name__}")
+
+
+def _integer(field, value):
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            number = _parse(field, value, "an integer")
+        if number.is_integer():
+            return int(number)
+        raise InvalidEvent(f"{field} must be an integer, got string {value!r}")
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    raise InvalidEvent(f"{field} must be an integer, got {type(value).__name__}")
+
+
+_CHECKS = {"string": _string, "number": _number, "integer": _integer}
+
+# (field, required, check) in column order, resolved once from Config.json
+_SCHEMA = tuple((field, field in REQUIRED, _CHECKS[TYPES[field]]) for field in FIELDS)
+_ROW = attrgetter(*FIELDS)
+
+
+class TrafficEvent:
+    """
+    Slotted traffic record with one attribute per Config.json field.
+
+    Supports ``get`` and item access so enrichment and sinks can treat it
+    like the message dicts they already handle, while ``as_row`` hands the
+    values over in column order without per-field lookups.
+    """
+
+    __slots__ = FIELDS
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrafficEvent":
+        """Builds an event from a decoded message, validating every field in one pass."""
+        if not isinstance(data, dict):
+            raise InvalidEvent(f"Expected an event object, got {type(data).__name__}")
+        event = cls.__new__(cls)
+        for field, required, check in _SCHEMA:
+            value = data.get(field)
+            if value is None:
+                if required:
+                    raise InvalidEvent(f"Missing required field: {field}")
+            else:
+                value = check(field, value)
+            setattr(event, field, value)
+        return event
+
+    def as_row(self) -> tuple:
+        return _ROW(self)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def to_dict(self) -> dict:
+        return dict(zip(FIELDS, self.as_row()))
+
+    def __eq__(self, other):
+        return isinstance(other, TrafficEvent) and self.as_row() == other.as_row()
+
+    def __repr__(self):
+        return f"TrafficEvent({self.to_dict()!r})"
@@ -0,0 +1,313 @@
+import os
+import heapq
+import time
+import logging
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+DIMENSIONS = ("stream_id", "location", "city")
+
+# Pseudo partition under which the rollup writer counts landed batches
+BATCHES = ("rollup-batches", 0)
+
+_NO_PARTITION = object()
+
+
+def _epoch(value) -> Optional[float]:
+    """Event time in epoch seconds from an ISO string or datetime; None if unparseable."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return None
+
+
+def parse_windows(spec: str) -> List[Tuple[int, int]]:
+    """
+    Parses ``"60,300:60"`` into ``[(60, 60), (300, 60)]``: each entry is a
+    window size in seconds, optionally followed by ``:slide``. Entries without
+    a slide are tumbling windows.
+    """
+    windows = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        size, _, slide = entry.partition(":")
+        size = int(size)
+        slide = int(slide) if slide else size
+        if size <= 0 or slide <= 0 or size % slide:
+            raise ValueError(f"Invalid window '{entry}': size must be a positive multiple of slide")
+        windows.append((size, slide))
+    return windows
+
+
+class _Aggregate:
+    """Running aggregate for one key in one window; every update is O(1)."""
+
+    __slots__ = ("count", "total", "max_total", "capacity", "labels")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max_total = 0
+        self.capacity = 0
+        self.labels = {}
+
+    def add(self, total_in_area, estimated_max_people, label):
+        self.count += 1
+        self.total += total_in_area
+        if self.count == 1 or total_in_area > self.max_total:
+            self.max_total = total_in_area
+        self.capacity += estimated_max_people or 0
+        if label is not None:
+            self.labels[label] = self.labels.get(label, 0) + 1
+
+
+class WindowAggregator:
+    """
+    Incremental tumbling and sliding window aggregates over traffic events.
+
+    Each event updates one running aggregate per (window, dimension) it falls
+    in: count, sum/avg/max of ``total_in_area``, the occupancy ratio against
+    ``estimated_max_people`` and a label histogram, keyed by ``stream_id``,
+    ``location`` and ``city``. Aggregates are kept per Kafka partition and
+    every row carries its ``source_partition``, so a window rebuilt from the
+    same records replaces its row instead of adding to it.
+
+    Every partition's watermark trails its newest event time by
+    ``allowed_lateness`` seconds, and the aggregator's watermark is the lowest
+    of them, so a partition catching up after a restart is not dropped as
+    late. A window closes once the watermark passes its end; ``close``
+    returns the rollup rows of every closed window in one batch. Events for
+    windows that already closed are dropped and counted in ``late_events``.
+    A partition without events for ``allowed_lateness`` seconds of wall time
+    stops holding the watermark back; once all are quiet the watermark catches
+    up with the newest event so quiet streams still emit.
+
+    ``held`` gives, per partition, the first offset of the records in windows
+    that are still open or whose rows have not landed. Offsets are committed
+    no further, so whoever consumes the partition next rebuilds those windows
+    whole.
+    """
+
+    def __init__(self, windows: Sequence[Tuple[int, int]], dimensions: Sequence[str] = DIMENSIONS,
+                 allowed_lateness: float = 10.0):
+        self.windows = list(windows)
+        self.dimensions = tuple(dimensions)
+        self.allowed_lateness = allowed_lateness
+
+        # (size, slide, start) -> {(dimension, key, partition): _Aggregate}
+        self.open = {}
+        # (end, size, slide, start) for every open window, earliest end first
+        self._ends = []
+        # (size, slide, start) -> {partition: first offset in the window}
+        self._firsts = {}
+        # (batch, {partition: first offset}) for closed batches not landed yet
+        self._closed = []
+        self.batches = 0
+
+        # partition -> [newest event time, monotonic time of its last event]
+        self._partitions = {}
+        self.max_event_time = None
+        self.watermark = float("-inf")
+
+        self.events = 0
+        self.late_events = 0
+        self.invalid_events = 0
+
+    @staticmethod
+    def from_env() -> Optional["WindowAggregator"]:
+        """Builds the aggregator from ROLLUP_* variables; None when ROLLUP_WINDOWS is empty."""
+        windows = parse_windows(os.getenv("ROLLUP_WINDOWS", ""))
+        if not windows:
+            return None
+        dimensions = [d.strip() for d in os.getenv("ROLLUP_DIMENSIONS", ",".join(DIMENSIONS)).split(",") if d.strip()]
+        return WindowAggregator(
+            windows,
+            dimensions=dimensions,
+            allowed_lateness=float(os.getenv("ROLLUP_ALLOWED_LATENESS_SECONDS", "10"))
+        )
+
+    def add(self, event, message=None) -> bool:
+        """
+        Folds one event into its windows; ``message`` is the Kafka record it
+        came from. Returns False if it was late or unusable.
+        """
+        event_time = _epoch(event.get("timestamp"))
+        total_in_area = event.get("total_in_area")
+        if event_time is None or total_in_area is None:
+            self.invalid_events += 1
+            return False
+
+        partition = None if message is None else (message.topic, message.partition)
+        now = time.monotonic()
+        seen = self._partitions.get(partition)
+        if seen is None:
+            self._partitions[partition] = [event_time, now]
+            self._advance(now, partition)
+        else:
+            seen[1] = now
+            if event_time > seen[0]:
+                seen[0] = event_time
+                self._advance(now, partition)
+        if self.max_event_time is None or event_time > self.max_event_time:
+            self.max_event_time = event_time
+
+        keys = [(dimension, event.get(dimension), partition) for dimension in self.dimensions]
+        estimated_max_people = event.get("estimated_max_people")
+        label = event.get("label")
+
+        accepted = False
+        for size, slide in self.windows:
+            # Sliding windows overlap: the event belongs to size / slide of them
+            last_start = event_time - event_time % slide
+            for start in range(int(last_start), int(event_time - size), -slide):
+                end = start + size
+                if end <= self.watermark:
+                    continue
+                accepted = True
+
+                window = self.open.get((size, slide, start))
+                if window is None:
+                    window = self.open[(size, slide, start)] = {}
+                    heapq.heappush(self._ends, (end, size, slide, start))
+
+                for key in keys:
+                    if key[1] is None:
+                        continue
+                    aggregate = window.get(key)
+                    if aggregate is None:
+                        aggregate = window[key] = _Aggregate()
+                    aggregate.add(total_in_area, estimated_max_people, label)
+
+                if message is not None:
+                    firsts = self._firsts.setdefault((size, slide, start), {})
+                    if message.offset < firsts.get(partition, message.offset + 1):
+                        firsts[partition] = message.offset
+
+        if accepted:
+            self.events += 1
+        else:
+            self.late_events += 1
+        return accepted
+
+    def _advance(self, now, current=_NO_PARTITION):
+        """Raises the watermark to the lowest one among partitions that are not quiet."""
+        active = [newest for partition, (newest, last) in self._partitions.items()
+                  if partition == current or now - last < self.allowed_lateness]
+        if active:
+            self.watermark = max(self.watermark, min(active) - self.allowed_lateness)
+        elif self.max_event_time is not None:
+            self.watermark = max(self.watermark, self.max_event_time)
+
+    def close(self, final: bool = False) -> List[dict]:
+        """
+        Returns the rollup rows of every window the watermark has passed.
+        ``final`` closes all open windows, e.g. when the consumer shuts down;
+        their records stay held, so the next owner rebuilds them whole.
+        """
+        if final:
+            watermark = float("inf")
+        else:
+            self._advance(time.monotonic())
+            watermark = self.watermark
+
+        rows = []
+        held = {}
+        while self._ends and self._ends[0][0] <= watermark:
+            end, size, slide, start = heapq.heappop(self._ends)
+            window = self.open.pop((size, slide, start))
+            rows.extend(self._rows(start, end, size, slide, window))
+            if not final:
+                for partition, offset in self._firsts.pop((size, slide, start), {}).items():
+                    held[partition] = min(offset, held.get(partition, offset))
+
+        if rows:
+            self.batches += 1
+            if held:
+                self._closed.append((self.batches, held))
+            logging.debug(f"🪟 Closed {len(rows)} rollup rows (watermark {self.watermark})")
+        return rows
+
+    def marker(self) -> SimpleNamespace:
+        """
+        Record to submit the last closed batch's rows with: the rollup
+        writer's ``landed[BATCHES]`` then counts the batches that landed.
+        """
+        return SimpleNamespace(topic=BATCHES[0], partition=BATCHES[1], offset=self.batches - 1)
+
+    def held(self, landed: int = 0) -> dict:
+        """
+        First offset, per partition, of the records in windows that are still
+        open or whose batch is not among the first ``landed`` written ones.
+        """
+        while self._closed and self._closed[0][0] <= landed:
+            self._closed.pop(0)
+        held = {}
+        for firsts in list(self._firsts.values()) + [firsts for _, firsts in self._closed]:
+            for partition, offset in firsts.items():
+                if offset < held.get(partition, offset + 1):
+                    held[partition] = offset
+        return held
+
+    def assign(self, partitions):
+        """
+        Registers ``(topic, partition)`` pairs before their first event, so a
+        partition that is behind holds the watermark back until it delivers.
+        """
+        now = time.monotonic()
+        for partition in partitions:
+            self._partitions.setdefault(partition, [float("-inf"), now])
+
+    def forget(self, partitions):
+        """Drops the window state of ``(topic, partition)`` pairs given up in a rebalance."""
+        partitions = set(partitions)
+        for partition in partitions:
+            self._partitions.pop(partition, None)
+        for window in self.open.values():
+            for key in [key for key in window if key[2] in partitions]:
+                del window[key]
+        for firsts in list(self._firsts.values()) + [firsts for _, firsts in self._closed]:
+            for partition in partitions:
+                firsts.pop(partition, None)
+
+    @staticmethod
+    def _rows(start, end, size, slide, window) -> List[dict]:
+        window_start = datetime.fromtimestamp(start, tz=timezone.utc)
+        window_end = datetime.fromtimestamp(end, tz=timezone.utc)
+        rows = []
+        for (dimension, key, partition), aggregate in window.items():
+            rows.append({
+                "window_start": window_start,
+                "window_end": window_end,
+                "window_seconds": size,
+                "slide_seconds": slide,
+                "dimension": dimension,
+                "key": str(key),
+                "source_partition": 0 if partition is None else partition[1],
+                "event_count": aggregate.count,
+                "sum_total_in_area": aggregate.total,
+                "avg_total_in_area": aggregate.total / aggregate.count,
+                "max_total_in_area": aggregate.max_total,
+                "sum_estimated_max_people": aggregate.capacity,
+                "occupancy_ratio": aggregate.total / aggregate.capacity if aggregate.capacity else None,
+                "label_counts": dict(aggregate.labels),
+            })
+        return rows
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "late_events": self.late_events,
+            "invalid_events": self.invalid_events,
+            "open_windows": len(self.open),
+            "partitions": len(self._partitions),
+            "watermark": self.watermark,
+        }
@@ -0,0 +1,121 @@
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+
+
+def child_stop_event(pool_stop) -> threading.Event:
+    """
+    Stop event of one child process: set when the pool stops, or when
+    SIGTERM is sent to this child alone, which leaves its siblings running.
+    """
+    stop_event = threading.Event()
+    # The supervisor owns SIGINT; SIGTERM sent straight to a child still drains it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    def follow_pool():
+        # Polled rather than waited on: a child killed inside
+        # multiprocessing.Event.wait would block the supervisor's set()
+        while not stop_event.wait(0.5):
+            if pool_stop.is_set():
+                stop_event.set()
+
+    threading.Thread(target=follow_pool, name="pool-stop", daemon=True).start()
+    return stop_event
+
+
+def _run_consumer(index, topic, group_id, pool_stop):
+    stop_event = child_stop_event(pool_stop)
+
+    from Packages.Parser import KafkaParser
+    from Packages import Metrics
+    Metrics.serve_from_env(offset=index)
+    signal.signal(signal.SIGUSR2, Metrics.toggle_profiler)
+    logging.info(f"👷 Worker {index} started (pid {os.getpid()})")
+    KafkaParser.consumer_kafka(topic, group_id=group_id, stop_event=stop_event, worker=index)
+
+
+class WorkerPool:
+    """
+    Supervises a pool of consumer processes sharing one consumer group.
+
+    Kafka spreads the topic's partitions across the processes and rebalances
+    when one joins or leaves. Crashed children are restarted with a backoff
+    that grows while they keep crashing. SIGTERM/SIGINT ask every child to
+    drain (flush and commit) and exit; children still running after
+    ``drain_timeout`` seconds are killed.
+    """
+
+    def __init__(self, topic: str, group_id: str, workers: int, drain_timeout: float = 30.0,
+                 target=_run_consumer):
+        self.topic = topic
+        self.group_id = group_id
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.target = target
+
+        self.stop_event = multiprocessing.Event()
+        self.processes = {}
+        self.restarts = {}
+        self.next_start = {}
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(
+            target=self.target,
+            args=(index, self.topic, self.group_id, self.stop_event),
+            name=f"consumer-{index}"
+        )
+        process.start()
+        self.processes[index] = (process, time.monotonic())
+
+    def _check(self):
+        now = time.monotonic()
+        for index, (process, started) in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            if now - started > 60:
+                # It ran for a while before dying; do not treat it as a crash loop
+                self.restarts[index] = 0
+            if index not in self.next_start:
+                delay = min(2 ** self.restarts.get(index, 0), 60)
+                self.next_start[index] = now + delay
+                logging.error(f"💥 Worker {index} exited with code {process.exitcode}, restarting in {delay}s")
+
+            if now >= self.next_start[index]:
+                del self.next_start[index]
+                self.restarts[index] = self.restarts.get(index, 0) + 1
+                self._spawn(index)
+
+    def stop(self, signum=None, frame=None):
+        if not self.stop_event.is_set():
+            logging.info("🛑 Stopping workers...")
+        self.stop_event.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for index in range(self.workers):
+            self._spawn(index)
+        logging.info(f"👷 Started {self.workers} consumers on '{self.topic}' in group '{self.group_id}'")
+
+        while not self.stop_event.wait(1.0):
+            self._check()
+
+        self.drain()
+
+    def drain(self):
+        """Waits up to ``drain_timeout`` for the stopped children, then kills the rest."""
+        deadline = time.monotonic() + self.drain_timeout
+        for index, (process, _) in self.processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                # SIGTERM would only ask again; a child stuck draining needs SIGKILL
+                logging.warning(f"⚠️ Worker {index} did not drain in time, killing it")
+                process.kill()
+                process.join(5)
+        logging.info("🛑 All workers stopped")
@@ -1,15 +1,82 @@
+-- ClickHouse schema, for reference. It is applied and upgraded from code:
+--   python Worker.py --mode migrate-clickhouse
+-- (Packages/ClickHouseSchema.py; CLICKHOUSE_PARTITION_BY=day partitions by toDate(timestamp))
+
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version UInt32,
+    name String,
+    applied_at DateTime DEFAULT now()
+) ENGINE = MergeTree
+ORDER BY version;
+
 -- Traffic Data Table for ClickHouse
 CREATE TABLE IF NOT EXISTS traffic_data (
     stream_id String,
     timestamp DateTime64(3, 'UTC'),
-    location String,
+    day_month_year Date,
+    location LowCardinality(String),
     longitude Decimal(10, 6),
     latitude Decimal(10, 6),
     total_in_area Int32,
     estimated_max_people Int32,
-    label String,
-    type String,
+    label LowCardinality(String),
+    type LowCardinality(String),
     fulladdress Nullable(String),
-    created_at DateTime DEFAULT now()
-) ENGINE = ReplacingMergeTree()
-ORDER BY stream_id;
+    city LowCardinality(Nullable(String)),
+    province LowCardinality(Nullable(String)),
+    created_at DateTime DEFAULT now(),
+    INDEX idx_coordinates (longitude, latitude) TYPE minmax GRANULARITY 4
+) ENGINE = ReplacingMergeTree(created_at)
+PARTITION BY toYYYYMM(timestamp)
+ORDER BY (location, timestamp, stream_id)
+-- A retried insert block (same insert_deduplication_token) is dropped, here and in the rollups
+SETTINGS non_replicated_deduplication_window = 1000;
+
+-- Per-minute rollup, filled by its materialized view on every insert. Rows
+-- that traffic_data later collapses as duplicates (e.g. from a replay) are
+-- counted again; ClickHouseSchema.rebuild_rollups recomputes a range, and
+-- Worker.py --mode replay runs it for the replayed range
+CREATE TABLE IF NOT EXISTS traffic_rollup_1m (
+    bucket_start DateTime('UTC'),
+    location LowCardinality(String),
+    city LowCardinality(String),
+    province LowCardinality(String),
+    events SimpleAggregateFunction(sum, UInt64),
+    sum_total_in_area SimpleAggregateFunction(sum, Int64),
+    max_total_in_area SimpleAggregateFunction(max, Int32),
+    sum_estimated_max_people SimpleAggregateFunction(sum, Int64)
+) ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(bucket_start)
+ORDER BY (location, bucket_start, city, province)
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS traffic_rollup_1m_mv TO traffic_rollup_1m AS
+SELECT toStartOfMinute(timestamp) AS bucket_start,
+       location,
+       ifNull(traffic_data.city, '') AS city,
+       ifNull(traffic_data.province, '') AS province,
+       toUInt64(count()) AS events,
+       toInt64(sum(total_in_area)) AS sum_total_in_area,
+       max(total_in_area) AS max_total_in_area,
+       toInt64(sum(estimated_max_people)) AS sum_estimated_max_people
+FROM traffic_data
+GROUP BY bucket_start, location, city, province;
+
+-- Per-hour rollup, same columns
+CREATE TABLE IF NOT EXISTS traffic_rollup_1h AS traffic_rollup_1m
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(bucket_start)
+ORDER BY (location, bucket_start, city, province)
+SETTINGS non_replicated_deduplication_window = 1000;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS traffic_rollup_1h_mv TO traffic_rollup_1h AS
+SELECT toStartOfHour(timestamp) AS bucket_start,
+       location,
+       ifNull(traffic_data.city, '') AS city,
+       ifNull(traffic_data.province, '') AS province,
+       toUInt64(count()) AS events,
+       toInt64(sum(total_in_area)) AS sum_total_in_area,
+       max(total_in_area) AS max_total_in_area,
+       toInt64(sum(estimated_max_people)) AS sum_estimated_max_people
+FROM traffic_data
+GROUP BY bucket_start, location, city, province;
@@ -1,6 +1,35 @@
+-- Upgrade from a traffic_data created before partitioning (a plain table):
+-- it is renamed to traffic_data_v0, with its indexes, so the partitioned table
+-- below can be created, and its rows are copied over further down. Stop the
+-- consumers while this runs, then run `python Worker.py --mode maintain` to
+-- move the copied days into their partitions and drop traffic_data_v0 once
+-- verified.
+DO $$
+DECLARE
+    legacy_index record;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('traffic_data') AND relkind = 'r') THEN
+        IF to_regclass('traffic_data_v0') IS NOT NULL THEN
+            RAISE EXCEPTION 'traffic_data_v0 already exists; drop or rename it before upgrading traffic_data';
+        END IF;
+        ALTER TABLE traffic_data RENAME TO traffic_data_v0;
+        FOR legacy_index IN
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = 'traffic_data_v0'::regclass
+        LOOP
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', legacy_index.relname, legacy_index.relname || '_v0');
+        END LOOP;
+        RAISE NOTICE 'Moved the unpartitioned traffic_data to traffic_data_v0';
+    END IF;
+END $$;
+
 -- Traffic Data Table
+-- Range partitioned by day on timestamp. Daily partitions (traffic_data_pYYYYMMDD)
+-- are created ahead of time and expired by `python Worker.py --mode maintain`;
+-- the consumer also creates the partition for any day it sees in a batch.
+-- The primary key of a partitioned table must include the partition key.
 CREATE TABLE IF NOT EXISTS traffic_data (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
     stream_id UUID NOT NULL,
     day_month_year VARCHAR(10) NOT NULL,
     timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
@@ -14,23 +43,161 @@ CREATE TABLE IF NOT EXISTS traffic_data (
     fulladdress TEXT,
     city TEXT,
     province TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
--- Index on stream_id for lookups
-CREATE INDEX idx_traffic_stream_id ON traffic_data(stream_id);
+-- Catches rows for days without a partition yet; they are moved out when the day's partition is created
+CREATE TABLE IF NOT EXISTS traffic_data_default PARTITION OF traffic_data DEFAULT;
+
+-- Rows of an upgraded table land in the default partition until maintenance
+-- creates their days' partitions
+DO $$
+BEGIN
+    IF to_regclass('traffic_data_v0') IS NOT NULL AND NOT EXISTS (SELECT 1 FROM traffic_data) THEN
+        INSERT INTO traffic_data (id, stream_id, day_month_year, timestamp, location, longitude, latitude,
+                                  total_in_area, estimated_max_people, label, type, fulladdress, city, province, created_at)
+        SELECT id, stream_id, day_month_year, timestamp, location, longitude, latitude,
+               total_in_area, estimated_max_people, label, type, fulladdress, city, province, created_at
+        FROM traffic_data_v0;
+        RAISE NOTICE 'Copied traffic_data_v0 into traffic_data';
+    END IF;
+END $$;
 
--- Time-based queries (most common for analytics)
-CREATE INDEX idx_traffic_timestamp ON traffic_data(timestamp DESC);
+-- Indexes declared on the parent are created on every partition.
+-- Partition pruning already narrows time ranges, so there is no separate
+-- timestamp-only index; the composite index below serves timestamp ordering.
+
+-- Index on stream_id for lookups
+CREATE INDEX IF NOT EXISTS idx_traffic_stream_id ON traffic_data(stream_id);
 
 -- Geospatial queries
-CREATE INDEX idx_traffic_location ON traffic_data(location);
-CREATE INDEX idx_traffic_coordinates ON traffic_data(longitude, latitude);
+CREATE INDEX IF NOT EXISTS idx_traffic_location ON traffic_data(location);
+CREATE INDEX IF NOT EXISTS idx_traffic_coordinates ON traffic_data(longitude, latitude);
 
 -- Filtering by type/label
-CREATE INDEX idx_traffic_type ON traffic_data(type);
-CREATE INDEX idx_traffic_label ON traffic_data(label);
+CREATE INDEX IF NOT EXISTS idx_traffic_type ON traffic_data(type);
+CREATE INDEX IF NOT EXISTS idx_traffic_label ON traffic_data(label);
 
 -- Composite index for common query patterns
-CREATE INDEX idx_traffic_time_location ON traffic_data(timestamp DESC, location);
+CREATE INDEX IF NOT EXISTS idx_traffic_time_location ON traffic_data(timestamp DESC, location);
+
+-- Rows still waiting for an address (GEOCODING_MODE=deferred), scanned by `Worker.py --mode backfill`
+CREATE INDEX IF NOT EXISTS idx_traffic_unresolved ON traffic_data(latitude, longitude)
+    WHERE city IS NULL AND province IS NULL AND fulladdress IS NULL;
+
+-- Latest state per stream (POSTGRES_WRITE_MODE=upsert|both)
+-- The primary key on stream_id is the conflict target for ON CONFLICT upserts
+CREATE TABLE IF NOT EXISTS traffic_latest (
+    stream_id UUID PRIMARY KEY,
+    day_month_year VARCHAR(10) NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    location TEXT NOT NULL,
+    longitude NUMERIC(10, 6) NOT NULL,
+    latitude NUMERIC(10, 6) NOT NULL,
+    total_in_area INTEGER NOT NULL,
+    estimated_max_people INTEGER NOT NULL,
+    label VARCHAR(10) NOT NULL,
+    type VARCHAR(10) NOT NULL,
+    fulladdress TEXT,
+    city TEXT,
+    province TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_traffic_latest_location ON traffic_latest(location);
+
+-- Closed window aggregates from the consumer (ROLLUP_WINDOWS)
+-- One row per dimension key, window and Kafka partition the events came from;
+-- traffic_rollup_totals adds up the partitions
+CREATE TABLE IF NOT EXISTS traffic_rollup (
+    window_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    window_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    window_seconds INTEGER NOT NULL,
+    slide_seconds INTEGER NOT NULL,
+    dimension VARCHAR(20) NOT NULL,
+    key TEXT NOT NULL,
+    source_partition INTEGER NOT NULL DEFAULT 0,
+    event_count INTEGER NOT NULL,
+    sum_total_in_area BIGINT NOT NULL,
+    avg_total_in_area DOUBLE PRECISION NOT NULL,
+    max_total_in_area INTEGER NOT NULL,
+    sum_estimated_max_people BIGINT NOT NULL DEFAULT 0,
+    occupancy_ratio DOUBLE PRECISION,
+    label_counts JSONB NOT NULL DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (dimension, key, window_seconds, slide_seconds, window_start, source_partition)
+);
+
+-- Capacity is kept so windows can be added up with their occupancy_ratio
+ALTER TABLE traffic_rollup ADD COLUMN IF NOT EXISTS sum_estimated_max_people BIGINT NOT NULL DEFAULT 0;
+
+-- Rows are kept per source partition so a rebuilt window replaces its own row
+ALTER TABLE traffic_rollup ADD COLUMN IF NOT EXISTS source_partition INTEGER NOT NULL DEFAULT 0;
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.key_column_usage
+        WHERE table_name = 'traffic_rollup' AND constraint_name = 'traffic_rollup_pkey'
+        AND column_name = 'source_partition'
+    ) THEN
+        ALTER TABLE traffic_rollup DROP CONSTRAINT IF EXISTS traffic_rollup_pkey;
+        ALTER TABLE traffic_rollup ADD CONSTRAINT traffic_rollup_pkey
+            PRIMARY KEY (dimension, key, window_seconds, slide_seconds, window_start, source_partition);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_traffic_rollup_window ON traffic_rollup(window_seconds, window_start DESC);
+
+-- Windows added up over the partitions that wrote them
+CREATE OR REPLACE VIEW traffic_rollup_totals AS
+SELECT r.dimension, r.key, r.window_seconds, r.slide_seconds, r.window_start,
+    MAX(r.window_end) AS window_end,
+    SUM(r.event_count) AS event_count,
+    SUM(r.sum_total_in_area) AS sum_total_in_area,
+    SUM(r.sum_total_in_area)::DOUBLE PRECISION / SUM(r.event_count) AS avg_total_in_area,
+    MAX(r.max_total_in_area) AS max_total_in_area,
+    SUM(r.sum_estimated_max_people) AS sum_estimated_max_people,
+    SUM(r.sum_total_in_area)::DOUBLE PRECISION / NULLIF(SUM(r.sum_estimated_max_people), 0) AS occupancy_ratio,
+    (
+        SELECT COALESCE(jsonb_object_agg(label, total), '{}'::jsonb) FROM (
+            SELECT labels.label, SUM(labels.n::BIGINT) AS total
+            FROM traffic_rollup p, jsonb_each_text(p.label_counts) AS labels (label, n)
+            WHERE p.dimension = r.dimension AND p.key = r.key AND p.window_seconds = r.window_seconds
+            AND p.slide_seconds = r.slide_seconds AND p.window_start = r.window_start
+            GROUP BY labels.label
+        ) AS merged
+    ) AS label_counts
+FROM traffic_rollup r
+GROUP BY r.dimension, r.key, r.window_seconds, r.slide_seconds, r.window_start;
+
+-- Write sequence bumped by every transaction that changes the traffic tables
+-- (consumer batches, replays, address backfill, retention); the analytics API
+-- invalidates its result cache when it moves. Also keeps the newest event time
+CREATE TABLE IF NOT EXISTS ingest_watermark (
+    name VARCHAR(50) PRIMARY KEY,
+    watermark TIMESTAMP WITH TIME ZONE,
+    sequence BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE ingest_watermark ADD COLUMN IF NOT EXISTS sequence BIGINT NOT NULL DEFAULT 0;
+-- Backfill and retention bump the sequence without a new event time
+ALTER TABLE ingest_watermark ALTER COLUMN watermark DROP NOT NULL;
+
+-- Next offset to consume per partition, written in the same transaction as
+-- each traffic_data batch (KAFKA_OFFSET_STORE=postgres); consumers seek here
+-- when partitions are assigned
+CREATE TABLE IF NOT EXISTS kafka_offsets (
+    consumer_group TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    partition INTEGER NOT NULL,
+    next_offset BIGINT NOT NULL,
+    written_offset BIGINT,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (consumer_group, topic, partition)
+);
 
+-- Position the sinks were written up to when next_offset is held back by
+-- open rollup windows; records in between only rebuild those windows
+ALTER TABLE kafka_offsets ADD COLUMN IF NOT EXISTS written_offset BIGINT;
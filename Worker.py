@@ -1,12 +1,168 @@
 import argparse
-import time
-from Packages.Parser import KafkaParser
+import os
+import signal
+import logging
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
 
 TOPIC = "ws_incoming"
 
-def main():
-    KafkaParser.consumer_kafka(TOPIC)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Traffic stream analytics worker")
+    parser.add_argument("--mode", choices=["consumer", "maintain", "backfill", "replay", "migrate-clickhouse", "rebuild-rollups"], default="consumer")
+    parser.add_argument("--topic", default=os.getenv("KAFKA_TOPIC", TOPIC),
+                        help="Kafka topic to consume")
+    parser.add_argument("--group-id", default=os.getenv("KAFKA_GROUP_ID") or "traffic-consumer",
+                        help="Kafka consumer group shared by all workers")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of consumer processes")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="Seconds to wait for workers to flush on shutdown")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="Maintain and backfill modes: repeat every N seconds (0 runs once)")
+    parser.add_argument("--file", nargs="+",
+                        help="Replay mode: NDJSON dump files (.gz, .bz2, .xz, .zst, .lz4) instead of the topic")
+    parser.add_argument("--start", help="Replay mode: first offset or ISO timestamp of the topic range; "
+                                        "rebuild-rollups mode: first ISO timestamp to rebuild")
+    parser.add_argument("--end", help="Replay mode: offset or ISO timestamp the topic range ends before; "
+                                      "rebuild-rollups mode: last ISO timestamp to rebuild")
+    parser.add_argument("--partitions", help="Replay mode: comma-separated partitions (default all)")
+    parser.add_argument("--loaders", type=int, default=int(os.getenv("REPLAY_LOADERS", "4")),
+                        help="Replay mode: parallel bulk loads")
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("REPLAY_CHUNK_SIZE", "5000")),
+                        help="Replay mode: lines or records decoded and loaded per chunk")
+    return parser.parse_args(argv)
+
+
+def run_consumer(args):
+    if args.workers > 1:
+        from Packages.WorkerPool import WorkerPool
+        WorkerPool(args.topic, args.group_id, args.workers, drain_timeout=args.drain_timeout).run()
+        return
+
+    from Packages.Parser import KafkaParser
+    from Packages import Metrics
+    Metrics.serve_from_env()
+    signal.signal(signal.SIGUSR2, Metrics.toggle_profiler)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    KafkaParser.consumer_kafka(args.topic, group_id=args.group_id, stop_event=stop_event)
+
+
+def run_maintain(args):
+    from Packages.PostgresService import PostgresService
+    from Packages.PartitionManager import PartitionManager
+    manager = PartitionManager.from_env(PostgresService.get_pool())
+    if manager is None:
+        logging.warning("⚠️ POSTGRES_PARTITIONING is disabled, nothing to maintain")
+        return
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    while True:
+        try:
+            result = manager.maintain()
+        except RuntimeError as e:
+            logging.error(f"❌ {e}")
+            return
+        logging.info(f"📦 Partition maintenance: {len(result['created'])} created, {len(result['expired'])} expired")
+        if args.interval <= 0 or stop_event.wait(args.interval):
+            return
+
+
+def run_backfill(args):
+    from Packages.AddressBackfill import AddressBackfill
+    backfill = AddressBackfill.from_env()
+    if backfill is None:
+        logging.warning("⚠️ TRAFFIC_SINKS has no postgres or clickhouse sink, nothing to backfill")
+        return
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    try:
+        backfill.run(stop_event, interval=args.interval)
+    finally:
+        backfill.shutdown()
+
+
+def run_replay(args):
+    from Packages.Replay import Replay, FileSource, KafkaRangeSource, parse_bound
+    if args.file:
+        source = FileSource(args.file, chunk_size=args.chunk_size)
+    else:
+        from Packages.KafkaService import KafkaService
+        partitions = [int(p) for p in args.partitions.split(",")] if args.partitions else None
+        source = KafkaRangeSource(KafkaService.get_reader(args.chunk_size), args.topic,
+                                  start=parse_bound(args.start), end=parse_bound(args.end), partitions=partitions)
+    replay = Replay.from_env(source, loaders=args.loaders)
+    if replay is None:
+        logging.warning("⚠️ TRAFFIC_SINKS has no postgres or clickhouse sink, nothing to replay into")
+        if isinstance(source, KafkaRangeSource):
+            source.close()
+        return
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    try:
+        result = replay.run(stop_event)
+        logging.info(f"✅ Replay finished: {result}")
+    finally:
+        replay.shutdown()
+
+    # The ClickHouse rollup views counted the replayed rows again; recompute
+    # them from the deduplicated rows
+    event_range = replay.event_range()
+    if "clickhouse" in replay.sinks and event_range is not None:
+        rebuild_rollups(*event_range)
+
+
+def rebuild_rollups(start, end):
+    from Packages.ClickHouseService import ClickHouseService
+    from Packages.ClickHouseSchema import ClickHouseSchema
+    ClickHouseSchema.from_env(ClickHouseService.get_connection()).rebuild_rollups(start, end)
+
+
+def run_rebuild_rollups(args):
+    from Packages.Replay import parse_bound
+    start, end = parse_bound(args.start), parse_bound(args.end)
+    if not isinstance(start, datetime) or not isinstance(end, datetime):
+        logging.error("❌ rebuild-rollups needs --start and --end as ISO timestamps")
+        return
+    rebuild_rollups(start, end)
+
+
+def run_migrate_clickhouse(args):
+    from Packages.ClickHouseService import ClickHouseService
+    from Packages.ClickHouseSchema import ClickHouseSchema
+    applied = ClickHouseSchema.from_env(ClickHouseService.get_connection()).migrate()
+    logging.info(f"🗄️ ClickHouse migrations applied: {', '.join(applied) or 'none'}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode == "consumer":
+        run_consumer(args)
+    elif args.mode == "maintain":
+        run_maintain(args)
+    elif args.mode == "backfill":
+        run_backfill(args)
+    elif args.mode == "replay":
+        run_replay(args)
+    elif args.mode == "migrate-clickhouse":
+        run_migrate_clickhouse(args)
+    elif args.mode == "rebuild-rollups":
+        run_rebuild_rollups(args)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
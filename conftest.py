@@ -0,0 +1,14 @@
+"""
+Shared pytest fixtures
+"""
+import pytest
+from Packages.GeocodingService import GeocodingService
+
+
+@pytest.fixture(autouse=True)
+def isolated_geocoding_cache(monkeypatch):
+    """Tests never read or write the on-disk geocoding cache from .env; each gets a fresh memory-only cache"""
+    monkeypatch.setenv("GEOCODING_CACHE_PATH", "")
+    GeocodingService._cache = None
+    yield
+    GeocodingService._cache = None
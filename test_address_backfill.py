@@ -0,0 +1,151 @@
+"""
+Unit tests for deferred geocoding and the address backfill worker
+"""
+import threading
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from Packages.AddressBackfill import AddressBackfill, ClickHouseBackfill, PostgresBackfill, coordinate_key
+from Packages.Enrichment import EnrichmentStage
+from Packages.PostgresService import PostgresPool
+from Packages.Parser import KafkaParser, Parser
+
+ADDRESS = {"city": "Jakarta", "province": "DKI Jakarta", "fulladdress": "Jl. Sudirman"}
+EMPTY = {"city": None, "province": None, "fulladdress": None}
+
+
+class FakeTarget:
+    name = "fake"
+
+    def __init__(self, coordinates):
+        self.coordinates = coordinates
+        self.scans = []
+        self.applied = []
+
+    def unresolved(self, limit, blocked):
+        self.scans.append(set(blocked))
+        return [c for c in self.coordinates if coordinate_key(*c) not in blocked][:limit]
+
+    def apply(self, resolved):
+        self.applied.append(dict(resolved))
+        self.coordinates = [c for c in self.coordinates if c not in resolved]
+        return len(resolved)
+
+
+def _backfill(target):
+    stage = EnrichmentStage(None, max_workers=2)
+    return AddressBackfill([target], stage, batch_size=10, base_backoff=30, max_backoff=100)
+
+
+def test_deferred_mode_skips_geocoding():
+    """Rows are enriched with empty addresses and day keys without any lookup"""
+    messages = [SimpleNamespace(offset=i) for i in range(2)]
+    values = [{"stream_id": f"s-{i}", "timestamp": "2025-11-17 14:16:17+0700", "latitude": -6.1, "longitude": 106.9}
+              for i in range(2)]
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode") as reverse_geocode:
+        stage = EnrichmentStage(KafkaParser.enrich, defer=True)
+        rows = [data for _, data in stage.process(zip(messages, values))]
+        rows += [data for _, data in stage.process_batch(zip(messages, values), Parser.time_to_day_month_year)]
+        stage.shutdown()
+
+    reverse_geocode.assert_not_called()
+    assert all(row["city"] is None and row["day_month_year"] == "2025-11-17" for row in rows)
+
+
+def test_coordinate_key_matches_column_scale():
+    """Floats and Decimals of the same NUMERIC(10, 6) value share one key"""
+    assert coordinate_key(-6.108524, 106.913354) == coordinate_key(Decimal("-6.108524"), Decimal("106.913354"))
+    assert coordinate_key(-6.108524, 106.913354) != coordinate_key(-6.108525, 106.913354)
+    assert coordinate_key(-90, -180) == 0
+
+
+def test_failed_coordinates_back_off():
+    """Resolved coordinates are written; failed ones are skipped until their retry time"""
+    good, bad = (Decimal("-6.100000"), Decimal("106.900000")), (Decimal("-7.000000"), Decimal("110.000000"))
+    target = FakeTarget([good, bad])
+    lookup = lambda latitude, longitude: ADDRESS if latitude == good[0] else EMPTY
+
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode", side_effect=lookup), \
+            patch("Packages.AddressBackfill.time.monotonic", return_value=1000.0):
+        backfill = _backfill(target)
+        first = backfill.run_once()
+        second = backfill.run_once()
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode", side_effect=lookup), \
+            patch("Packages.AddressBackfill.time.monotonic", return_value=1031.0):
+        third = backfill.run_once()
+    backfill.shutdown()
+
+    assert first == {"coordinates": 2, "resolved": 1, "failed": 1, "updated": {"fake": 1}}
+    assert target.applied[0] == {good: ADDRESS}
+    assert second["coordinates"] == 0
+    assert third["coordinates"] == 1
+    # The second failure doubles the delay
+    assert backfill._retry[coordinate_key(*bad)] == (2, 1031.0 + 60)
+
+
+def test_invalid_coordinates_are_not_geocoded():
+    """Out-of-range coordinates are skipped, and the scans only ask for valid ones"""
+    target = FakeTarget([(Decimal("95.000000"), Decimal("106.900000")), (Decimal("-6.100000"), Decimal("200.000000"))])
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode") as reverse_geocode:
+        backfill = _backfill(target)
+        result = backfill.run_once()
+        backfill.shutdown()
+
+    reverse_geocode.assert_not_called()
+    assert result["resolved"] == 0 and target.applied == []
+    assert "latitude BETWEEN -90 AND 90" in PostgresBackfill.UNRESOLVED_QUERY
+    assert "latitude BETWEEN -90 AND 90" in ClickHouseBackfill.UNRESOLVED_QUERY
+
+
+def test_blocked_coordinates_are_capped():
+    """Only max_blocked coordinates are held back, keeping the ones with the latest retry"""
+    coordinates = [(Decimal(f"-6.{i:06d}"), Decimal("106.900000")) for i in range(5)]
+    target = FakeTarget(coordinates)
+    backfill = AddressBackfill([target], EnrichmentStage(None, max_workers=2), batch_size=10,
+                               base_backoff=30, max_backoff=100, max_blocked=3)
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode", return_value=EMPTY):
+        for now in (1000.0, 1001.0):
+            with patch("Packages.AddressBackfill.time.monotonic", return_value=now):
+                backfill.run_once()
+    backfill.shutdown()
+
+    assert len(backfill._retry) == 3
+    assert all(len(blocked) <= 3 for blocked in target.scans)
+
+
+def test_run_stops_when_nothing_is_left():
+    """With no interval the worker returns once a pass finds no work"""
+    target = FakeTarget([])
+    backfill = _backfill(target)
+    backfill.run(threading.Event(), interval=0)
+    backfill.shutdown()
+    assert len(target.scans) == 1
+
+
+def test_postgres_updates_both_tables_in_one_transaction():
+    """Addresses are applied with one batched UPDATE per table and one commit"""
+    mock_conn = MagicMock(closed=0)
+    cursor = mock_conn.cursor.return_value.__enter__.return_value
+    cursor.rowcount = 3
+    target = PostgresBackfill(PostgresPool(lambda: mock_conn, reconnect_attempts=1))
+
+    with patch("Packages.AddressBackfill.execute_values") as execute_values:
+        assert target.apply({(Decimal("-6.1"), Decimal("106.9")): ADDRESS}) == 6
+
+    tables = [call.args[1] for call in execute_values.call_args_list]
+    assert "UPDATE traffic_data AS t" in tables[0] and "UPDATE traffic_latest AS t" in tables[1]
+    assert execute_values.call_args.args[2] == [(Decimal("-6.1"), Decimal("106.9"), "Jakarta", "DKI Jakarta", "Jl. Sudirman")]
+    assert mock_conn.commit.call_count == 1
+
+
+def test_clickhouse_applies_one_mutation():
+    """A batch becomes one synchronous ALTER TABLE UPDATE keyed by coordinate"""
+    client = MagicMock()
+    target = ClickHouseBackfill(client)
+    target.apply({(Decimal("-6.1"), Decimal("106.9")): ADDRESS, (Decimal("-7.0"), Decimal("110.0")): EMPTY})
+
+    query, params = client.execute.call_args.args
+    assert query.startswith("ALTER TABLE traffic_data UPDATE city = multiIf(")
+    assert params["keys"] == (coordinate_key(-6.1, 106.9), coordinate_key(-7.0, 110.0))
+    assert params["city0"] == "Jakarta" and params["city1"] is None
+    assert client.execute.call_args.kwargs["settings"] == {"mutations_sync": 1}
@@ -0,0 +1,182 @@
+"""
+Unit tests for the cached analytics queries behind the read API
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from psycopg2 import extensions
+from Packages.AnalyticsQuery import AnalyticsQuery, QueryCache
+from Packages.PostgresService import PostgresPool
+from Packages.Query import QuerySql
+
+
+WATERMARK = datetime(2025, 11, 17, 7, 0, tzinfo=timezone.utc)
+
+
+def _postgres(rows, sequence=7, watermark=WATERMARK):
+    """Pool whose cursor returns the write sequence row, then the query rows."""
+    mock_conn = MagicMock(closed=0)
+    # Reads roll back, so there is nothing left to commit
+    mock_conn.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_IDLE
+    cursor = mock_conn.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (sequence, watermark)
+    cursor.description = [("name",), ("events",)]
+    cursor.fetchall.return_value = rows
+    return PostgresPool(lambda: mock_conn, reconnect_attempts=1), cursor
+
+
+def test_cache_key_is_normalized():
+    """Parameter order, timezone and float noise map to the same entry"""
+    jakarta = timezone(timedelta(hours=7))
+    a = QueryCache.key("series", {"location": "A ", "start": datetime(2025, 11, 17, 14, tzinfo=jakarta), "x": 0.1 + 0.2})
+    b = QueryCache.key("series", {"x": 0.3, "start": datetime(2025, 11, 17, 7, tzinfo=timezone.utc), "location": "A"})
+    assert a == b
+
+
+def test_cache_invalidated_by_the_answering_backend():
+    """An entry is served while the version of the backend that answered it is unchanged"""
+    cache = QueryCache()
+    from_postgres = QueryCache.key("q", {"n": 1})
+    from_clickhouse = QueryCache.key("q", {"n": 2})
+    cache.put(from_postgres, ["pg"], "postgres", 5)
+    cache.put(from_clickhouse, ["ch"], "clickhouse", (3, 11))
+
+    assert cache.get(from_postgres, {"postgres": 5, "clickhouse": (4, 12)}) == ["pg"]
+    assert cache.get(from_clickhouse, {"postgres": 6, "clickhouse": (3, 11)}) == ["ch"]
+
+    # Any later write invalidates, however old the queried range is
+    assert cache.get(from_postgres, {"postgres": 6}) is None
+    assert cache.get(from_clickhouse, {"postgres": 6}) is None
+    assert cache.stats()["invalidations"] == 2
+
+    cache.put(from_postgres, ["pg"], "postgres", None)
+    assert cache.get(from_postgres, {"postgres": None}) is None
+
+
+def test_falls_back_to_postgres_and_caches():
+    """A failing ClickHouse falls back to PostgreSQL; the repeat is a cache hit"""
+    pool, cursor = _postgres([("Jakarta", 3)])
+    clickhouse = MagicMock()
+    clickhouse.execute.side_effect = RuntimeError("clickhouse down")
+    analytics = AnalyticsQuery(pool=pool, clickhouse_connect=lambda: clickhouse, watermark_poll_seconds=0)
+
+    end = datetime(2025, 11, 17, 7, tzinfo=timezone.utc)
+    rows = analytics.top_congested("city", end - timedelta(hours=1), end, limit=5)
+    assert rows == [{"name": "Jakarta", "events": 3}]
+    query = cursor.execute.call_args_list[-1].args[0]
+    assert "GROUP BY city" in query
+
+    executed = cursor.execute.call_count
+    assert analytics.top_congested("city", end - timedelta(hours=1), end, limit=5) == rows
+    # Only the write sequence was read again
+    assert cursor.execute.call_count == executed + 1
+    assert analytics.cache.stats()["hits"] == 1
+    assert analytics.watermark() == WATERMARK
+
+    # A write, e.g. a late event or an address backfill, invalidates the result
+    cursor.fetchone.return_value = (8, WATERMARK)
+    analytics.top_congested("city", end - timedelta(hours=1), end, limit=5)
+    assert analytics.cache.stats()["invalidations"] == 1
+
+
+def test_clickhouse_results_follow_clickhouse_parts():
+    """ClickHouse answers are cached against ClickHouse's active parts, not the PostgreSQL sequence"""
+    pool, cursor = _postgres([])
+    clickhouse = MagicMock()
+    parts = [([(4, 99)], [("count()", "UInt64"), ("parts", "UInt64")])]
+    result = ([("Jakarta", 3)], [("name", "String"), ("events", "UInt64")])
+    clickhouse.execute.side_effect = lambda query, params, **kwargs: parts[0] if "system.parts" in query else result
+    analytics = AnalyticsQuery(pool=pool, clickhouse_connect=lambda: clickhouse, watermark_poll_seconds=0)
+
+    end = datetime(2025, 11, 17, 7, tzinfo=timezone.utc)
+    analytics.top_congested("city", end - timedelta(hours=1), end)
+    cursor.fetchone.return_value = (8, WATERMARK)
+    analytics.top_congested("city", end - timedelta(hours=1), end)
+    assert analytics.cache.stats()["hits"] == 1
+
+    # A ClickHouse insert or mutation replaces parts
+    parts[0] = ([(5, 42)], parts[0][1])
+    analytics.top_congested("city", end - timedelta(hours=1), end)
+    assert analytics.cache.stats()["invalidations"] == 1
+    query, params = next(call.args for call in clickhouse.execute.call_args_list if "system.parts" in call.args[0])
+    assert params["tables"][0] == "traffic_data"
+
+
+def test_clickhouse_rows_become_dicts():
+    """ClickHouse results are mapped to dicts by column name"""
+    clickhouse = MagicMock()
+    clickhouse.execute.return_value = ([("s-1", 4)], [("stream_id", "String"), ("total_in_area", "Int32")])
+    analytics = AnalyticsQuery(clickhouse_connect=lambda: clickhouse, backends=["clickhouse"])
+
+    rows = analytics.latest_in_bbox(106.0, -7.0, 107.0, -6.0)
+
+    assert rows == [{"stream_id": "s-1", "total_in_area": 4}]
+    assert clickhouse.execute.call_args.kwargs["with_column_types"] is True
+
+
+def test_batch_write_advances_watermark():
+    """The consumer records the newest event time of every batch it writes"""
+    rows = [{"timestamp": "2025-11-17 14:16:17+0700"}, {"timestamp": "2025-11-17 07:20:00+00:00"}, {"timestamp": None}]
+    assert QuerySql._watermark(rows) == datetime(2025, 11, 17, 7, 20, tzinfo=timezone.utc)
+    assert QuerySql._watermark([{"timestamp": None}]) is None
+
+
+def test_every_postgres_write_bumps_the_sequence():
+    """Batches, replays and the address backfill all move the write sequence"""
+    from Packages.AddressBackfill import PostgresBackfill
+
+    mock_conn = MagicMock(closed=0)
+    cursor = mock_conn.cursor.return_value.__enter__.return_value
+    pool = PostgresPool(lambda: mock_conn, reconnect_attempts=1)
+    row = {"stream_id": "s-1", "timestamp": None, "day_month_year": "2025-11-17", "location": "A"}
+
+    with patch("Packages.Query.execute_values"), patch.object(pool, "prepare", lambda conn, query: query):
+        QuerySql(pool).insert_traffic_data_batch([row])
+        QuerySql(pool).replace_traffic_data_batch([row])
+        QuerySql(pool).insert_traffic_data_batch([], offsets={("ws_incoming", 0): 1}, group="g")
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert statements.count(QuerySql.WRITE_SEQUENCE_QUERY) == 2
+
+    cursor.reset_mock()
+    cursor.rowcount = 3
+    with patch("Packages.AddressBackfill.execute_values"):
+        PostgresBackfill(pool).apply({(-6.1, 106.9): {"city": "Jakarta"}})
+    assert (QuerySql.WRITE_SEQUENCE_QUERY, (None,)) in [call.args for call in cursor.execute.call_args_list]
+
+
+def test_invalid_parameters_are_rejected():
+    """Unknown levels, empty ranges and inverted boxes raise ValueError"""
+    analytics = AnalyticsQuery(backends=[])
+    for call in (
+        lambda: analytics.top_congested("district"),
+        lambda: analytics.series("A", WATERMARK, WATERMARK),
+        lambda: analytics.latest_in_bbox(107.0, -7.0, 106.0, -6.0),
+    ):
+        try:
+            call()
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+
+def test_respond_pages_json_and_ndjson():
+    """Responses carry one page of rows with the next offset, or stream NDJSON lines"""
+    import asyncio
+    from Api import Analytics
+
+    rows = [{"n": i, "at": WATERMARK} for i in range(5)]
+
+    with patch.object(Analytics, "analytics") as analytics:
+        analytics.watermark.return_value = WATERMARK
+        body = json.loads(Analytics.respond(lambda: rows, "json", limit=2, offset=2).body)
+    assert [row["n"] for row in body["rows"]] == [2, 3]
+    assert body["next_offset"] == 4 and body["total"] == 5
+
+    response = Analytics.respond(lambda: rows, "ndjson", limit=10, offset=3)
+
+    async def collect():
+        return [chunk async for chunk in response.body_iterator]
+
+    lines = asyncio.run(collect())
+    assert [json.loads(line)["n"] for line in lines] == [3, 4]
+    assert response.media_type == Analytics.NDJSON
@@ -0,0 +1,78 @@
+"""
+Unit tests for streaming per-stream anomaly detection
+"""
+import numpy as np
+from Packages.AnomalyDetector import AnomalyDetector, StreamState
+
+
+def _event(stream_id, total_in_area, estimated_max_people=1000):
+    return {"stream_id": stream_id, "timestamp": "2025-11-17 14:16:17+0700", "city": "Jakarta",
+            "total_in_area": total_in_area, "estimated_max_people": estimated_max_people}
+
+
+def _detector(**kwargs):
+    options = dict(alpha=0.2, z_threshold=4.0, warmup=5, min_std=1.0, cooldown_seconds=0)
+    options.update(kwargs)
+    return AnomalyDetector(**options)
+
+
+def test_ewma_matches_sequential_updates():
+    """Repeats of a stream within one batch update its state in order"""
+    values = [10, 12, 9, 11, 30, 10]
+    batched = _detector()
+    batched.observe([_event("cam-1", v) for v in values] + [_event("cam-2", 5)])
+    sequential = _detector()
+    for v in values:
+        sequential.observe([_event("cam-1", v)])
+
+    slot_a, slot_b = batched.state.index["cam-1"], sequential.state.index["cam-1"]
+    assert batched.state.count[slot_a] == 6
+    assert np.isclose(batched.state.mean[slot_a], sequential.state.mean[slot_b])
+    assert np.isclose(batched.state.var[slot_a], sequential.state.var[slot_b])
+    assert batched.state.count[batched.state.index["cam-2"]] == 1
+
+
+def test_spike_and_capacity_alerts():
+    """A jump far from the EWMA alerts as a spike; exceeding capacity alerts even when cold"""
+    detector = _detector()
+    assert detector.observe([_event("cam-1", 10 + i % 2) for i in range(20)]) == []
+
+    alerts = detector.observe([_event("cam-1", 60), _event("cam-2", 120, estimated_max_people=100)])
+    by_stream = {alert["stream_id"]: alert for alert in alerts}
+    assert by_stream["cam-1"]["reasons"] == ["spike"]
+    assert by_stream["cam-1"]["z_score"] > 4 and by_stream["cam-1"]["city"] == "Jakarta"
+    assert by_stream["cam-2"]["reasons"] == ["capacity"]
+    assert by_stream["cam-2"]["capacity_ratio"] == 1.2
+
+
+def test_cooldown_limits_alerts_per_stream():
+    """A stream over capacity alerts once per cooldown, not on every event"""
+    detector = _detector(cooldown_seconds=60)
+    alerts = detector.observe([_event("cam-1", 200, estimated_max_people=100) for _ in range(3)])
+    alerts += detector.observe([_event("cam-1", 200, estimated_max_people=100)])
+    assert len(alerts) == 1
+
+
+def test_checkpoints_are_merged_on_restart(tmp_path):
+    """Worker checkpoints restore warm state; the copy that saw more events wins"""
+    first = _detector(checkpoint_dir=str(tmp_path), worker=0)
+    first.observe([_event("cam-1", 10) for _ in range(8)] + [_event("kamera-é", 3)])
+    assert first.checkpoint(force=True)
+
+    second = _detector(checkpoint_dir=str(tmp_path), worker=1)
+    second.observe([_event("cam-1", 10)])
+    second.checkpoint(force=True)
+
+    restored = _detector(checkpoint_dir=str(tmp_path), worker=0)
+    assert len(restored.state) == 2
+    assert restored.state.count[restored.state.index["cam-1"]] == 9
+    assert restored.state.count[restored.state.index["kamera-é"]] == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_state_grows_for_many_streams():
+    """Slots are allocated per stream id and the arrays grow past their capacity"""
+    state = StreamState(capacity=4)
+    slots = state.slots([f"cam-{i}" for i in range(10)] + ["cam-3"])
+    assert slots.tolist() == list(range(10)) + [3]
+    assert len(state.count) >= 10 and np.isinf(state.last_alert[9])
@@ -0,0 +1,163 @@
+"""
+Unit tests for micro-batched writes and offset tracking
+"""
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+import psycopg2
+from Packages.BatchWriter import BatchWriter
+from Packages.Query import QuerySql
+from Packages.PostgresService import PostgresPool
+from Packages.Parser import KafkaParser
+
+
+def _query_service(mock_conn):
+    return QuerySql(pool=PostgresPool(lambda: mock_conn, reconnect_attempts=1))
+
+
+def _message(offset, partition=0):
+    return SimpleNamespace(topic="ws_incoming", partition=partition, offset=offset)
+
+
+def test_flush_by_size_and_linger():
+    """The writer is due when it reaches max_rows or has waited max_linger_seconds"""
+    sink = MagicMock()
+    writer = BatchWriter(sink, max_rows=3, max_linger_seconds=60)
+    assert not writer.due()
+
+    writer.add({"n": 1}, _message(0))
+    writer.add({"n": 2}, _message(1))
+    assert not writer.due()
+    writer.add({"n": 3}, _message(2))
+    assert writer.full() and writer.due()
+
+    lingering = BatchWriter(sink, max_rows=100, max_linger_seconds=1)
+    lingering.add({"n": 1}, _message(0))
+    with patch("Packages.BatchWriter.time.monotonic", return_value=10 ** 9):
+        assert lingering.due()
+
+
+def test_flush_returns_next_offsets_per_partition():
+    """Flushed offsets point at the next message to consume for every partition"""
+    sink = MagicMock()
+    writer = BatchWriter(sink, max_rows=10)
+    writer.add({"n": 1}, _message(4, partition=0))
+    writer.add({"n": 2}, _message(9, partition=1))
+    writer.skip(_message(5, partition=0))
+
+    offsets = writer.flush()
+
+    sink.assert_called_once_with([{"n": 1}, {"n": 2}])
+    assert offsets == {("ws_incoming", 0): 6, ("ws_incoming", 1): 10}
+    assert len(writer) == 0
+
+    commit = BatchWriter.to_commit(offsets)
+    assert sorted(meta.offset for meta in commit.values()) == [6, 10]
+
+
+def test_failed_flush_keeps_rows():
+    """A failing sink keeps the batch and its offsets for the next attempt"""
+    sink = MagicMock(side_effect=[RuntimeError("db down"), None])
+    writer = BatchWriter(sink, max_rows=10)
+    writer.add({"n": 1}, _message(0))
+
+    assert writer.flush() is None
+    assert len(writer) == 1
+    assert writer.flush() == {("ws_incoming", 0): 1}
+    assert sink.call_count == 2
+
+
+def test_stopping_flush_gives_up_without_committing():
+    """A stopped consumer retries a dead sink only for the drain time, then leaves the batch uncommitted"""
+    consumer = MagicMock()
+    consumer.config = {"group_id": "g"}
+    writer = BatchWriter(MagicMock(side_effect=RuntimeError("db down")), max_rows=10)
+    writer.add({"n": 1}, _message(0))
+    stop_event = threading.Event()
+    stop_event.set()
+
+    with patch.object(KafkaParser, "DRAIN_SECONDS", 0.2):
+        assert KafkaParser.flush(consumer, writer, stop_event) is False
+
+    consumer.commit.assert_not_called()
+    assert len(writer) == 0 and writer.offsets == {}
+
+
+def test_flush_commits_once_the_sink_recovers():
+    """Within the drain time a recovered sink still lands the batch and commits it"""
+    consumer = MagicMock()
+    consumer.config = {"group_id": "g"}
+    writer = BatchWriter(MagicMock(side_effect=[RuntimeError("db down"), None]), max_rows=10)
+    writer.add({"n": 1}, _message(0))
+
+    with patch("Packages.Parser.time.sleep"):
+        assert KafkaParser.flush(consumer, writer, max_seconds=5) is True
+    consumer.commit.assert_called_once()
+
+
+@patch("Packages.Query.execute_values")
+def test_insert_batch_single_commit(mock_execute_values):
+    """A batch becomes one multi-row INSERT and one commit"""
+    mock_conn = MagicMock(closed=0)
+    query_service = _query_service(mock_conn)
+
+    rows = [{"stream_id": f"s-{i}", "timestamp": "2025-11-17 14:16:17+0700"} for i in range(3)]
+    query_service.insert_traffic_data_batch(rows)
+
+    sql, values = mock_execute_values.call_args[0][1:3]
+    assert "INSERT INTO traffic_data" in sql and "VALUES %s" in sql
+    assert len(values) == 3
+    stream_index = QuerySql.TRAFFIC_DATA_FIELDS.index("stream_id")
+    assert [row[stream_index] for row in values] == ["s-0", "s-1", "s-2"]
+    assert mock_conn.commit.call_count == 1
+
+
+@patch("Packages.Query.execute_values", side_effect=psycopg2.OperationalError("server closed"))
+def test_insert_batch_raises_on_connection_error(mock_execute_values):
+    """Connection errors propagate so the writer retries the whole batch"""
+    mock_conn = MagicMock(closed=0)
+    query_service = _query_service(mock_conn)
+
+    try:
+        query_service.insert_traffic_data_batch([{"stream_id": "s-1"}])
+        assert False, "expected OperationalError"
+    except psycopg2.OperationalError:
+        pass
+    assert not mock_conn.commit.called
+
+
+def test_dedupe_latest_last_write_wins_by_timestamp():
+    """Only the newest row per stream_id survives, regardless of arrival order"""
+    rows = [
+        {"stream_id": "a", "timestamp": "2025-11-17 14:16:17+0700", "total_in_area": 1},
+        {"stream_id": "a", "timestamp": "2025-11-17 14:16:19+0700", "total_in_area": 3},
+        {"stream_id": "b", "timestamp": "2025-11-17 14:16:17+0700", "total_in_area": 5},
+        {"stream_id": "a", "timestamp": "2025-11-17 14:16:18+0700", "total_in_area": 2},
+    ]
+
+    latest = {row["stream_id"]: row["total_in_area"] for row in QuerySql.dedupe_latest(rows)}
+
+    assert latest == {"a": 3, "b": 5}
+
+
+@patch("Packages.Query.execute_values")
+def test_upsert_mode_builds_on_conflict_from_config(mock_execute_values):
+    """Upsert mode targets the configured conflict key and update fields"""
+    mock_conn = MagicMock(closed=0)
+    query_service = _query_service(mock_conn)
+    query_service.write_mode = "upsert"
+
+    rows = [
+        {"stream_id": "a", "timestamp": "2025-11-17 14:16:17+0700"},
+        {"stream_id": "a", "timestamp": "2025-11-17 14:16:18+0700"},
+    ]
+    query_service.insert_traffic_data_batch(rows)
+
+    assert mock_execute_values.call_count == 1
+    sql, values = mock_execute_values.call_args[0][1:3]
+    assert f"INSERT INTO {QuerySql.TRAFFIC_DATA_UPSERT_TABLE}" in sql
+    assert f"ON CONFLICT ({QuerySql.TRAFFIC_DATA_CONFLICT_KEY}) DO UPDATE" in sql
+    for field in QuerySql.TRAFFIC_DATA_UPDATE_FIELDS:
+        assert f"{field} = EXCLUDED.{field}" in sql
+    assert len(values) == 1
+    assert mock_conn.commit.call_count == 1
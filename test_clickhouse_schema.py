@@ -0,0 +1,135 @@
+"""
+Unit tests for the managed ClickHouse schema and rollup-backed analytics queries
+"""
+from datetime import date, datetime, timezone
+from unittest.mock import MagicMock
+from Packages.ClickHouseSchema import ClickHouseSchema, SORTING_KEY, LEGACY_TABLE
+from Packages.ClickHouseQuery import ClickHouseQuery
+from Packages.AnalyticsQuery import AnalyticsQuery
+
+
+class FakeClient:
+    """Records statements and answers the catalogue queries the migrations make."""
+
+    def __init__(self, tables=None, legacy_columns=()):
+        self.tables = dict(tables or {})
+        self.legacy_columns = set(legacy_columns)
+        self.applied = []
+        self.statements = []
+
+    def execute(self, query, params=None, **kwargs):
+        self.statements.append(" ".join(query.split()))
+        if "FROM system.tables" in query:
+            table = self.tables.get(params["name"])
+            return [("MergeTree", table)] if table is not None else []
+        if "FROM system.columns" in query:
+            return [(name,) for name in self.legacy_columns]
+        if query.startswith("SELECT version"):
+            return [(version,) for version, _ in self.applied]
+        if query.startswith("SELECT now()"):
+            return [(datetime(2025, 11, 17, tzinfo=timezone.utc),)]
+        if query.startswith("INSERT INTO schema_migrations"):
+            self.applied.extend(params)
+        if query.startswith("RENAME TABLE"):
+            self.tables[LEGACY_TABLE] = self.tables.pop("traffic_data")
+        if "CREATE MATERIALIZED VIEW" in query:
+            self.tables[query.split()[5]] = ""
+        return []
+
+    def find(self, fragment):
+        return [statement for statement in self.statements if fragment in statement]
+
+
+def test_fresh_database_gets_partitioned_layout_and_rollups():
+    """Migrations create the partitioned table, both rollups and views, once"""
+    client = FakeClient()
+    applied = ClickHouseSchema(client).migrate()
+
+    assert applied == ["traffic_data_layout", "traffic_rollups", "insert_deduplication"]
+    create = client.find("CREATE TABLE IF NOT EXISTS traffic_data ")[0]
+    assert "PARTITION BY toYYYYMM(timestamp)" in create
+    assert f"ORDER BY ({SORTING_KEY})" in create
+    assert "label LowCardinality(String)" in create and "day_month_year Date" in create
+    for table in ("traffic_rollup_1m", "traffic_rollup_1h"):
+        assert "AggregatingMergeTree" in client.find(f"CREATE TABLE IF NOT EXISTS {table} ")[0]
+        assert client.find(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_mv TO {table}")
+        assert "FROM traffic_data FINAL WHERE created_at < %(cutoff)s" in client.find(f"INSERT INTO {table} SELECT")[0]
+        assert client.find(f"ALTER TABLE {table} MODIFY SETTING non_replicated_deduplication_window")
+    # Each backfill cutoff is read after its view exists, so no insert falls between them
+    steps = ["view" if "MATERIALIZED VIEW" in statement else "cutoff" for statement in client.statements
+             if statement.startswith("SELECT now()") or "CREATE MATERIALIZED VIEW" in statement]
+    assert steps == ["view", "cutoff", "view", "cutoff"]
+
+    client.statements.clear()
+    assert ClickHouseSchema(client).migrate() == []
+    assert not client.find("CREATE TABLE IF NOT EXISTS traffic_data ")
+
+
+def test_legacy_table_is_moved_and_copied():
+    """A table ordered by stream_id is renamed and its rows copied; missing columns get defaults"""
+    client = FakeClient(tables={"traffic_data": "stream_id"},
+                        legacy_columns=["stream_id", "timestamp", "location", "longitude", "latitude",
+                                        "total_in_area", "estimated_max_people", "label", "type",
+                                        "fulladdress", "created_at"])
+    ClickHouseSchema(client, partition_by="day").migrate()
+
+    assert client.find(f"RENAME TABLE traffic_data TO {LEGACY_TABLE}")
+    assert "PARTITION BY toDate(timestamp)" in client.find("CREATE TABLE IF NOT EXISTS traffic_data ")[0]
+    copy = client.find(f"FROM {LEGACY_TABLE}")[0]
+    assert "toDate(timestamp) AS day_month_year" in copy
+    assert "NULL AS city" in copy and "NULL AS province" in copy
+    assert ", fulladdress," in copy
+
+
+def test_day_key_is_written_with_each_row():
+    """Rows carry their day key; rows without one use their timestamp's local date"""
+    query_service = ClickHouseQuery.__new__(ClickHouseQuery)
+    rows = [{"timestamp": "2025-11-17 00:30:00+0700", "day_month_year": "2025-11-17"},
+            {"timestamp": "2025-11-18 01:00:00+0700"}]
+    by_name = dict(zip(ClickHouseQuery.TRAFFIC_DATA_COLUMNS, query_service.to_columns(rows)))
+    assert by_name["day_month_year"] == [date(2025, 11, 17), date(2025, 11, 18)]
+
+
+def test_aligned_queries_read_rollups():
+    """Whole-hour and whole-minute ranges use the matching rollup; others read raw rows"""
+    clickhouse = MagicMock()
+    clickhouse.execute.return_value = ([], [])
+    analytics = AnalyticsQuery(clickhouse_connect=lambda: clickhouse, backends=["clickhouse"])
+    sql = lambda: clickhouse.execute.call_args.args[0]
+
+    hour = datetime(2025, 11, 17, 8, tzinfo=timezone.utc)
+    analytics.series("Gate", hour, hour.replace(hour=10), bucket_seconds=3600)
+    assert "FROM traffic_rollup_1h" in sql()
+    analytics.series("Gate", hour.replace(minute=5), hour.replace(minute=35), bucket_seconds=300)
+    assert "FROM traffic_rollup_1m" in sql()
+    analytics.series("Gate", hour.replace(second=30), hour.replace(minute=5), bucket_seconds=60)
+    assert "FROM traffic_data" in sql()
+    analytics.top_congested("province", hour, hour.replace(hour=9))
+    assert "FROM traffic_rollup_1h" in sql() and "province != ''" in sql()
+
+    deferred = AnalyticsQuery(clickhouse_connect=lambda: clickhouse, backends=["clickhouse"], address_rollups=False)
+    deferred.top_congested("city", hour, hour.replace(hour=9))
+    assert "FROM traffic_data" in sql()
+
+
+def test_rebuild_recomputes_whole_buckets_from_deduplicated_rows():
+    """A rebuild deletes and re-aggregates every bucket the range touches, reading FINAL rows"""
+    client = FakeClient()
+    start = datetime(2025, 11, 17, 8, 12, 30, tzinfo=timezone.utc)
+    rebuilt = ClickHouseSchema(client).rebuild_rollups(start, start.replace(hour=9, minute=40))
+
+    assert [(table, first.strftime("%H:%M"), last.strftime("%H:%M")) for table, first, last in rebuilt] == [
+        ("traffic_rollup_1h", "08:00", "10:00"), ("traffic_rollup_1m", "08:12", "09:41")]
+    assert client.find("ALTER TABLE traffic_rollup_1m DELETE WHERE bucket_start >= %(start)s")
+    insert = client.find("INSERT INTO traffic_rollup_1m SELECT")[0]
+    assert "FROM traffic_data FINAL WHERE timestamp >= %(start)s AND timestamp < %(end)s" in insert
+
+
+def test_retried_batches_share_a_deduplication_token():
+    """A resent batch gets the same insert token, a different batch a new one"""
+    rows = [{"stream_id": "s-1", "timestamp": "2025-11-17 00:30:00+0700", "location": "Gate"}]
+    settings = ClickHouseQuery.deduplication_settings(rows)
+    assert settings == ClickHouseQuery.deduplication_settings([dict(rows[0])])
+    assert settings["deduplicate_blocks_in_dependent_materialized_views"] == 1
+    other = ClickHouseQuery.deduplication_settings([dict(rows[0], stream_id="s-2")])
+    assert other["insert_deduplication_token"] != settings["insert_deduplication_token"]
@@ -0,0 +1,128 @@
+"""
+Unit tests for the buffered columnar ClickHouse sink
+"""
+import time
+import threading
+from decimal import Decimal
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from Packages.ClickHouseQuery import ClickHouseQuery
+from Packages.BatchWriter import BatchWriter, BackgroundWriter
+from Packages.Parser import KafkaParser
+
+
+SAMPLE = {
+    "timestamp": "2025-11-17 14:16:17+0700",
+    "stream_id": "96151250-abcb-408e-b25f-2fb4e82ea4a7",
+    "location": "Simpang MORATA",
+    "longitude": 106.913354,
+    "latitude": -6.108524,
+    "total_in_area": 4,
+    "estimated_max_people": "10",
+    "label": "Normal",
+    "type": "TC",
+    "fulladdress": None
+}
+
+
+def test_columnar_insert_with_typed_values():
+    """Rows are sent as one typed list per column in a single columnar INSERT"""
+    query_service = ClickHouseQuery.__new__(ClickHouseQuery)
+    query_service.client = MagicMock()
+
+    query_service.insert_traffic_data_batch([SAMPLE, dict(SAMPLE, total_in_area=7)])
+
+    sql, columns = query_service.client.execute.call_args[0]
+    kwargs = query_service.client.execute.call_args[1]
+    assert sql.startswith("INSERT INTO traffic_data (stream_id, timestamp,")
+    assert "now()" not in sql
+    assert kwargs["columnar"] is True
+
+    by_name = dict(zip(ClickHouseQuery.TRAFFIC_DATA_COLUMNS, columns))
+    assert by_name["timestamp"][0] == datetime(2025, 11, 17, 7, 16, 17, tzinfo=timezone.utc)
+    assert by_name["longitude"][0] == Decimal("106.913354")
+    assert by_name["estimated_max_people"] == [10, 10]
+    assert by_name["total_in_area"] == [4, 7]
+    assert by_name["fulladdress"] == [None, None]
+
+
+def test_background_writer_flushes_off_thread():
+    """Rows submitted to the background writer land in batches on another thread"""
+    batches = []
+    landed = threading.Event()
+
+    def sink(rows):
+        batches.append((threading.current_thread().name, list(rows)))
+        if sum(len(rows) for _, rows in batches) == 10:
+            landed.set()
+
+    writer = BackgroundWriter(BatchWriter(sink, max_rows=4, max_linger_seconds=0.05, name="ClickHouse"))
+    for i in range(10):
+        assert writer.submit({"n": i})
+
+    assert landed.wait(5)
+    writer.stop()
+    assert all(name == "ClickHouse-writer" for name, _ in batches)
+    assert [row["n"] for _, rows in batches for row in rows] == list(range(10))
+
+
+def test_background_writer_drops_instead_of_blocking():
+    """A stalled sink fills the queue and further rows are dropped, not waited on"""
+    release = threading.Event()
+    writer = BackgroundWriter(
+        BatchWriter(lambda rows: release.wait(5), max_rows=1, max_linger_seconds=0.01),
+        max_queue=2
+    )
+
+    started = time.monotonic()
+    results = [writer.submit({"n": i}) for i in range(50)]
+    assert time.monotonic() - started < 1
+    assert writer.dropped > 0
+    assert results.count(False) == writer.dropped
+
+    release.set()
+    writer.stop()
+
+
+def test_blocking_writer_applies_backpressure_instead_of_dropping():
+    """A full queue holds back the caller until the sink drains it; no row is lost"""
+    release = threading.Event()
+    landed = []
+    writer = BackgroundWriter(
+        BatchWriter(lambda rows: (release.wait(5), landed.extend(rows)), max_rows=1, max_linger_seconds=0.01),
+        max_queue=2, block=True
+    )
+    threading.Timer(0.3, release.set).start()
+
+    started = time.monotonic()
+    results = [writer.submit({"n": i}) for i in range(10)]
+    assert time.monotonic() - started >= 0.2
+    assert all(results) and writer.dropped == 0
+    writer.stop()
+    assert [row["n"] for row in landed] == list(range(10))
+
+
+def test_offsets_are_committed_only_once_both_sinks_landed():
+    """The commit follows the slower of PostgreSQL and the background ClickHouse writer"""
+    message = lambda offset: SimpleNamespace(topic="t", partition=0, offset=offset)
+    release = threading.Event()
+    clickhouse = BackgroundWriter(
+        BatchWriter(lambda rows: release.wait(5), max_rows=100, max_linger_seconds=0.01), block=True
+    )
+    postgres = BatchWriter(lambda rows: None, max_rows=100)
+    consumer = MagicMock()
+    consumer.config = {"group_id": "g"}
+
+    for offset in range(3):
+        postgres.add({"n": offset}, message(offset))
+        clickhouse.submit({"n": offset}, message(offset))
+    assert KafkaParser.flush(consumer, postgres, held_by=clickhouse)
+    consumer.commit.assert_not_called()
+
+    release.set()
+    clickhouse.stop()
+    assert clickhouse.landed == {("t", 0): 3}
+    KafkaParser.commit(consumer, KafkaParser.committable(postgres, clickhouse))
+    committed = consumer.commit.call_args.args[0]
+    assert [meta.offset for meta in committed.values()] == [3]
@@ -0,0 +1,114 @@
+"""
+Unit tests for columnar, NumPy-vectorized enrichment of poll batches
+"""
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+from hypothesis import given, strategies as st
+from Packages.ColumnBatch import ColumnBatch
+from Packages.Enrichment import EnrichmentStage
+from Packages.GeocodingCache import GeocodingCache
+from Packages.GeocodingService import GeocodingService
+from Packages.Parser import KafkaParser, Parser
+
+
+def _day_or_none(timestamp):
+    try:
+        return Parser.time_to_day_month_year(timestamp)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+@given(st.lists(st.tuples(st.one_of(st.none(), st.floats(-200, 200)), st.one_of(st.none(), st.floats(-100, 100))), max_size=50))
+def test_coordinate_mask_matches_scalar_validation(coordinates):
+    """The vectorized mask agrees with GeocodingService.validate_coordinates"""
+    events = [{"longitude": lon, "latitude": lat} for lon, lat in coordinates]
+    mask = ColumnBatch(events).valid_coordinates()
+    expected = [lon is not None and lat is not None and GeocodingService.validate_coordinates(lat, lon)
+                for lon, lat in coordinates]
+    assert mask.tolist() == expected
+
+
+def test_day_keys_match_scalar_parsing():
+    """Day keys equal Parser.time_to_day_month_year, with None where it fails"""
+    timestamps = [
+        "2025-11-17 14:16:17+0700", "2025-11-17T23:59:59.123Z", "2025-11-17T10:00:00",
+        "2025-11-17 14:16:17+07:00", "2025-11-17", datetime(2025, 1, 2, 3),
+        "2025-02-30 00:00:00", "2025-11-17 25:00:00", "2025-11-17 14:16:17+07:0x", "bad", None,
+    ]
+    days = ColumnBatch([{"timestamp": t} for t in timestamps]).day_keys(Parser.time_to_day_month_year)
+    assert days == [_day_or_none(t) for t in timestamps]
+
+
+def test_coordinates_grouped_by_cache_precision():
+    """Coordinates equal after quantization share one group; invalid ones are left out"""
+    events = [
+        {"latitude": -6.10851, "longitude": 106.91331},
+        {"latitude": -6.10849, "longitude": 106.91329},
+        {"latitude": -7.0, "longitude": 110.0},
+        {"latitude": 95.0, "longitude": 110.0},
+    ]
+    batch = ColumnBatch(events)
+    positions, group = batch.unique_coordinates(batch.valid_coordinates(), precision=4)
+
+    assert len(positions) == 2
+    assert group[0] == group[1] != group[2]
+    assert group[3] == -1
+
+
+def test_process_batch_geocodes_each_coordinate_once():
+    """A poll batch is enriched in order with one lookup per distinct coordinate"""
+    messages = [SimpleNamespace(offset=i) for i in range(6)]
+    values = [
+        {"stream_id": "a", "timestamp": "2025-11-17 14:16:17+0700", "latitude": -6.1, "longitude": 106.9},
+        None,
+        {"stream_id": "b", "timestamp": "2025-11-18 01:00:00+0700", "latitude": -6.1, "longitude": 106.9},
+        {"stream_id": "c", "timestamp": "2025-11-17 14:16:17+0700", "latitude": -7.0, "longitude": 110.0},
+        {"stream_id": "d", "timestamp": "not a time", "latitude": -7.0, "longitude": 110.0},
+        {"stream_id": "e", "timestamp": "2025-11-17 14:16:17+0700", "latitude": 95.0, "longitude": 110.0},
+    ]
+    lookup = lambda latitude, longitude: {"city": f"city-{latitude}", "province": "P", "fulladdress": None}
+
+    with patch.object(GeocodingService, "get_cache", return_value=GeocodingCache(db_path=None)), \
+            patch.object(GeocodingService, "reverse_geocode", side_effect=lookup) as reverse_geocode:
+        stage = EnrichmentStage(KafkaParser.enrich)
+        results = list(stage.process_batch(zip(messages, values), Parser.time_to_day_month_year))
+        stage.shutdown()
+
+    assert [message.offset for message, _ in results] == list(range(6))
+    enriched = [data for _, data in results]
+    assert enriched[1] is None and enriched[4] is None
+    assert [(d["city"], d["day_month_year"]) for d in (enriched[0], enriched[2], enriched[3], enriched[5])] == [
+        ("city--6.1", "2025-11-17"), ("city--6.1", "2025-11-18"), ("city--7.0", "2025-11-17"), (None, "2025-11-17")
+    ]
+    assert reverse_geocode.call_count == 2
+
+
+def test_process_batch_bounds_lookups_in_flight():
+    """A poll with many distinct coordinates starts at most max_in_flight lookups ahead of its output"""
+    messages = [SimpleNamespace(offset=i) for i in range(40)]
+    values = [{"stream_id": str(i), "timestamp": "2025-11-17 14:16:17+0700", "latitude": -6.0 - i / 100, "longitude": 106.9}
+              for i in range(40)]
+    started = []
+
+    def lookup(latitude, longitude):
+        started.append(latitude)
+        return {"city": None, "province": None, "fulladdress": None}
+
+    with patch.object(GeocodingService, "get_cache", return_value=None), \
+            patch.object(GeocodingService, "reverse_geocode", side_effect=lookup):
+        stage = EnrichmentStage(KafkaParser.enrich, max_in_flight=4)
+        for released, (message, _) in enumerate(stage.process_batch(zip(messages, values), Parser.time_to_day_month_year)):
+            assert stage.lookups - released <= 4
+        stage.shutdown()
+
+    assert stage.lookups == 40
+
+
+def test_row_mode_without_numpy():
+    """The consumer falls back to per-event enrichment when NumPy is missing"""
+    with patch.object(ColumnBatch, "available", return_value=False):
+        assert KafkaParser.columnar() is False
+    with patch.dict("os.environ", {"CONSUMER_BATCH_MODE": "row"}):
+        assert KafkaParser.columnar() is False
+    assert KafkaParser.columnar() is True
@@ -0,0 +1,112 @@
+"""
+Unit tests for the compact binary wire format and keyed, compressed producing
+"""
+import json
+import struct
+import zlib
+from unittest.mock import patch
+from hypothesis import given, strategies as st
+from Packages.CompactCodec import CompactCodec, CODEC
+from Packages.ConfigService import ConfigService
+from Packages.EventCodec import EventCodec, JSON, COMPACT
+from Packages import KafkaService as kafka_service
+from Packages.KafkaService import KafkaService
+
+EVENT = {
+    "timestamp": "2025-11-17 14:16:17+0700",
+    "stream_id": "9b1deb4d-3b7d-4bad-9bdd-2b0d7b3dcb6d",
+    "location": "Simpang Lima",
+    "longitude": 106.913354,
+    "latitude": -6.108524,
+    "total_in_area": 17,
+    "estimated_max_people": 40,
+    "label": "Padat",
+    "type": "car",
+}
+
+_events = st.lists(st.fixed_dictionaries(
+    {"stream_id": st.text(min_size=1), "longitude": st.floats(allow_nan=False), "total_in_area": st.integers(-2**62, 2**62)},
+    optional={"location": st.text(), "label": st.none()}
+), max_size=20)
+
+
+@given(_events)
+def test_roundtrip(events):
+    """Every schema field survives encoding; absent and null fields stay absent"""
+    decoded = CODEC.decode(CODEC.encode(events))
+    assert decoded == [{k: v for k, v in e.items() if v is not None} for e in events]
+
+
+def test_smaller_than_json_and_recognised_without_header():
+    """Compact records are much smaller than JSON and decoded by their magic byte"""
+    events = [dict(EVENT, total_in_area=i) for i in range(100)]
+    value = EventCodec.encode(events, COMPACT)
+
+    assert len(value) < len(json.dumps(events)) * 0.6
+    assert EventCodec.decode(value) == events
+    assert EventCodec.decode(value, EventCodec.content_type(EventCodec.headers(COMPACT))) == events
+
+
+def test_rejects_other_schemas_and_corruption():
+    """Records of an unregistered schema, truncated or mistyped raise ValueError"""
+    other = CompactCodec({"7": {"fields": ["stream_id"], "types": {"stream_id": "string"}}})
+    value = CODEC.encode([EVENT])
+    for bad in (other.encode([EVENT]), value[:-3], value + b"\x00", value[:1] + b"\x09" + value[2:]):
+        try:
+            CODEC.decode(bad)
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    try:
+        CODEC.encode([dict(EVENT, total_in_area="many")])
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_old_layout_records_decode_after_a_field_change():
+    """A record written before a field was added still decodes by its schema id"""
+    fields = ["stream_id", "total_in_area"]
+    types = {"stream_id": "string", "total_in_area": "integer", "camera": "string"}
+    before = CompactCodec({"1": {"fields": fields, "types": types}})
+    after = CompactCodec({"1": {"fields": fields, "types": types},
+                          "2": {"fields": ["stream_id", "camera", "total_in_area"], "types": types}})
+    old = before.encode([{"stream_id": "a", "total_in_area": 3}])
+    new = after.encode([{"stream_id": "b", "camera": "north", "total_in_area": 4}])
+
+    assert after.schema_id == 2
+    assert after.decode(old) == [{"stream_id": "a", "total_in_area": 3}]
+    assert after.decode(new) == [{"stream_id": "b", "camera": "north", "total_in_area": 4}]
+
+    # Version 1 records identified their layout by a crc32 fingerprint
+    fingerprint = zlib.crc32(b"stream_id:string,total_in_area:integer")
+    legacy = struct.pack(">BBI", 0xC1, 1, fingerprint) + old[6:]
+    assert after.decode(legacy) == [{"stream_id": "a", "total_in_area": 3}]
+
+
+def test_latest_schema_matches_traffic_data():
+    """A changed traffic_data field list needs a new compact schema id"""
+    config = ConfigService.load()
+    latest = config["compact_schemas"][str(CODEC.schema_id)]
+    assert latest["fields"] == config["traffic_data"]["fields"]
+    assert all(latest["types"][field] == config["traffic_data"]["types"][field] for field in latest["fields"])
+
+
+def test_group_by_stream_keeps_order():
+    """Frames split per stream keep each stream's events in order"""
+    events = [{"stream_id": s, "n": i} for i, s in enumerate("abab")] + [{"n": 4}]
+    groups = EventCodec.group_by_stream(events)
+    assert [(key, [e["n"] for e in group]) for key, group in groups] == [("a", [0, 2]), ("b", [1, 3]), (None, [4])]
+    assert json.loads(EventCodec.encode(groups[2][1], JSON)) == {"n": 4}
+
+
+def test_compression_falls_back_without_codec_library():
+    """lz4/zstd are used when installed and replaced by gzip otherwise"""
+    with patch.dict("os.environ", {"KAFKA_COMPRESSION_TYPE": "zstd"}), \
+            patch.dict(kafka_service._CODECS, {"zstd": lambda: False}):
+        assert KafkaService.compression_type() == "gzip"
+    with patch.dict("os.environ", {"KAFKA_COMPRESSION_TYPE": "lz4"}), \
+            patch.dict(kafka_service._CODECS, {"lz4": lambda: True}):
+        assert KafkaService.compression_type() == "lz4"
+    with patch.dict("os.environ", {"KAFKA_COMPRESSION_TYPE": "none"}):
+        assert KafkaService.compression_type() is None
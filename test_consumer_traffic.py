@@ -1,70 +1,54 @@
 """
 Test script for the Kafka consumer with traffic data format
 """
-import json
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import MagicMock
 from Packages.Query import QuerySql
+from Packages.PostgresService import PostgresPool
 
 
-@patch('Packages.Query.GeocodingService')
-def test_insert_traffic_data(mock_geocoding):
+def test_insert_traffic_data():
     """Test that traffic data is correctly inserted into the database with fulladdress"""
-    
-    # Mock the geocoding service
-    mock_geocoding.validate_coordinates.return_value = True
-    mock_geocoding.reverse_geocode.return_value = "Jl. Example Street, Jakarta, Indonesia"
-    
-    # Sample data matching your format
+
+    # Sample data matching your format, already enriched with its address
     sample_data = {
         "timestamp": "2025-11-17 14:16:17+0700",
+        "day_month_year": "2025-11-17",
         "stream_id": "96151250-abcb-408e-b25f-2fb4e82ea4a7",
         "location": "Simpang MORATA",
         "longitude": 106.913354,
         "latitude": -6.108524,
-        "numbers_of_cars": 4,
+        "total_in_area": 4,
+        "estimated_max_people": 10,
         "label": "Normal Traffic",
-        "type": "TC"
+        "type": "TC",
+        "fulladdress": "Jl. Example Street, Jakarta, Indonesia",
+        "city": "Jakarta",
+        "province": "DKI Jakarta"
     }
-    
-    # Mock the database connection and cursor
-    mock_conn = MagicMock()
-    mock_cursor = MagicMock()
-    mock_conn.cursor.return_value = mock_cursor
-    
-    # Create instance and set mock connection
-    query_service = QuerySql.__new__(QuerySql)
-    query_service.conn = mock_conn
-    
+
+    # Mock the database connection and cursor behind a pool
+    mock_conn = MagicMock(closed=0)
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    pool = PostgresPool(lambda: mock_conn, reconnect_attempts=1, prepare_statements=False)
+    query_service = QuerySql(pool=pool)
+
     # Call the insert function
     query_service.insert_traffic_data(sample_data)
-    
-    # Verify cursor.execute was called
-    assert mock_cursor.execute.called
-    
+
+    # Verify cursor.execute was called with the insert
+    inserts = [call.args for call in mock_cursor.execute.call_args_list
+               if "INSERT INTO traffic_data" in call.args[0]]
+    assert len(inserts) == 1
+
     # Verify the SQL query contains the expected fields including fulladdress
-    call_args = mock_cursor.execute.call_args
-    sql_query = call_args[0][0]
-    params = call_args[0][1]
-    
-    assert "INSERT INTO traffic_data" in sql_query
+    sql_query, params = inserts[0]
     assert "fulladdress" in sql_query
-    assert params[0] == "2025-11-17 14:16:17+0700"
-    assert params[1] == "96151250-abcb-408e-b25f-2fb4e82ea4a7"
-    assert params[2] == "Simpang MORATA"
-    assert params[3] == 106.913354
-    assert params[4] == -6.108524
-    assert params[5] == 4
-    assert params[6] == "Normal Traffic"
-    assert params[7] == "TC"
-    assert params[8] == "Jl. Example Street, Jakarta, Indonesia"  # fulladdress
-    
-    # Verify geocoding was called with correct coordinates
-    mock_geocoding.validate_coordinates.assert_called_once_with(-6.108524, 106.913354)
-    mock_geocoding.reverse_geocode.assert_called_once_with(-6.108524, 106.913354)
-    
+    assert params == tuple(sample_data[field] for field in QuerySql.TRAFFIC_DATA_FIELDS)
+    assert params[QuerySql.TRAFFIC_DATA_FIELDS.index("fulladdress")] == "Jl. Example Street, Jakarta, Indonesia"
+
     # Verify commit was called
     assert mock_conn.commit.called
-    
+
     print("✅ Test passed: Traffic data insertion with fulladdress works correctly")
 
 
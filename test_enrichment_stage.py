@@ -0,0 +1,92 @@
+"""
+Unit tests for the concurrent geocoding stage used by the Kafka consumer
+"""
+import time
+import random
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+from Packages.Enrichment import EnrichmentStage
+from Packages.Parser import KafkaParser
+
+
+def _message(i, latitude=-6.108524, longitude=106.913354):
+    return SimpleNamespace(offset=i, value={
+        "stream_id": f"stream-{i}",
+        "timestamp": "2025-11-17 14:16:17+0700",
+        "latitude": latitude,
+        "longitude": longitude
+    })
+
+
+def _slow_geocode(latitude, longitude):
+    time.sleep(random.uniform(0, 0.01))
+    return {"city": f"city-{latitude}", "province": "P", "fulladdress": None}
+
+
+@patch("Packages.Enrichment.GeocodingService.get_cache", return_value=None)
+@patch("Packages.Enrichment.GeocodingService.reverse_geocode", side_effect=_slow_geocode)
+def test_output_keeps_input_order(mock_geocode, mock_cache):
+    """Results are released in the order messages were polled"""
+    stage = EnrichmentStage(KafkaParser.enrich, max_workers=8, max_in_flight=16)
+    messages = [_message(i, latitude=float(i % 10)) for i in range(100)]
+
+    results = list(stage.process((m, m.value) for m in messages))
+
+    assert [message.offset for message, _ in results] == list(range(100))
+    assert all(data["city"] == f"city-{float(i % 10)}" for i, (_, data) in enumerate(results))
+    assert results[0][1]["day_month_year"] == "2025-11-17"
+    stage.shutdown()
+
+
+@patch("Packages.Enrichment.GeocodingService.get_cache", return_value=None)
+def test_identical_lookups_are_coalesced(mock_cache):
+    """A burst from one camera makes a single upstream request"""
+    release = threading.Event()
+    calls = []
+
+    def blocking_geocode(latitude, longitude):
+        calls.append((latitude, longitude))
+        release.wait(5)
+        return {"city": "Jakarta", "province": "DKI Jakarta", "fulladdress": None}
+
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode", side_effect=blocking_geocode):
+        stage = EnrichmentStage(KafkaParser.enrich, max_workers=4, max_in_flight=1000)
+        futures = [stage.submit(_message(i).value) for i in range(200)]
+        release.set()
+        assert all(f.result(5)["city"] == "Jakarta" for f in futures)
+
+    assert len(calls) == 1
+    assert stage.coalesced == 199
+    stage.shutdown()
+
+
+@patch("Packages.Enrichment.GeocodingService.get_cache", return_value=None)
+@patch("Packages.Enrichment.GeocodingService.reverse_geocode", side_effect=_slow_geocode)
+def test_in_flight_is_bounded(mock_geocode, mock_cache):
+    """No more than max_in_flight messages are pending before output is drained"""
+    stage = EnrichmentStage(KafkaParser.enrich, max_workers=4, max_in_flight=5)
+    consumed = []
+
+    def messages():
+        for i in range(50):
+            consumed.append(i)
+            yield _message(i, latitude=float(i))
+
+    for message, _ in stage.process((m, m.value) for m in messages()):
+        assert len(consumed) - message.offset <= 5
+    stage.shutdown()
+
+
+@patch("Packages.Enrichment.GeocodingService.get_cache", return_value=None)
+@patch("Packages.Enrichment.GeocodingService.reverse_geocode")
+def test_invalid_coordinates_skip_geocoding(mock_geocode, mock_cache):
+    """Messages with missing or invalid coordinates are enriched with empty address fields"""
+    stage = EnrichmentStage(KafkaParser.enrich)
+    messages = [_message(0, latitude=100, longitude=200), _message(1, latitude=None)]
+
+    results = [data for _, data in stage.process((m, m.value) for m in messages)]
+
+    assert [data["city"] for data in results] == [None, None]
+    mock_geocode.assert_not_called()
+    stage.shutdown()
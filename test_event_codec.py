@@ -0,0 +1,83 @@
+"""
+Unit tests for batched and binary event frames
+"""
+import json
+import msgpack
+from types import SimpleNamespace
+from Packages.EventCodec import EventCodec, JSON, MSGPACK
+from Packages.Parser import KafkaParser
+
+
+EVENT = {"stream_id": "a", "longitude": 106.913354, "latitude": -6.108524}
+
+
+def test_single_object_frame():
+    """A single JSON object is forwarded byte for byte"""
+    text = json.dumps(EVENT)
+    events, payload = EventCodec.parse_text_frame(text)
+    assert events == [EVENT]
+    assert payload == text.encode("utf-8")
+
+
+def test_json_array_frame_is_forwarded_without_reencoding():
+    """A JSON array frame becomes one payload holding every event"""
+    text = json.dumps([EVENT, dict(EVENT, stream_id="b")])
+    events, payload = EventCodec.parse_text_frame(text)
+    assert [e["stream_id"] for e in events] == ["a", "b"]
+    assert payload == text.encode("utf-8")
+
+
+def test_ndjson_frame_becomes_json_array():
+    """NDJSON lines are joined into a JSON array payload"""
+    text = "\n".join(json.dumps(dict(EVENT, stream_id=s)) for s in "abc") + "\n"
+    events, payload = EventCodec.parse_text_frame(text)
+    assert [e["stream_id"] for e in events] == ["a", "b", "c"]
+    assert [e["stream_id"] for e in EventCodec.decode(payload)] == ["a", "b", "c"]
+
+
+def test_ndjson_array_lines_are_flattened():
+    """Every event of an NDJSON array line is counted and forwarded, not nested"""
+    text = "\n".join([json.dumps([dict(EVENT, stream_id="a"), dict(EVENT, stream_id="b")]),
+                      json.dumps(dict(EVENT, stream_id="c")), "[]"])
+    events, payload = EventCodec.parse_text_frame(text)
+    assert [e["stream_id"] for e in events] == ["a", "b", "c"]
+    assert [e["stream_id"] for e in json.loads(payload)] == ["a", "b", "c"]
+
+
+def test_invalid_frames_are_rejected():
+    """Frames that are not events raise ValueError"""
+    for text in ["[1, 2]", "{\"a\": 1", "\"text\""]:
+        try:
+            EventCodec.parse_text_frame(text)
+            assert False, f"expected {text!r} to be rejected"
+        except ValueError:
+            pass
+
+
+def test_msgpack_roundtrip_through_headers():
+    """MessagePack records are decoded using the content-type header"""
+    payload = msgpack.packb([EVENT, EVENT])
+    headers = EventCodec.headers(MSGPACK)
+
+    assert EventCodec.content_type(headers) == MSGPACK
+    assert EventCodec.content_type(None) == JSON
+    assert EventCodec.decode(payload, EventCodec.content_type(headers)) == [EVENT, EVENT]
+
+
+def test_consumer_expands_batches_and_skips_bad_records():
+    """Each event of a batch record is processed; broken records still advance offsets"""
+    full = dict(EVENT, timestamp="2025-11-17 14:16:17+0700", location="Simpang MORATA",
+                total_in_area=4, estimated_max_people=10, label="Normal", type="TC")
+    messages = [
+        SimpleNamespace(offset=0, headers=[], value=json.dumps([full, EVENT]).encode()),
+        SimpleNamespace(offset=1, headers=[], value=b"not json"),
+        SimpleNamespace(offset=2, headers=EventCodec.headers(MSGPACK), value=msgpack.packb(full)),
+    ]
+
+    decoded = [(message.offset, event) for message, event in KafkaParser.decode(messages)]
+
+    assert [offset for offset, _ in decoded] == [0, 0, 1, 2]
+    assert decoded[0][1].stream_id == "a"
+    assert decoded[1][1] is None, "events missing required fields are skipped"
+    assert decoded[2][1] is None
+    assert decoded[3][1] == decoded[0][1]
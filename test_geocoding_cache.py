@@ -0,0 +1,72 @@
+"""
+Unit tests for the reverse geocoding cache
+"""
+import os
+import tempfile
+from unittest.mock import patch
+from Packages.GeocodingCache import GeocodingCache
+from Packages.GeocodingService import GeocodingService
+
+
+RESULT = {"city": "Jakarta Utara", "province": "DKI Jakarta", "fulladdress": "Simpang MORATA, Jakarta"}
+
+
+def test_quantized_key_shares_entry():
+    """Nearby readings from the same camera resolve to one cache entry"""
+    cache = GeocodingCache(precision=4)
+    cache.put(-6.108524, 106.913354, RESULT)
+
+    assert cache.get(-6.10852401, 106.91335399) == RESULT
+    assert cache.get(-6.2, 106.8) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_lru_eviction_and_ttl():
+    """Oldest entries are evicted first and expired entries are not served"""
+    cache = GeocodingCache(precision=2, max_entries=2, ttl_seconds=60)
+    cache.put(1.0, 1.0, RESULT)
+    cache.put(2.0, 2.0, RESULT)
+    cache.get(1.0, 1.0)
+    cache.put(3.0, 3.0, RESULT)
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.get(2.0, 2.0) is None
+    assert cache.get(1.0, 1.0) == RESULT
+
+    with patch("Packages.GeocodingCache.time.time", return_value=10 ** 12):
+        assert cache.get(1.0, 1.0) is None
+
+
+def test_persistent_tier_survives_restart():
+    """Entries written to SQLite are visible to a fresh cache instance"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "geocode.sqlite3")
+        GeocodingCache(db_path=path).put(-6.108524, 106.913354, RESULT)
+
+        restarted = GeocodingCache(db_path=path)
+        assert restarted.get(-6.108524, 106.913354) == RESULT
+        assert restarted.stats()["disk_hits"] == 1
+
+
+@patch.object(GeocodingService, "fetch_address", return_value=RESULT)
+def test_reverse_geocode_uses_cache(mock_fetch):
+    """Repeated lookups for one camera make a single upstream request"""
+    with patch.object(GeocodingService, "_cache", GeocodingCache()):
+        for _ in range(5):
+            assert GeocodingService.reverse_geocode(-6.108524, 106.913354) == RESULT
+
+    mock_fetch.assert_called_once_with(-6.108524, 106.913354)
+
+
+@patch.object(GeocodingService, "fetch_address",
+              return_value={"city": None, "province": None, "fulladdress": None})
+def test_failed_lookups_are_not_cached(mock_fetch):
+    """Failed lookups are retried on the next message"""
+    with patch.object(GeocodingService, "_cache", GeocodingCache()):
+        GeocodingService.reverse_geocode(-6.108524, 106.913354)
+        GeocodingService.reverse_geocode(-6.108524, 106.913354)
+
+    assert mock_fetch.call_count == 2
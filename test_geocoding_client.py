@@ -0,0 +1,137 @@
+"""
+Unit tests for the pooled geocoding HTTP client, its rate limiter and circuit breaker
+"""
+import time
+from unittest.mock import MagicMock, patch
+import requests
+from Benchmark.FakeNominatim import FakeNominatim
+from Packages.GeocodingClient import GeocodingClient, TokenBucket, CircuitBreaker, CircuitOpen, RateLimited, OPEN, CLOSED
+from Packages.GeocodingService import GeocodingService
+
+
+def _response(status=200, body=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = b'{"address": {"city": "Jakarta", "state": "DKI Jakarta"}, "display_name": "Jakarta"}' if body is None else body
+    return response
+
+
+def test_token_bucket_paces_requests():
+    """Bursts are served at once, then requests wait for tokens or give up"""
+    bucket = TokenBucket(rate=20, burst=2)
+    started = time.monotonic()
+    assert bucket.acquire(1) and bucket.acquire(1)
+    assert time.monotonic() - started < 0.02
+    assert not bucket.acquire(0)
+    assert bucket.acquire(1)
+    assert time.monotonic() - started >= 0.04
+    assert TokenBucket(rate=0).acquire(0)
+
+
+def test_circuit_opens_on_error_rate_and_recovers():
+    """A failure spike opens the circuit with its reason; a successful trial closes it"""
+    breaker = CircuitBreaker("api", failure_ratio=0.5, window=4, min_requests=4, open_seconds=10)
+    with patch("Packages.GeocodingClient.time.monotonic", return_value=100.0):
+        for success in (True, False, True):
+            breaker.record(success, "Timeout")
+        assert breaker.state == CLOSED
+        breaker.record(False, "Timeout")
+        assert breaker.state == OPEN and breaker.reason == "Timeout"
+        assert not breaker.allow()
+    with patch("Packages.GeocodingClient.time.monotonic", return_value=111.0):
+        assert breaker.allow()
+        # Only one trial request while half-open
+        assert not breaker.allow()
+        breaker.record(True)
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_endpoints_are_used_round_robin_and_skipped_when_open():
+    """Lookups alternate between endpoints and avoid one whose circuit is open"""
+    client = GeocodingClient(["http://a/reverse", "http://b/reverse"], min_requests=1, failure_ratio=0.5)
+    client.session.get = MagicMock(return_value=_response())
+
+    client.get({}), client.get({})
+    assert [call.args[0] for call in client.session.get.call_args_list] == ["http://a/reverse", "http://b/reverse"]
+
+    client.session.get.side_effect = [_response(503), _response(), _response()]
+    try:
+        client.get({})
+        assert False, "expected HTTPError"
+    except requests.exceptions.HTTPError:
+        pass
+    client.get({}), client.get({})
+    urls = [call.args[0] for call in client.session.get.call_args_list[2:]]
+    assert urls == ["http://a/reverse", "http://b/reverse", "http://b/reverse"]
+    assert client.endpoints[0].breaker.reason == "HTTP 503"
+
+
+def test_open_circuit_fails_fast():
+    """With every circuit open the lookup returns an empty address without a request"""
+    client = GeocodingClient(["http://a/reverse"], min_requests=1, failure_ratio=1.0)
+    client.session.get = MagicMock(side_effect=requests.exceptions.ConnectTimeout("slow"))
+    with patch.object(GeocodingService, "_client", client):
+        assert GeocodingService.fetch_address(-6.2, 106.8) == {"city": None, "province": None, "fulladdress": None}
+        assert GeocodingService.fetch_address(-6.2, 106.8) == {"city": None, "province": None, "fulladdress": None}
+    assert client.session.get.call_count == 1
+    try:
+        client.get({})
+        assert False, "expected CircuitOpen"
+    except CircuitOpen as e:
+        assert "ConnectTimeout" in str(e)
+
+
+def test_rate_limited_lookup_is_rejected():
+    """A lookup that cannot get a token in time is rejected without a request"""
+    client = GeocodingClient(["http://a/reverse"], rate=0.1, burst=1, max_wait=0)
+    client.session.get = MagicMock(return_value=_response())
+    client.get({})
+    try:
+        client.get({})
+        assert False, "expected RateLimited"
+    except RateLimited:
+        pass
+    assert client.session.get.call_count == 1
+
+
+def test_session_keeps_connections_alive():
+    """Consecutive lookups reuse one pooled connection to the server"""
+    with FakeNominatim(latency_ms=0, jitter_ms=0) as nominatim:
+        client = GeocodingClient([nominatim.url])
+        with patch.object(GeocodingService, "_client", client):
+            for _ in range(3):
+                assert GeocodingService.fetch_address(-6.2, 106.8)["fulladdress"]
+        client.close()
+    assert nominatim.requests == 3
+    assert nominatim.connections == 1
+
+
+def test_half_open_trial_is_settled_by_any_failure():
+    """A trial ending in a redirect loop reopens the circuit; an unrelated error frees the trial"""
+    client = GeocodingClient(["http://a/reverse"], min_requests=1, failure_ratio=1.0, open_seconds=10)
+    breaker = client.endpoints[0].breaker
+    client.session.get = MagicMock(side_effect=requests.exceptions.TooManyRedirects("loop"))
+
+    with patch("Packages.GeocodingClient.time.monotonic", return_value=100.0):
+        for _ in range(2):
+            try:
+                client.get({})
+            except (requests.exceptions.TooManyRedirects, CircuitOpen):
+                pass
+        assert breaker.state == OPEN and breaker.reason == "TooManyRedirects"
+
+    with patch("Packages.GeocodingClient.time.monotonic", return_value=111.0):
+        try:
+            client.get({})
+        except requests.exceptions.TooManyRedirects:
+            pass
+        assert breaker.state == OPEN
+
+    client.session.get.side_effect = [RuntimeError("bug"), _response()]
+    with patch("Packages.GeocodingClient.time.monotonic", return_value=122.0):
+        try:
+            client.get({})
+        except RuntimeError:
+            pass
+        client.get({})
+    assert breaker.state == CLOSED
@@ -0,0 +1,131 @@
+"""
+Unit tests for the non-blocking Kafka publisher used by the WebSocket ingress
+"""
+import asyncio
+import threading
+from types import SimpleNamespace
+from Packages.KafkaPublisher import KafkaPublisher, PublisherBusy
+
+
+class FakeSend:
+    def __init__(self):
+        self.callbacks = []
+        self.errbacks = []
+
+    def add_callback(self, fn):
+        self.callbacks.append(fn)
+
+    def add_errback(self, fn):
+        self.errbacks.append(fn)
+
+
+class FakeProducer:
+    """Records sends and acknowledges them only when told to"""
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, topic, value=None, key=None, headers=None):
+        handle = FakeSend()
+        with self.lock:
+            self.sent.append((topic, value, handle))
+        return handle
+
+    def ack_all(self):
+        with self.lock:
+            sent, self.sent = self.sent, []
+        for i, (_, _, handle) in enumerate(sent):
+            for fn in handle.callbacks:
+                fn(SimpleNamespace(partition=0, offset=i))
+
+    def flush(self, timeout=None):
+        pass
+
+
+def test_publish_resolves_on_broker_ack():
+    """The returned future completes with record metadata once the broker acks"""
+    producer = FakeProducer()
+    publisher = KafkaPublisher(producer, max_pending=10)
+
+    async def scenario():
+        delivery = await publisher.publish("ws_incoming", {"stream_id": "a"})
+        while not producer.sent:
+            await asyncio.sleep(0.01)
+        assert not delivery.done()
+        producer.ack_all()
+        return await asyncio.wait_for(delivery, 2)
+
+    metadata = asyncio.run(scenario())
+    assert metadata.offset == 0
+    assert publisher.pending == 0
+    publisher.close()
+
+
+def test_reject_policy_applies_backpressure():
+    """With the pending limit reached, new messages are rejected instead of blocking"""
+    producer = FakeProducer()
+    publisher = KafkaPublisher(producer, max_pending=3, policy="reject")
+
+    async def scenario():
+        for i in range(3):
+            await publisher.publish("ws_incoming", {"n": i})
+        try:
+            await publisher.publish("ws_incoming", {"n": 3})
+            return False
+        except PublisherBusy:
+            return True
+
+    assert asyncio.run(scenario())
+    assert publisher.rejected == 1
+    publisher.close()
+
+
+def test_wait_policy_resumes_when_space_frees():
+    """With the wait policy a publish proceeds as soon as earlier messages are acked"""
+    producer = FakeProducer()
+    publisher = KafkaPublisher(producer, max_pending=1, policy="wait", wait_timeout=2)
+
+    async def scenario():
+        await publisher.publish("ws_incoming", {"n": 0})
+        while not producer.sent:
+            await asyncio.sleep(0.01)
+        asyncio.get_running_loop().call_later(0.05, producer.ack_all)
+        delivery = await publisher.publish("ws_incoming", {"n": 1})
+        return delivery
+
+    asyncio.run(scenario())
+    assert publisher.rejected == 0
+    publisher.close()
+
+
+def test_batch_is_rejected_whole_when_it_does_not_fit():
+    """A two-record frame with one free slot queues nothing; it fits once a slot frees"""
+    producer = FakeProducer()
+    publisher = KafkaPublisher(producer, max_pending=3, policy="reject")
+    frame = [("cam-1", b"a", None), ("cam-2", b"b", None)]
+
+    async def scenario():
+        await publisher.publish("ws_incoming", b"x")
+        await publisher.publish("ws_incoming", b"y")
+        try:
+            await publisher.publish_many("ws_incoming", frame)
+            return False
+        except PublisherBusy:
+            pass
+        while len(producer.sent) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert publisher.pending == 2 and [value for _, value, _ in producer.sent] == [b"x", b"y"]
+
+        producer.ack_all()
+        deliveries = await publisher.publish_many("ws_incoming", frame)
+        while len(producer.sent) < 2:
+            await asyncio.sleep(0.01)
+        producer.ack_all()
+        await asyncio.wait_for(asyncio.gather(*deliveries), 2)
+        return True
+
+    assert asyncio.run(scenario())
+    assert publisher.rejected == 1 and publisher.published == 4
+    publisher.close()
@@ -0,0 +1,116 @@
+"""
+Unit tests for Prometheus metrics, the sampling profiler and sampled logging
+"""
+import time
+import logging
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+import requests
+from Packages import Metrics
+from Packages.Metrics import Registry, SamplingProfiler, SampledLog, REGISTRY
+from Packages.BatchWriter import BatchWriter
+from Packages.Parser import KafkaParser
+
+
+def test_render_prometheus_text():
+    """Counters, gauges and cumulative histogram buckets use the exposition format"""
+    registry = Registry()
+    counter = registry.counter("events_total", "Events", ["result"])
+    counter.inc(result="ok")
+    counter.inc(2, result="ok")
+    gauge = registry.gauge("queue_depth", "Depth", ["sink"])
+    gauge.track(lambda: 7, sink="clickhouse")
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+
+    text = registry.render()
+    assert "# TYPE events_total counter" in text
+    assert 'events_total{result="ok"} 3' in text
+    assert 'queue_depth{sink="clickhouse"} 7' in text
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
+
+
+def test_sampled_log_rate_limits_per_key():
+    """Repeated messages are logged once per interval with a suppressed count"""
+    log = MagicMock()
+    sampled = SampledLog(interval=10)
+    with patch("Packages.Metrics.time.monotonic", return_value=100.0):
+        assert sampled(logging.INFO, "a", "first", log)
+        assert not sampled(logging.INFO, "a", "second", log)
+        assert sampled(logging.INFO, "b", "other key", log)
+    with patch("Packages.Metrics.time.monotonic", return_value=111.0):
+        assert sampled(logging.INFO, "a", "third", log)
+
+    messages = [call.args[1] for call in log.log.call_args_list]
+    assert messages == ["first", "other key", "third (+1 similar in the last 10s)"]
+
+
+def test_profiler_samples_other_threads():
+    """Collapsed stacks name the sampled thread and its functions"""
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop, name="busy")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.1)
+    report = profiler.stop()
+    stop.set()
+    worker.join()
+
+    assert profiler.samples > 0
+    assert any(line.startswith("busy;") and "busy_loop" in line for line in report.splitlines())
+
+
+def test_metrics_endpoint_serves_registry():
+    """The worker's HTTP server exposes the process registry on /metrics"""
+    REGISTRY.counter("test_metrics_endpoint_total", "Test counter").inc()
+    server = Metrics.serve(0, host="127.0.0.1")
+    try:
+        response = requests.get(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5)
+    finally:
+        server.shutdown()
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert "test_metrics_endpoint_total 1" in response.text
+
+
+def test_profile_endpoint_requires_token():
+    """/debug/profile is absent without PROFILER_TOKEN and rejects a wrong bearer token"""
+    server = Metrics.serve(0)
+    url = f"http://127.0.0.1:{server.server_address[1]}/debug/profile?seconds=0"
+    try:
+        with patch.object(Metrics, "PROFILER_TOKEN", ""):
+            assert requests.get(url, timeout=5).status_code == 404
+        with patch.object(Metrics, "PROFILER_TOKEN", "secret"):
+            assert requests.get(url, timeout=5).status_code == 401
+            assert requests.get(url, headers={"Authorization": "Bearer wrong"}, timeout=5).status_code == 401
+            response = requests.get(url, headers={"Authorization": "Bearer secret"}, timeout=5)
+            assert response.status_code == 200
+    finally:
+        server.shutdown()
+    assert server.server_address[0] == "127.0.0.1"
+
+
+def test_stage_metrics_are_recorded():
+    """Flushes record duration and batch size; decoding counts events by outcome"""
+    writer = BatchWriter(lambda rows: None, name="metrics-test")
+    writer.add({"n": 1})
+    writer.add({"n": 2})
+    writer.flush()
+    assert Metrics.REGISTRY.histogram("sink_batch_rows", "").count(sink="metrics-test") == 1
+
+    events = REGISTRY.counter("consumer_events_total", "", ["result"])
+    before = events.value(result="undecodable")
+    message = SimpleNamespace(value=b"not json", headers=[], offset=0)
+    assert list(KafkaParser.decode([message])) == [(message, None)]
+    assert events.value(result="undecodable") == before + 1
@@ -0,0 +1,169 @@
+"""
+Unit tests for the offline gazetteer reverse geocoder
+"""
+import os
+import json
+import time
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from Packages.OfflineGeocoder import OfflineGeocoder, Place
+from Packages.GeocodingService import GeocodingService
+
+
+GAZETTEER_CSV = """name,city,province,latitude,longitude
+Simpang MORATA,Jakarta Utara,DKI Jakarta,-6.108524,106.913354
+Monas,Jakarta Pusat,DKI Jakarta,-6.175392,106.827153
+Gedung Sate,Bandung,Jawa Barat,-6.902474,107.618782
+"""
+
+
+def _write(tmp, name, content):
+    path = os.path.join(tmp, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+def test_csv_nearest_place():
+    """Lookups resolve to the nearest gazetteer centroid"""
+    with tempfile.TemporaryDirectory() as tmp:
+        geocoder = OfflineGeocoder.from_file(_write(tmp, "places.csv", GAZETTEER_CSV), max_distance_km=50)
+
+    result = geocoder.reverse_geocode(-6.11, 106.91)
+    assert result["city"] == "Jakarta Utara"
+    assert result["province"] == "DKI Jakarta"
+    assert result["fulladdress"] == "Simpang MORATA, Jakarta Utara, DKI Jakarta"
+
+    assert geocoder.reverse_geocode(-6.90, 107.60)["city"] == "Bandung"
+
+
+def test_far_points_return_empty_address():
+    """Coordinates outside the covered area are not forced onto a distant place"""
+    with tempfile.TemporaryDirectory() as tmp:
+        geocoder = OfflineGeocoder.from_file(_write(tmp, "places.csv", GAZETTEER_CSV), max_distance_km=50)
+
+    assert geocoder.reverse_geocode(37.7749, -122.4194) == {"city": None, "province": None, "fulladdress": None}
+
+
+def test_polygon_refinement():
+    """A point inside a boundary polygon wins over a closer centroid"""
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"city": "Big", "province": "P"},
+                "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]]}
+            },
+            {
+                "type": "Feature",
+                "properties": {"city": "Small", "province": "P"},
+                "geometry": {"type": "Polygon", "coordinates": [[[10, 0], [11, 0], [11, 1], [10, 1], [10, 0]]]}
+            }
+        ]
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        geocoder = OfflineGeocoder.from_file(_write(tmp, "areas.geojson", json.dumps(collection)))
+
+    # Closer to the centroid of "Small" but inside "Big"
+    assert geocoder.reverse_geocode(0.5, 9.9)["city"] == "Big"
+    assert geocoder.reverse_geocode(0.5, 10.5)["city"] == "Small"
+
+
+def test_point_outside_polygons_is_not_assigned_to_one():
+    """A point outside every boundary falls back to a point-only place, never to a polygon's centroid"""
+    polygon = {
+        "type": "Feature",
+        "properties": {"city": "Area", "province": "P"},
+        "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+    }
+    point = {
+        "type": "Feature",
+        "properties": {"city": "Town", "province": "Q"},
+        "geometry": {"type": "Point", "coordinates": [3, 0.5]}
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        polygons_only = OfflineGeocoder.from_file(_write(tmp, "a.geojson", json.dumps(
+            {"type": "FeatureCollection", "features": [polygon]})))
+        mixed = OfflineGeocoder.from_file(_write(tmp, "b.geojson", json.dumps(
+            {"type": "FeatureCollection", "features": [polygon, point]})))
+
+    assert polygons_only.reverse_geocode(0.5, 1.2) == {"city": None, "province": None, "fulladdress": None}
+    assert mixed.reverse_geocode(0.5, 1.2)["city"] == "Town"
+    assert mixed.reverse_geocode(0.5, 0.5)["city"] == "Area"
+
+
+def test_large_boundary_wins_over_many_closer_centroids():
+    """A point inside a large polygon resolves to it even when many smaller polygons lie closer"""
+    square = lambda x, y, size: [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]
+    features = [{
+        "type": "Feature",
+        "properties": {"city": None, "province": "Region"},
+        "geometry": {"type": "Polygon", "coordinates": square(0, 0, 20)}
+    }]
+    # Twelve small districts around (18, 18), all nearer than the region's centroid
+    features += [{
+        "type": "Feature",
+        "properties": {"city": f"District {i}", "province": "Region"},
+        "geometry": {"type": "Polygon", "coordinates": square(16 + (i % 4) * 0.5, 16.5 + (i // 4) * 0.5, 0.4)}
+    } for i in range(12)]
+    with tempfile.TemporaryDirectory() as tmp:
+        geocoder = OfflineGeocoder.from_file(_write(tmp, "region.geojson", json.dumps(
+            {"type": "FeatureCollection", "features": features})))
+
+    result = geocoder.reverse_geocode(18.45, 18.45)
+    assert (result["city"], result["province"]) == (None, "Region")
+    assert geocoder.reverse_geocode(16.7, 16.2)["city"] == "District 0"
+    assert geocoder.reverse_geocode(25, 25) == {"city": None, "province": None, "fulladdress": None}
+
+
+def test_kdtree_matches_linear_scan():
+    """The KD-tree returns the same nearest place as a brute-force scan"""
+    rng = random.Random(7)
+    places = [Place(str(i), None, None, rng.uniform(-60, 60), rng.uniform(-180, 180)) for i in range(500)]
+    geocoder = OfflineGeocoder(places)
+
+    for _ in range(200):
+        lat, lon = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        query = Place(None, None, None, lat, lon).xyz
+        expected = min(places, key=lambda p: sum((a - b) ** 2 for a, b in zip(p.xyz, query)))
+        assert geocoder.reverse_geocode(lat, lon)["city"] == expected.city
+
+
+def test_backend_selected_from_env():
+    """GEOCODING_BACKEND=offline routes lookups away from the HTTP API"""
+    geocoder = OfflineGeocoder([Place("Jakarta", "DKI Jakarta", None, -6.2, 106.8)])
+    try:
+        with patch.dict(os.environ, {"GEOCODING_BACKEND": "offline"}), \
+                patch.object(GeocodingService, "_offline", geocoder), \
+                patch.object(GeocodingService, "fetch_address") as mock_fetch:
+            GeocodingService.configure()
+            assert GeocodingService.reverse_geocode(-6.2, 106.8)["city"] == "Jakarta"
+
+            # The backend is resolved once, not on every lookup
+            os.environ["GEOCODING_BACKEND"] = "nominatim"
+            assert GeocodingService.reverse_geocode(-6.2, 106.8)["city"] == "Jakarta"
+    finally:
+        GeocodingService.configure()
+
+    mock_fetch.assert_not_called()
+
+
+def test_offline_geocoder_is_built_once_across_threads():
+    """Concurrent first lookups share one offline index"""
+    built = []
+
+    def slow_from_env():
+        time.sleep(0.05)
+        built.append(OfflineGeocoder([Place("Jakarta", "DKI Jakarta", None, -6.2, 106.8)]))
+        return built[-1]
+
+    with patch.object(GeocodingService, "_offline", None), \
+            patch.object(OfflineGeocoder, "from_env", side_effect=slow_from_env):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            geocoders = list(pool.map(lambda _: GeocodingService.get_offline_geocoder(), range(8)))
+
+    assert len(built) == 1
+    assert all(geocoder is built[0] for geocoder in geocoders)
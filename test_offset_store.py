@@ -0,0 +1,91 @@
+"""
+Unit tests for Kafka offsets stored transactionally with the data in PostgreSQL
+"""
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from kafka.structs import TopicPartition
+from Packages.BatchWriter import BatchWriter
+from Packages.Query import QuerySql
+from Packages.PostgresService import PostgresPool
+from Packages.Parser import KafkaParser
+
+ROW = {"stream_id": "s-1", "timestamp": "2025-11-17 14:16:17+0700", "day_month_year": "2025-11-17"}
+
+
+def _query_service():
+    mock_conn = MagicMock(closed=0)
+    return QuerySql(pool=PostgresPool(lambda: mock_conn, reconnect_attempts=1)), mock_conn
+
+
+def _message(offset, partition=0):
+    return SimpleNamespace(topic="ws_incoming", partition=partition, offset=offset)
+
+
+def test_offsets_commit_with_the_rows():
+    """Rows and offsets are written by one transaction with a single commit"""
+    service, mock_conn = _query_service()
+    with patch("Packages.Query.execute_values") as execute_values:
+        service.insert_traffic_data_batch([ROW], offsets={("ws_incoming", 0): 42}, group="traffic-consumer")
+
+    statements = [call.args[1] for call in execute_values.call_args_list]
+    assert "INSERT INTO traffic_data" in statements[0]
+    assert "INSERT INTO kafka_offsets" in statements[-1]
+    assert execute_values.call_args.args[2] == [("traffic-consumer", "ws_incoming", 0, 42, 42)]
+    assert mock_conn.commit.call_count == 1
+
+
+def test_skipped_batches_still_store_offsets():
+    """A flush of only skipped messages stores their offsets through the sink"""
+    sink = MagicMock()
+    writer = BatchWriter(sink, with_offsets=True)
+    writer.skip(_message(7))
+    writer.skip(_message(3, partition=1))
+
+    assert writer.flush() == {("ws_incoming", 0): 8, ("ws_incoming", 1): 4}
+    sink.assert_called_once_with([], {("ws_incoming", 0): 8, ("ws_incoming", 1): 4})
+
+    service, mock_conn = _query_service()
+    with patch("Packages.Query.execute_values") as execute_values:
+        service.insert_traffic_data_batch([], offsets={("ws_incoming", 0): 8}, group="g")
+    assert ["kafka_offsets" in call.args[1] for call in execute_values.call_args_list] == [True]
+
+
+def test_failed_flush_keeps_rows_and_offsets():
+    """When the transaction fails neither rows nor offsets are dropped"""
+    sink = MagicMock(side_effect=[RuntimeError("db down"), None])
+    writer = BatchWriter(sink, with_offsets=True)
+    writer.add(ROW, _message(0))
+
+    assert writer.flush() is None
+    assert writer.flush() == {("ws_incoming", 0): 1}
+    assert sink.call_args_list[1].args == ([ROW], {("ws_incoming", 0): 1})
+
+
+def test_assigned_partitions_seek_to_stored_offsets():
+    """Partitions with a stored offset resume there; others keep their position"""
+    consumer = MagicMock(config={"group_id": "traffic-consumer"})
+    store = MagicMock()
+    store.stored_positions.return_value = {("ws_incoming", 0): (120, 120)}
+
+    written = KafkaParser.seek_to_stored(consumer, store, [TopicPartition("ws_incoming", 0), TopicPartition("ws_incoming", 1)])
+
+    store.stored_positions.assert_called_once_with("traffic-consumer", {"ws_incoming"})
+    consumer.seek.assert_called_once_with(TopicPartition("ws_incoming", 0), 120)
+    assert written == {}
+
+
+def test_held_offsets_store_the_written_position():
+    """A position held back by rollup windows keeps the written offset, returned again on assignment"""
+    service, mock_conn = _query_service()
+    with patch("Packages.Query.execute_values") as execute_values:
+        service.insert_traffic_data_batch([ROW], offsets={("ws_incoming", 0): 42, ("ws_incoming", 1): 9},
+                                          group="g", held={("ws_incoming", 0): 30})
+    assert execute_values.call_args.args[2] == [("g", "ws_incoming", 0, 30, 42), ("g", "ws_incoming", 1, 9, 9)]
+
+    consumer = MagicMock(config={"group_id": "g"})
+    store = MagicMock()
+    store.stored_positions.return_value = {("ws_incoming", 0): (30, 42)}
+    written = KafkaParser.seek_to_stored(consumer, store, [TopicPartition("ws_incoming", 0)])
+
+    consumer.seek.assert_called_once_with(TopicPartition("ws_incoming", 0), 30)
+    assert written == {("ws_incoming", 0): 42}
@@ -0,0 +1,131 @@
+"""
+Unit tests for daily traffic_data partition management
+"""
+import threading
+from datetime import date
+from unittest.mock import MagicMock, patch
+from Packages.PartitionManager import PartitionManager
+from Packages.PostgresService import PostgresPool
+from Packages.Query import QuerySql
+
+
+def _manager(existing=(), stranded=(), relkind="p", **kwargs):
+    mock_conn = MagicMock(closed=0)
+    cursor = mock_conn.cursor.return_value.__enter__.return_value
+
+    def fetchall():
+        query = repr(cursor.execute.call_args.args[0])
+        return [(day,) for day in stranded] if "DISTINCT" in query else [(name,) for name in existing]
+
+    def fetchone():
+        query, *params = cursor.execute.call_args.args
+        if "relkind" in query:
+            return (relkind,)
+        # Only the default partition exists among the tables looked up with to_regclass
+        return (params == [("traffic_data_default",)],)
+
+    cursor.fetchall.side_effect = fetchall
+    cursor.fetchone.side_effect = fetchone
+    cursor.rowcount = 0
+    manager = PartitionManager(PostgresPool(lambda: mock_conn, reconnect_attempts=1), **kwargs)
+    return manager, cursor
+
+
+def _statements(cursor):
+    return [repr(call.args[0]) for call in cursor.execute.call_args_list]
+
+
+def test_partition_name_and_bounds():
+    """A partition covers one calendar day in the configured timezone"""
+    manager, _ = _manager(timezone="Asia/Jakarta")
+    assert manager.partition_name(date(2025, 11, 17)) == "traffic_data_p20251117"
+
+    start, end = manager.bounds(date(2025, 11, 17))
+    assert start.isoformat() == "2025-11-17T00:00:00+07:00"
+    assert end.isoformat() == "2025-11-18T00:00:00+07:00"
+
+
+def test_existing_parses_partition_names():
+    """Only daily partitions are reported, not the default partition"""
+    manager, _ = _manager(existing=["traffic_data_p20251116", "traffic_data_default"])
+    assert manager.existing() == {date(2025, 11, 16)}
+
+
+def test_ensure_creates_missing_days_once():
+    """The day key and its neighbours get partitions; known days are not re-created"""
+    manager, cursor = _manager(existing=["traffic_data_p20251116"])
+
+    manager.ensure(["2025-11-17", "2025-11-17", None, "garbage"])
+    attached = [s for s in _statements(cursor) if "ATTACH PARTITION" in s]
+    assert len(attached) == 2
+    assert "traffic_data_p20251117" in attached[0] and "traffic_data_p20251118" in attached[1]
+    # Rows of the day are moved out of the default partition before attaching
+    assert any("DELETE FROM" in s and "traffic_data_default" in s for s in _statements(cursor))
+
+    cursor.execute.reset_mock()
+    manager.ensure(["2025-11-17"])
+    assert cursor.execute.call_count == 0
+
+
+def test_maintain_premakes_and_expires():
+    """Future partitions are pre-created and expired ones detached or dropped"""
+    manager, cursor = _manager(
+        existing=["traffic_data_p20251101", "traffic_data_p20251116", "traffic_data_p20251117"],
+        premake_days=2, retention_days=7, retention_action="drop"
+    )
+
+    result = manager.maintain(today=date(2025, 11, 17))
+
+    assert result["created"] == [date(2025, 11, 18), date(2025, 11, 19)]
+    assert result["expired"] == [date(2025, 11, 1)]
+    statements = _statements(cursor)
+    assert any("DETACH PARTITION" in s and "traffic_data_p20251101" in s for s in statements)
+    assert any(s.startswith("Composed([SQL('DROP TABLE ')") for s in statements)
+
+
+def test_batch_write_ensures_partitions():
+    """The consumer's batch writer creates partitions for the days in the batch"""
+    mock_conn = MagicMock(closed=0)
+    partitions = MagicMock()
+    service = QuerySql(pool=PostgresPool(lambda: mock_conn, reconnect_attempts=1), partitions=partitions)
+
+    with patch("Packages.Query.execute_values"):
+        service.insert_traffic_data_batch([{"day_month_year": "2025-11-17"}, {"day_month_year": "2025-11-17"}])
+
+    partitions.ensure.assert_called_once_with({"2025-11-17"})
+    mock_conn.commit.assert_called_once()
+
+
+def test_unpartitioned_table_turns_management_off_once():
+    """A plain traffic_data logs one error and is left alone; maintain refuses to run"""
+    manager, cursor = _manager(relkind="r")
+    manager.ensure(["2025-11-17"])
+    manager.ensure(["2025-11-18"])
+
+    assert manager.disabled
+    assert not [s for s in _statements(cursor) if "ATTACH PARTITION" in s]
+    assert sum("relkind" in s for s in _statements(cursor)) == 1
+    try:
+        manager.maintain(today=date(2025, 11, 17))
+        assert False, "maintain must refuse an unpartitioned table"
+    except RuntimeError:
+        pass
+
+
+def test_maintain_moves_stranded_days_out_of_the_default_partition():
+    """Days with rows in the default partition, e.g. copied on upgrade, get their partitions"""
+    manager, cursor = _manager(existing=["traffic_data_p20251117"], stranded=[date(2025, 10, 2)], premake_days=0)
+    result = manager.maintain(today=date(2025, 11, 17))
+    assert result["created"] == [date(2025, 10, 2), date(2025, 11, 16)]
+    assert any("traffic_data_p20251002" in s and "ATTACH PARTITION" in s for s in _statements(cursor))
+
+
+def test_concurrent_ensure_creates_each_day_once():
+    """Loader threads sharing the manager do not create the same partition twice"""
+    manager, cursor = _manager()
+    threads = [threading.Thread(target=manager.ensure, args=(["2025-11-17"],)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len([s for s in _statements(cursor) if "ATTACH PARTITION" in s]) == 3
@@ -0,0 +1,161 @@
+"""
+Unit tests for the pooled PostgreSQL connection manager
+"""
+import threading
+from unittest.mock import MagicMock, patch
+import psycopg2
+from psycopg2 import extensions
+from Packages.PostgresService import PostgresPool, CommitUnknown
+
+
+def _conn():
+    conn = MagicMock(closed=0)
+    conn.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+
+def test_connections_are_reused():
+    """A released connection is handed out again instead of opening a new one"""
+    connect = MagicMock(side_effect=lambda: _conn())
+    pool = PostgresPool(connect, max_size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert connect.call_count == 1
+
+
+def test_broken_connection_is_discarded():
+    """A connection that raised a connection error never goes back to the pool"""
+    connect = MagicMock(side_effect=lambda: _conn())
+    pool = PostgresPool(connect, max_size=2)
+
+    try:
+        with pool.connection() as conn:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+    except psycopg2.OperationalError:
+        pass
+
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.close.called
+    assert pool.discarded == 1
+
+
+def test_idle_connection_is_health_checked():
+    """Connections idle past the health check interval are pinged and replaced if dead"""
+    dead = _conn()
+    dead.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError("gone")
+    connect = MagicMock(side_effect=[dead, _conn()])
+    pool = PostgresPool(connect, health_check_seconds=0)
+
+    with pool.connection():
+        pass
+    with pool.connection() as conn:
+        assert conn is not dead
+    assert connect.call_count == 2
+
+
+@patch("Packages.PostgresService.time.sleep")
+def test_run_reconnects_with_backoff(mock_sleep):
+    """Work interrupted by a dropped connection is retried on a fresh connection"""
+    pool = PostgresPool(MagicMock(side_effect=lambda: _conn()), reconnect_attempts=3, reconnect_backoff=0.5)
+    attempts = []
+
+    def work(conn):
+        attempts.append(conn)
+        if len(attempts) < 3:
+            raise psycopg2.OperationalError("terminating connection due to administrator command")
+        return "ok"
+
+    assert pool.run(work) == "ok"
+    assert len(set(map(id, attempts))) == 3
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.5, 1.0]
+
+
+def test_pool_never_exceeds_max_size():
+    """Concurrent writers share at most max_size connections"""
+    connect = MagicMock(side_effect=lambda: _conn())
+    pool = PostgresPool(connect, max_size=3)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def writer():
+        for _ in range(20):
+            with pool.connection():
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                with lock:
+                    active.pop()
+
+    threads = [threading.Thread(target=writer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(peak) <= 3
+    assert connect.call_count <= 3
+
+
+def test_statements_are_prepared_once_per_connection():
+    """A statement is PREPAREd on first use per connection and forgotten with the connection"""
+    pool = PostgresPool(MagicMock(side_effect=lambda: _conn()), max_size=1)
+    query = "INSERT INTO t (a, b) VALUES (%s, %s)"
+
+    with pool.connection() as conn:
+        assert pool.prepare(conn, query) == "EXECUTE traffic_stmt_0 (%s, %s)"
+        assert pool.prepare(conn, query) == "EXECUTE traffic_stmt_0 (%s, %s)"
+    executed = [call.args[0] for call in conn.cursor.return_value.__enter__.return_value.execute.call_args_list]
+    assert executed == ["PREPARE traffic_stmt_0 AS INSERT INTO t (a, b) VALUES ($1, $2)"]
+
+    pool.release(pool.acquire(), discard=True)
+    with pool.connection() as fresh:
+        pool.prepare(fresh, query)
+    assert fresh.cursor.return_value.__enter__.return_value.execute.called
+
+
+@patch("Packages.PostgresService.time.sleep")
+def test_commit_lost_with_the_connection_is_not_repeated(mock_sleep):
+    """A dropped COMMIT is looked up by transaction id: committed work is not run again"""
+    def writer(status):
+        def connect():
+            conn = _conn()
+            conn.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_INTRANS
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchone.side_effect = lambda: (status if "txid_status" in cursor.execute.call_args.args[0] else 42,)
+            return conn
+        return connect
+
+    for status, runs in (("committed", 1), ("aborted", 2)):
+        pool = PostgresPool(MagicMock(side_effect=writer(status)), reconnect_attempts=2)
+        attempts = []
+
+        def work(conn):
+            attempts.append(conn)
+            if len(attempts) == 1:
+                conn.commit.side_effect = psycopg2.OperationalError("server closed the connection unexpectedly")
+            return "ok"
+
+        assert pool.run(work) == "ok"
+        assert len(attempts) == runs
+
+    pool = PostgresPool(MagicMock(side_effect=writer(None)), reconnect_attempts=2)
+    first = []
+
+    def dropped(conn):
+        if not first:
+            first.append(conn)
+            conn.commit.side_effect = psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    try:
+        pool.run(dropped)
+        assert False, "an unknown commit outcome must be raised"
+    except CommitUnknown:
+        pass
+    assert len(first) == 1
@@ -0,0 +1,191 @@
+"""
+Unit tests for the bulk replay mode of the worker
+"""
+import gzip
+import json
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from kafka.structs import TopicPartition
+from Packages.Enrichment import EnrichmentStage
+from Packages.EventCodec import EventCodec
+from Packages.Parser import KafkaParser, Parser
+from Packages.Replay import FileSource, KafkaRangeSource, Replay, parse_bound
+from Packages.PostgresService import PostgresPool
+from Packages.Query import QuerySql
+
+ADDRESS = {"city": "Jakarta", "province": "DKI Jakarta", "fulladdress": "Jl. Sudirman"}
+
+
+def _event(i, latitude=-6.1, longitude=106.9):
+    return {
+        "stream_id": f"s-{i}", "timestamp": "2025-11-17 14:16:17+0700", "location": "Gate",
+        "latitude": latitude, "longitude": longitude, "total_in_area": i,
+        "estimated_max_people": 10, "label": "person", "type": "traffic"
+    }
+
+
+class ListSource:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def describe(self):
+        return "test chunks"
+
+    def progress(self):
+        return None
+
+    def chunks(self):
+        for events in self._chunks:
+            yield events, 0
+
+
+class FakeReader:
+    """Consumer over one in-memory partition that honours assign, seek, pause and position."""
+
+    def __init__(self, values, timestamps):
+        self.tp = TopicPartition("ws_incoming", 0)
+        self.values = values
+        self.timestamps = timestamps
+        self.position_at = 0
+
+    def partitions_for_topic(self, topic):
+        return {0}
+
+    def beginning_offsets(self, partitions):
+        return {self.tp: 0}
+
+    def end_offsets(self, partitions):
+        return {self.tp: len(self.values)}
+
+    def offsets_for_times(self, times):
+        offset = next((i for i, t in enumerate(self.timestamps) if t >= times[self.tp]), None)
+        return {self.tp: None if offset is None else SimpleNamespace(offset=offset)}
+
+    def assign(self, partitions):
+        pass
+
+    def seek(self, tp, offset):
+        self.position_at = offset
+
+    def pause(self, tp):
+        pass
+
+    def position(self, tp):
+        return self.position_at
+
+    def poll(self, timeout_ms=0):
+        records = [SimpleNamespace(offset=i, value=self.values[i], headers=[])
+                   for i in range(self.position_at, min(self.position_at + 2, len(self.values)))]
+        self.position_at += len(records)
+        return {self.tp: records} if records else {}
+
+
+def test_decode_lines_drops_only_bad_lines():
+    """A chunk is parsed at once; a bad line falls back to per-line parsing"""
+    events, undecodable = EventCodec.decode_lines([b'{"a": 1}', b'[{"a": 2}, {"a": 3}]'])
+    assert [e["a"] for e in events] == [1, 2, 3] and undecodable == 0
+
+    events, undecodable = EventCodec.decode_lines([b'{"a": 1}', b'{not json', b'{"a": 2}'])
+    assert [e["a"] for e in events] == [1, 2] and undecodable == 1
+
+
+def test_file_source_reads_compressed_dumps(tmp_path):
+    """Plain and gzip NDJSON files are read in chunks and progress reaches the end"""
+    plain = tmp_path / "a.ndjson"
+    plain.write_text("\n".join(json.dumps(_event(i)) for i in range(3)) + "\n")
+    packed = tmp_path / "b.ndjson.gz"
+    with gzip.open(packed, "wt") as f:
+        f.write(json.dumps([_event(3), _event(4)]) + "\n\n" + json.dumps(_event(5)) + "\n")
+
+    source = FileSource([str(plain), str(packed)], chunk_size=2)
+    chunks = list(source.chunks())
+
+    assert [len(events) for events, _ in chunks] == [2, 1, 3]
+    assert [e["stream_id"] for events, _ in chunks for e in events] == [f"s-{i}" for i in range(6)]
+    assert source.progress() == 1.0
+
+
+def test_kafka_range_source_stops_at_the_range_end():
+    """Offsets and timestamps bound the range; records past the end are not replayed"""
+    values = [EventCodec.encode([_event(i)]) for i in range(6)]
+    timestamps = [1000 * i for i in range(6)]
+
+    source = KafkaRangeSource(FakeReader(values, timestamps), "ws_incoming", start=1, end=4)
+    replayed = [e["stream_id"] for events, _ in source.chunks() for e in events]
+    assert replayed == ["s-1", "s-2", "s-3"]
+    assert source.progress() == 1.0
+
+    start = datetime.fromtimestamp(2, tz=timezone.utc)
+    source = KafkaRangeSource(FakeReader(values, timestamps), "ws_incoming", start=start)
+    assert [e["stream_id"] for events, _ in source.chunks() for e in events] == ["s-2", "s-3", "s-4", "s-5"]
+
+
+def test_parse_bound():
+    """Digits are offsets, anything else an ISO timestamp in UTC by default"""
+    assert parse_bound("42") == 42
+    assert parse_bound("2025-11-17T00:00:00") == datetime(2025, 11, 17, tzinfo=timezone.utc)
+    assert parse_bound(None) is None
+
+
+def test_replay_geocodes_each_coordinate_once():
+    """Distinct coordinates are looked up once per replay and every sink gets each chunk"""
+    chunks = [
+        [_event(0), _event(1), _event(2, latitude=-7.0)],
+        [_event(3), _event(4, latitude=-7.0), {"stream_id": "broken"}],
+    ]
+    loaded = {"postgres": [], "clickhouse": []}
+    lock = threading.Lock()
+
+    def sink(name):
+        def write(rows):
+            with lock:
+                loaded[name].extend(rows)
+        return write
+
+    with patch("Packages.Enrichment.GeocodingService.reverse_geocode", return_value=ADDRESS) as reverse_geocode, \
+            patch("Packages.Enrichment.GeocodingService.get_cache", return_value=None):
+        stage = EnrichmentStage(KafkaParser.enrich, max_workers=2)
+        replay = Replay(ListSource(chunks), {name: sink(name) for name in loaded}, stage,
+                        Parser.time_to_day_month_year, loaders=2)
+        result = replay.run()
+        replay.shutdown()
+
+    assert reverse_geocode.call_count == 2
+    assert result["read"] == 6 and result["written"] == 5 and result["skipped"] == 1
+    assert result["lookups"] == 2
+    assert replay.event_range() == (datetime(2025, 11, 17, 7, 16, 17, tzinfo=timezone.utc),) * 2
+    for rows in loaded.values():
+        assert sorted(row["stream_id"] for row in rows) == [f"s-{i}" for i in range(5)]
+        assert all(row["city"] == "Jakarta" and row["day_month_year"] == "2025-11-17" for row in rows)
+
+
+@patch("Packages.Query.execute_values")
+def test_postgres_replay_replaces_stored_readings(mock_execute_values):
+    """Replayed rows delete stored copies of the same readings before the insert, in one transaction"""
+    conn = MagicMock(closed=0)
+    cursor = conn.cursor.return_value.__enter__.return_value
+    query = QuerySql(pool=PostgresPool(lambda: conn, reconnect_attempts=1))
+
+    rows = [_event(1), _event(2), _event(1)]
+    query.replace_traffic_data_batch(rows)
+
+    sql, keys = cursor.execute.call_args_list[0].args
+    assert sql.strip().startswith("DELETE FROM traffic_data")
+    assert keys["stream_ids"] == ["s-1", "s-2"]
+    assert len(mock_execute_values.call_args.args[2]) == 2
+    assert conn.commit.call_count == 1
+
+
+@patch("Packages.Query.execute_values", side_effect=ValueError("bad row"))
+def test_postgres_replay_raises_on_a_failed_row(mock_execute_values):
+    """A replay load never falls back to row-by-row writes that would hide a failure"""
+    conn = MagicMock(closed=0)
+    query = QuerySql(pool=PostgresPool(lambda: conn, reconnect_attempts=1))
+    try:
+        query.replace_traffic_data_batch([_event(1), _event(2)])
+        assert False, "expected the failure to be raised"
+    except ValueError:
+        pass
+    assert mock_execute_values.call_count == 1
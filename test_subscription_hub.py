@@ -0,0 +1,96 @@
+"""
+Unit tests for live subscription fan-out with indexed filters
+"""
+import json
+import asyncio
+from unittest.mock import patch
+from Packages.SubscriptionHub import SubscriptionHub, Subscription, COALESCE
+
+
+def _event(stream_id="s-1", city="Jakarta", province="DKI Jakarta", label="Padat",
+           longitude=106.82, latitude=-6.17, total=5):
+    return {"stream_id": stream_id, "city": city, "province": province, "label": label,
+            "longitude": longitude, "latitude": latitude, "total_in_area": total}
+
+
+def _frames(subscription):
+    return json.loads(b"[" + b",".join(subscription.drain()) + b"]")
+
+
+def test_filters_are_matched_through_the_index():
+    """Value filters, bounding boxes and unfiltered subscriptions match correctly"""
+    hub = SubscriptionHub(cell_degrees=0.1)
+    everything = hub.subscribe(Subscription())
+    jakarta = hub.subscribe(Subscription({"city": ["Jakarta", "Bogor"]}))
+    padat_in_bandung = hub.subscribe(Subscription({"city": ["Bandung"], "label": ["Padat"]}))
+    box = hub.subscribe(Subscription(bbox=(106.8, -6.2, 106.9, -6.1)))
+    wide = hub.subscribe(Subscription(bbox=(-180, -90, 180, 90)))
+
+    assert hub.match(_event()) == {everything, jakarta, box, wide}
+    assert hub.match(_event(city="Bandung", longitude=107.6, latitude=-6.9)) == {everything, padat_in_bandung, wide}
+    assert hub.match(_event(city="Bandung", label="Sepi", longitude=107.6)) == {everything, wide}
+
+
+def test_unsubscribe_removes_from_every_index():
+    """A closed subscription stops matching and leaves no index entries behind"""
+    hub = SubscriptionHub()
+    subscription = hub.subscribe(Subscription({"city": ["Jakarta"]}, bbox=(106.8, -6.2, 106.9, -6.1)))
+    hub.unsubscribe(subscription)
+
+    assert hub.match(_event()) == set()
+    assert hub._by_value["city"] == {} and hub._by_cell == {}
+
+
+def test_event_is_encoded_once_for_all_subscribers():
+    """Every matching subscriber shares the same encoded bytes"""
+    hub = SubscriptionHub()
+    subscriptions = [hub.subscribe(Subscription()) for _ in range(50)]
+
+    with patch("Packages.SubscriptionHub.json.dumps", wraps=json.dumps) as dumps:
+        hub.publish([_event(), _event(stream_id="s-2")])
+    assert dumps.call_count == 2
+    assert all(len(s.drain()) == 2 for s in subscriptions)
+
+
+def test_drop_oldest_bounds_the_queue():
+    """A slow subscriber keeps only the newest events"""
+    hub = SubscriptionHub()
+    slow = hub.subscribe(Subscription(max_queue=3))
+    hub.publish([_event(total=i) for i in range(10)])
+
+    assert [e["total_in_area"] for e in _frames(slow)] == [7, 8, 9]
+    assert slow.dropped == 7
+
+
+def test_coalesce_keeps_latest_per_stream():
+    """Coalescing replaces a pending event with the newer one for the same stream"""
+    hub = SubscriptionHub()
+    subscription = hub.subscribe(Subscription(policy=COALESCE))
+    hub.publish([_event("a", total=1), _event("b", total=2), _event("a", total=3)])
+
+    assert [(e["stream_id"], e["total_in_area"]) for e in _frames(subscription)] == [("a", 3), ("b", 2)]
+
+
+def test_next_frame_batches_pending_events():
+    """Pending events are sent as one JSON array frame"""
+    async def scenario():
+        hub = SubscriptionHub()
+        subscription = hub.subscribe(Subscription())
+        waiter = asyncio.create_task(subscription.next_frame())
+        await asyncio.sleep(0)
+        hub.publish([_event("a"), _event("b")])
+        return json.loads(await asyncio.wait_for(waiter, 1))
+
+    assert [e["stream_id"] for e in asyncio.run(scenario())] == ["a", "b"]
+
+
+def test_matching_scales_with_matches():
+    """Thousands of filtered subscribers are matched without visiting each one"""
+    hub = SubscriptionHub()
+    for i in range(5000):
+        hub.subscribe(Subscription({"city": [f"city-{i}"]}))
+    target = hub.subscribe(Subscription({"city": ["Jakarta"]}))
+
+    with patch.object(Subscription, "contains") as contains:
+        assert hub.match(_event()) == {target}
+    contains.assert_not_called()
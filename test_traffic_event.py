@@ -0,0 +1,77 @@
+"""
+Unit tests for the typed traffic event record
+"""
+from Packages.TrafficEvent import TrafficEvent, InvalidEvent, FIELDS
+from Packages.Query import QuerySql
+from Packages.Parser import KafkaParser
+
+
+SAMPLE = {
+    "timestamp": "2025-11-17 14:16:17+0700",
+    "stream_id": "96151250-abcb-408e-b25f-2fb4e82ea4a7",
+    "location": "Simpang MORATA",
+    "longitude": 106.913354,
+    "latitude": -6,
+    "total_in_area": 4,
+    "estimated_max_people": 10.0,
+    "label": "Normal",
+    "type": "TC"
+}
+
+
+def _rejects(data, message):
+    try:
+        TrafficEvent.from_dict(data)
+    except InvalidEvent as e:
+        assert message in str(e)
+        return
+    assert False, f"expected InvalidEvent for {data!r}"
+
+
+def test_fields_follow_config():
+    """The record has exactly the Config.json fields, in column order"""
+    assert FIELDS == tuple(QuerySql.TRAFFIC_DATA_FIELDS)
+    assert TrafficEvent.__slots__ == FIELDS
+    assert not hasattr(TrafficEvent.from_dict(SAMPLE), "__dict__")
+
+
+def test_types_are_validated_and_normalized():
+    """Numbers become floats, integral floats become ints, enrichment fields start empty"""
+    event = TrafficEvent.from_dict(SAMPLE)
+    assert event.latitude == -6.0 and isinstance(event.latitude, float)
+    assert event.estimated_max_people == 10 and isinstance(event.estimated_max_people, int)
+    assert event.city is None and event.fulladdress is None
+
+
+def test_missing_and_mistyped_fields_are_rejected():
+    """A missing required field or a wrong type fails in the same pass"""
+    _rejects({k: v for k, v in SAMPLE.items() if k != "stream_id"}, "stream_id")
+    _rejects(dict(SAMPLE, longitude="east"), "longitude")
+    _rejects(dict(SAMPLE, total_in_area=True), "total_in_area")
+    _rejects(dict(SAMPLE, total_in_area=4.5), "total_in_area")
+    _rejects(["not", "an", "object"], "event object")
+
+
+def test_numeric_strings_are_coerced():
+    """Quoted numbers are read as numbers; integer fields only take integral ones"""
+    event = TrafficEvent.from_dict(dict(SAMPLE, longitude=" 106.9", total_in_area="4", estimated_max_people="10.0"))
+    assert event.longitude == 106.9
+    assert event.total_in_area == 4 and isinstance(event.total_in_area, int)
+    assert event.estimated_max_people == 10 and isinstance(event.estimated_max_people, int)
+
+    _rejects(dict(SAMPLE, total_in_area="4.5"), "total_in_area")
+    _rejects(dict(SAMPLE, estimated_max_people="ten"), "estimated_max_people")
+    _rejects(dict(SAMPLE, latitude="nan"), "latitude")
+
+
+def test_enriched_event_hands_sinks_a_column_ordered_row():
+    """After enrichment the row matches the INSERT column order"""
+    event = KafkaParser.enrich(
+        TrafficEvent.from_dict(SAMPLE),
+        {"city": "Jakarta Utara", "province": "DKI Jakarta", "fulladdress": "Jl. Example"}
+    )
+    row = QuerySql.__new__(QuerySql)._row(event)
+
+    expected = dict(SAMPLE, latitude=-6.0, estimated_max_people=10, day_month_year="2025-11-17",
+                    city="Jakarta Utara", province="DKI Jakarta", fulladdress="Jl. Example")
+    assert row == tuple(expected[field] for field in QuerySql.TRAFFIC_DATA_FIELDS)
@@ -0,0 +1,210 @@
+"""
+Unit tests for in-stream tumbling/sliding window rollups
+"""
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from kafka.structs import TopicPartition
+from Packages.WindowAggregator import WindowAggregator, parse_windows
+from Packages.BatchWriter import BatchWriter
+from Packages.Query import QuerySql
+from Packages.PostgresService import PostgresPool
+from Packages.Parser import KafkaParser
+
+
+def _event(second, stream_id="s-1", total=10, capacity=20, label="Sepi", city="Jakarta"):
+    return {
+        "timestamp": f"2025-11-17T07:{second // 60:02d}:{second % 60:02d}+00:00",
+        "stream_id": stream_id,
+        "location": f"loc-{stream_id}",
+        "city": city,
+        "total_in_area": total,
+        "estimated_max_people": capacity,
+        "label": label,
+    }
+
+
+def _message(offset, partition=0):
+    return SimpleNamespace(topic="ws_incoming", partition=partition, offset=offset)
+
+
+def _by_key(rows, dimension):
+    return {(row["window_start"].minute, row["window_start"].second, row["key"]): row
+            for row in rows if row["dimension"] == dimension}
+
+
+def test_parse_windows():
+    """Entries are sizes in seconds with an optional slide; bad specs are rejected"""
+    assert parse_windows("60, 300:60") == [(60, 60), (300, 60)]
+    assert parse_windows("") == []
+    try:
+        parse_windows("300:70")
+        assert False, "slide must divide the window size"
+    except ValueError:
+        pass
+
+
+def test_tumbling_window_aggregates():
+    """Count, sum/avg/max, occupancy and label histogram are kept per key"""
+    aggregator = WindowAggregator([(60, 60)], allowed_lateness=0)
+    aggregator.add(_event(1, total=10, capacity=20, label="Sepi"))
+    aggregator.add(_event(30, total=30, capacity=20, label="Ramai"))
+    aggregator.add(_event(45, stream_id="s-2", total=5, capacity=10, label="Sepi"))
+    assert aggregator.close() == []
+
+    # An event in the next window moves the watermark past the first one
+    aggregator.add(_event(61))
+    rows = aggregator.close()
+
+    streams = _by_key(rows, "stream_id")
+    first = streams[(0, 0, "s-1")]
+    assert first["event_count"] == 2
+    assert first["sum_total_in_area"] == 40
+    assert first["avg_total_in_area"] == 20
+    assert first["max_total_in_area"] == 30
+    assert first["occupancy_ratio"] == 1.0
+    assert first["label_counts"] == {"Sepi": 1, "Ramai": 1}
+    assert first["window_seconds"] == 60
+
+    city = _by_key(rows, "city")[(0, 0, "Jakarta")]
+    assert city["event_count"] == 3
+    assert city["sum_total_in_area"] == 45
+    assert len(_by_key(rows, "location")) == 2
+
+
+def test_sliding_windows_overlap():
+    """Every event lands in size / slide overlapping windows"""
+    aggregator = WindowAggregator([(120, 60)], dimensions=["stream_id"], allowed_lateness=0)
+    aggregator.add(_event(70))
+    rows = aggregator.close(final=True)
+
+    assert sorted(row["window_start"].minute for row in rows) == [0, 1]
+    assert all(row["event_count"] == 1 for row in rows)
+
+
+def test_late_events_within_lateness_are_kept():
+    """The watermark trails the newest event so slightly late events still count"""
+    aggregator = WindowAggregator([(60, 60)], dimensions=["stream_id"], allowed_lateness=10)
+    aggregator.add(_event(55))
+    aggregator.add(_event(65))
+    assert aggregator.add(_event(58))
+    assert aggregator.close() == []
+
+    aggregator.add(_event(75))
+    rows = aggregator.close()
+    assert [row["event_count"] for row in rows] == [2]
+
+    # The first window has closed; events for it are dropped and counted
+    assert not aggregator.add(_event(59))
+    assert aggregator.stats()["late_events"] == 1
+
+
+def test_idle_stream_closes_windows():
+    """Without new events the watermark catches up after allowed_lateness of wall time"""
+    aggregator = WindowAggregator([(60, 60)], dimensions=["stream_id"], allowed_lateness=5)
+    with patch("Packages.WindowAggregator.time.monotonic", return_value=100.0):
+        aggregator.add(_event(10))
+        aggregator.add(_event(62))
+    with patch("Packages.WindowAggregator.time.monotonic", return_value=110.0):
+        rows = aggregator.close()
+    assert [row["window_start"].minute for row in rows] == [0]
+
+
+def test_unparseable_events_are_counted():
+    """Events without a usable timestamp are skipped"""
+    aggregator = WindowAggregator([(60, 60)])
+    assert not aggregator.add({"timestamp": "not a time", "total_in_area": 1})
+    assert aggregator.stats()["invalid_events"] == 1
+    assert aggregator.close(final=True) == []
+
+
+def test_insert_rollup_batch_upserts_rows():
+    """Closed windows are written with one upsert statement"""
+    mock_conn = MagicMock(closed=0)
+    service = QuerySql(pool=PostgresPool(lambda: mock_conn, reconnect_attempts=1))
+    aggregator = WindowAggregator([(60, 60)], dimensions=["stream_id"])
+    aggregator.add(_event(1))
+
+    with patch("Packages.Query.execute_values") as mock_execute_values:
+        service.insert_rollup_batch(aggregator.close(final=True))
+
+    query, values = mock_execute_values.call_args[0][1:3]
+    assert "ON CONFLICT (dimension, key, window_seconds, slide_seconds, window_start, source_partition)" in query
+    assert len(values) == 1
+    mock_conn.commit.assert_called_once()
+
+
+def test_rebuilt_windows_replace_their_row():
+    """Rows are kept per source partition and a re-emitted window replaces its row"""
+    mock_conn = MagicMock(closed=0)
+    service = QuerySql(pool=PostgresPool(lambda: mock_conn, reconnect_attempts=1))
+    aggregator = WindowAggregator([(60, 60)], dimensions=["city"])
+    aggregator.add(_event(5, stream_id="s-1", total=10), _message(0, partition=0))
+    aggregator.add(_event(6, stream_id="s-2", total=30), _message(0, partition=1))
+    rows = aggregator.close(final=True)
+
+    assert sorted((row["source_partition"], row["sum_total_in_area"]) for row in rows) == [(0, 10), (1, 30)]
+
+    with patch("Packages.Query.execute_values") as mock_execute_values:
+        service.insert_rollup_batch(rows)
+
+    query = mock_execute_values.call_args.args[1]
+    assert "event_count = EXCLUDED.event_count" in query
+    assert "label_counts = EXCLUDED.label_counts" in query
+    assert "WHERE traffic_rollup.event_count <= EXCLUDED.event_count" in query
+    assert "traffic_rollup.event_count + EXCLUDED.event_count" not in query
+
+
+def test_lagging_partition_holds_the_watermark():
+    """The watermark is the lowest partition watermark, so a partition catching up is not late"""
+    aggregator = WindowAggregator([(60, 60)], dimensions=["stream_id"], allowed_lateness=5)
+    with patch("Packages.WindowAggregator.time.monotonic", return_value=100.0):
+        aggregator.assign([("ws_incoming", 0), ("ws_incoming", 1)])
+        aggregator.add(_event(200), _message(50, partition=0))
+        assert aggregator.close() == []
+
+        # Partition 1 is still minutes behind; its events are kept
+        assert aggregator.add(_event(10, stream_id="s-2"), _message(3, partition=1))
+        aggregator.add(_event(130, stream_id="s-2"), _message(4, partition=1))
+        rows = aggregator.close()
+    assert [row["window_start"].minute for row in rows] == [0]
+    assert aggregator.stats()["late_events"] == 0
+
+    # Once partition 1 goes quiet it stops holding the watermark back
+    with patch("Packages.WindowAggregator.time.monotonic", return_value=110.0):
+        assert [row["window_start"].minute for row in aggregator.close()] == [2]
+
+
+def test_offsets_are_held_until_window_rows_land():
+    """Commits stop at the first record of a window that is open or whose rows have not landed"""
+    aggregator = WindowAggregator([(60, 60)], dimensions=["stream_id"], allowed_lateness=0)
+    aggregator.add(_event(10), _message(7))
+    aggregator.add(_event(20), _message(8))
+    assert aggregator.held() == {("ws_incoming", 0): 7}
+
+    aggregator.add(_event(70), _message(9))
+    assert aggregator.close()
+    assert aggregator.marker().offset == 0
+    # The closed window is written by the rollup writer in the background
+    assert aggregator.held(landed=0) == {("ws_incoming", 0): 7}
+    assert aggregator.held(landed=1) == {("ws_incoming", 0): 9}
+
+    # A partial window closed at shutdown stays held for the next owner
+    aggregator.close(final=True)
+    assert aggregator.held(landed=2) == {("ws_incoming", 0): 9}
+
+    aggregator.forget([("ws_incoming", 0)])
+    assert aggregator.held(landed=2) == {}
+
+
+def test_held_commits_carry_the_written_offset():
+    """A held partition commits the held offset; the written one comes back as metadata on assignment"""
+    commit = BatchWriter.to_commit({("ws_incoming", 0): 20, ("ws_incoming", 1): 5}, {("ws_incoming", 0): 12})
+    assert commit[TopicPartition("ws_incoming", 0)].offset == 12
+    assert commit[TopicPartition("ws_incoming", 0)].metadata == "20"
+    assert commit[TopicPartition("ws_incoming", 1)].offset == 5
+    assert commit[TopicPartition("ws_incoming", 1)].metadata is None
+
+    consumer = MagicMock()
+    consumer.committed.side_effect = [commit[TopicPartition("ws_incoming", 0)], commit[TopicPartition("ws_incoming", 1)], None]
+    partitions = [TopicPartition("ws_incoming", 0), TopicPartition("ws_incoming", 1), TopicPartition("ws_incoming", 2)]
+    assert KafkaParser.written_offsets(consumer, partitions) == {("ws_incoming", 0): 20}
@@ -0,0 +1,108 @@
+"""
+Unit tests for the supervised multi-process consumer pool
+"""
+import os
+import time
+import signal
+import tempfile
+from Packages.WorkerPool import WorkerPool, child_stop_event
+from Worker import parse_args
+
+
+def _flaky_consumer(index, path, group_id, stop_event):
+    """Crashes on its first start, then runs until asked to stop"""
+    with open(path, "a") as f:
+        f.write(f"{index}\n")
+    with open(path) as f:
+        starts = f.read().split().count(str(index))
+    if starts == 1:
+        os._exit(3)
+    stop_event.wait(10)
+
+
+def _signalled_consumer(index, path, group_id, pool_stop):
+    """Runs until its own stop event is set, then records that it drained"""
+    child_stop_event(pool_stop).wait(30)
+    with open(path, "a") as f:
+        f.write(f"{index}\n")
+
+
+def _stuck_consumer(index, path, group_id, pool_stop):
+    """Never finishes draining, like a flush that cannot reach its sink"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_crashed_worker_is_restarted_and_drains_on_stop():
+    """A child that crashes is started again, and all children exit once stopped"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "starts.txt")
+        pool = WorkerPool(path, "test-group", workers=2, target=_flaky_consumer)
+        for index in range(2):
+            pool._spawn(index)
+
+        assert _wait_for(lambda: all(not p.is_alive() for p, _ in pool.processes.values()))
+        assert _wait_for(lambda: (pool._check(), all(p.is_alive() for p, _ in pool.processes.values()))[1])
+
+
+        def starts():
+            with open(path) as f:
+                return sorted(f.read().split())
+        assert _wait_for(lambda: starts() == ["0", "0", "1", "1"])
+
+        pool.stop()
+        for process, _ in pool.processes.values():
+            process.join(5)
+            assert process.exitcode == 0
+
+
+def test_cli_topic_group_and_workers():
+    """Topic, group and worker count come from the command line"""
+    args = parse_args(["--workers", "4", "--topic", "replayed", "--group-id", "rebuild"])
+    assert (args.mode, args.workers, args.topic, args.group_id) == ("consumer", 4, "replayed", "rebuild")
+
+
+def test_sigterm_to_one_child_leaves_the_others_running():
+    """A child's SIGTERM sets only its own stop event, not the pool's"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "drained.txt")
+        open(path, "w").close()
+        pool = WorkerPool(path, "test-group", workers=2, target=_signalled_consumer)
+        for index in range(2):
+            pool._spawn(index)
+        time.sleep(0.5)
+
+        first, _ = pool.processes[0]
+        second, _ = pool.processes[1]
+        os.kill(first.pid, signal.SIGTERM)
+        first.join(5)
+        assert first.exitcode == 0
+        assert second.is_alive() and not pool.stop_event.is_set()
+
+        pool.stop()
+        second.join(5)
+        with open(path) as f:
+            assert sorted(f.read().split()) == ["0", "1"]
+
+
+def test_drain_kills_children_that_do_not_exit():
+    """A child stuck past drain_timeout is killed instead of hanging the supervisor"""
+    pool = WorkerPool("unused", "test-group", workers=1, drain_timeout=0.5, target=_stuck_consumer)
+    pool._spawn(0)
+    time.sleep(0.2)
+    pool.stop()
+
+    started = time.monotonic()
+    pool.drain()
+    process, _ = pool.processes[0]
+    assert time.monotonic() - started < 10
+    assert not process.is_alive()